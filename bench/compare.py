@@ -0,0 +1,55 @@
+import argparse
+import json
+import sys
+
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def change(base, new):
+    if not base or new is None:
+        return None
+    return (new - base) / base * 100
+
+
+def compare(base: dict, new: dict, threshold: float):
+    """Yield (route, metric, base, new, % change, regressed) for routes in both runs"""
+    for route, before in base["routes"].items():
+        after = new["routes"].get(route)
+        if after is None:
+            continue
+        for key in LATENCY_KEYS:
+            delta = change(before.get(key), after.get(key))
+            yield route, key, before.get(key), after.get(key), delta, delta is not None and delta > threshold
+        delta = change(before.get("throughput_rps"), after.get("throughput_rps"))
+        yield (route, "throughput_rps", before.get("throughput_rps"), after.get("throughput_rps"),
+               delta, delta is not None and delta < -threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two bench.run result files")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percent change in latency or throughput counted as a regression")
+    args = parser.parse_args()
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"base {base['meta'].get('commit') or '?'}  new {new['meta'].get('commit') or '?'}")
+    for key in ("mode", "workers", "concurrency", "preload", "users", "smtp_latency_ms", "sms_latency_ms"):
+        if base["meta"].get(key) != new["meta"].get(key):
+            print(f"warning: runs differ in {key}: {base['meta'].get(key)} vs {new['meta'].get(key)}")
+    regressions = 0
+    for route, key, before, after, delta, regressed in compare(base, new, args.threshold):
+        regressions += regressed
+        delta_text = f"{delta:+.1f}%" if delta is not None else "-"
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{route:<45} {key:<15} {before!s:>10} -> {after!s:>10} {delta_text:>8}{flag}")
+    print(f"{regressions} regression(s) beyond {args.threshold}%")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
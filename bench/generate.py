@@ -0,0 +1,109 @@
+from typing import Dict, Iterator, Optional
+import argparse
+import json
+import random
+import sys
+
+# Relative frequency of each route in generated traffic. Entries with a
+# "capture" put a field of their response into a named pool; paths with
+# {pool} placeholders are filled from those pools when replayed.
+ROUTE_WEIGHTS = {
+    "POST /email/send_email": 10,
+    "POST /email/batch": 1,
+    "GET /email/batch/{batch_id}": 1,
+    "GET /email/users/{user_id}/notifications": 10,
+    "POST /sms/send": 10,
+    "POST /sms/batch": 1,
+    "GET /sms/batch/{batch_id}": 1,
+    "GET /sms/logs/{user_id}": 10,
+    "POST /inapp/create": 15,
+    "POST /inapp/batch": 1,
+    "GET /inapp/batch/{batch_id}": 1,
+    "GET /inapp/user/{user_id}": 15,
+    "GET /inapp/user/{user_id}/summary": 10,
+    "PUT /inapp/{notification_id}/mark-read": 5,
+    "PUT /inapp/user/{user_id}/mark-all-read": 2,
+    "DELETE /inapp/{notification_id}": 2,
+}
+
+
+def _email(user_id: int, rng: random.Random) -> dict:
+    return {
+        "user_id": user_id,
+        "email": f"user{user_id}@example.com",
+        "subject": "Your order has shipped",
+        "body": f"<p>Order #{rng.randint(1000, 99999)} is on its way.</p>",
+    }
+
+
+def _sms(user_id: int, rng: random.Random) -> dict:
+    return {"user_id": user_id, "to": f"+1555{user_id:07d}", "body": f"Your code is {rng.randint(100000, 999999)}"}
+
+
+def _inapp(user_id: int, rng: random.Random) -> dict:
+    return {
+        "user_id": user_id,
+        "title": "New comment",
+        "message": f"Someone replied to your post #{rng.randint(1, 10000)}",
+        "notification_type": rng.choice(["info", "success", "warning", "error"]),
+    }
+
+
+def make_request(route: str, user_id: int, users: int, rng: random.Random, batch_size: int) -> dict:
+    method, template = route.split(" ", 1)
+    entry = {"route": route, "method": method, "path": template.replace("{user_id}", str(user_id))}
+    channel = template.split("/")[1]
+    body = {"email": _email, "sms": _sms, "inapp": _inapp}[channel]
+    if template.endswith("/batch"):
+        entry["json"] = [body(rng.randint(1, users), rng) for _ in range(batch_size)]
+        entry["capture"] = [f"{channel}_batch", "batch_id"]
+    elif method == "POST":
+        entry["json"] = body(user_id, rng)
+        entry["capture"] = [channel, "notification_id" if channel == "email" else "id"]
+    if "{batch_id}" in template:
+        entry["path"] = template.replace("{batch_id}", f"{{{channel}_batch}}")
+    if "{notification_id}" in template:
+        entry["path"] = template.replace("{notification_id}", "{inapp}")
+    return entry
+
+
+def generate(count: int, users: int, seed: Optional[int] = None, batch_size: int = 20,
+             weights: Dict[str, int] = ROUTE_WEIGHTS) -> Iterator[dict]:
+    """Yield count synthetic requests over users 1..users in the given route mix"""
+    rng = random.Random(seed)
+    routes = list(weights)
+    route_weights = [weights[r] for r in routes]
+    for _ in range(count):
+        route = rng.choices(routes, weights=route_weights)[0]
+        yield make_request(route, rng.randint(1, users), users, rng, batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic notification API traffic as JSONL")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--routes", help="comma-separated subset of routes to generate, e.g. 'POST /sms/send'")
+    parser.add_argument("--output", default="-", help="file to write, or - for stdout")
+    args = parser.parse_args()
+
+    weights = ROUTE_WEIGHTS
+    if args.routes:
+        wanted = [r.strip() for r in args.routes.split(",")]
+        unknown = [r for r in wanted if r not in ROUTE_WEIGHTS]
+        if unknown:
+            parser.error(f"Unknown routes: {', '.join(unknown)}")
+        weights = {r: ROUTE_WEIGHTS[r] for r in wanted}
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        for entry in generate(args.requests, args.users, args.seed, args.batch_size, weights):
+            out.write(json.dumps(entry) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+import argparse
+import os
+import time
+import uuid
+
+CHANNELS = ("email", "sms", "inapp")
+CHUNK_SIZE = 20000
+
+
+def _rows(channel: str, start: int, count: int, users: int, now: datetime):
+    rows = []
+    for n in range(start, start + count):
+        user_id = n % users + 1
+        created_at = now - timedelta(seconds=n)
+        if channel == "email":
+            rows.append({
+                "id": uuid.uuid4().hex, "user_id": user_id, "email_to": f"user{user_id}@example.com",
+                "subject": "Weekly summary", "body": f"<p>Summary #{n}</p>", "sent": True,
+                "status": "sent", "digest_id": None, "created_at": created_at,
+            })
+        elif channel == "sms":
+            rows.append({
+                "id": uuid.uuid4().hex, "user_id": user_id, "to": f"+1555{user_id:07d}",
+                "body": f"Your code is {n % 1000000:06d}", "sid": f"FAKE{n}", "status": "sent",
+                "error": None, "attempts": 1, "digest_id": None, "created_at": created_at,
+            })
+        else:
+            rows.append({
+                "id": uuid.uuid4().hex, "user_id": user_id, "title": "New comment",
+                "message": f"Someone replied to your post #{n}", "notification_type": "info",
+                "link": None, "read": n % 3 == 0, "created_at": created_at,
+            })
+    return rows
+
+
+def preload(count: int, users: int, channels=CHANNELS, progress: bool = True):
+    """Bulk-insert count notifications, split evenly over channels and users.
+
+    Uses the database configured by DATABASE_URL, which must be set before
+    this is called.
+    """
+    from sqlalchemy import insert
+
+    from database.database import SessionLocal, init_db
+    from database.models import EmailNotification, InAppNotification, SMSLog
+
+    models = {"email": EmailNotification, "sms": SMSLog, "inapp": InAppNotification}
+    init_db()
+    now = datetime.now()
+    per_channel = count // len(channels)
+    for channel in channels:
+        started = time.perf_counter()
+        for start in range(0, per_channel, CHUNK_SIZE):
+            rows = _rows(channel, start, min(CHUNK_SIZE, per_channel - start), users, now)
+            with SessionLocal() as session:
+                session.execute(insert(models[channel]), rows)
+                session.commit()
+        if progress:
+            print(f"preloaded {per_channel} {channel} records in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a benchmark database with stored notifications")
+    parser.add_argument("--db", required=True, help="SQLite file to fill")
+    parser.add_argument("--count", type=int, required=True, help="total records, e.g. 1000 to 10000000")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--channels", default=",".join(CHANNELS))
+    args = parser.parse_args()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+    preload(args.count, args.users, [c.strip() for c in args.channels.split(",")])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench.generate import generate
+from bench.preload import CHANNELS, preload
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+ID_SEGMENT = re.compile(r"/(\d+|[0-9a-f]{8}-[0-9a-f-]{27}|[0-9a-f]{32})(?=/|$)")
+
+
+def route_of(entry: dict) -> str:
+    """Route template of a request, used to group its latency"""
+    if "route" in entry:
+        return entry["route"]
+    return f"{entry['method']} {ID_SEGMENT.sub('/{id}', entry['path'].split('?')[0])}"
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+class Replay:
+    """Sends recorded requests with a fixed number of concurrent clients.
+
+    Ids returned by create calls are kept in named pools so that later
+    requests addressing {pool} placeholders hit real records.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, concurrency: int):
+        self.client = client
+        self.concurrency = concurrency
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.errors: Counter = Counter()
+        self.skipped: Counter = Counter()
+        self.pools: Dict[str, List[str]] = defaultdict(list)
+        self.elapsed = 0.0
+
+    async def run(self, entries: Iterable[dict], record: bool = True):
+        entries = iter(entries)
+        started = time.perf_counter()
+        await asyncio.gather(*(self._client(entries, record) for _ in range(self.concurrency)))
+        if record:
+            self.elapsed += time.perf_counter() - started
+
+    def _fill(self, entry: dict) -> Optional[str]:
+        path = entry["path"]
+        for name in PLACEHOLDER.findall(path):
+            pool = self.pools.get(name)
+            if not pool:
+                return None
+            if entry["method"] == "DELETE":
+                value = pool.pop(random.randrange(len(pool)))
+            else:
+                value = random.choice(pool)
+            path = path.replace(f"{{{name}}}", value)
+        return path
+
+    async def _client(self, entries, record: bool):
+        for entry in entries:
+            route = route_of(entry)
+            path = self._fill(entry)
+            if path is None:
+                self.skipped[route] += record
+                continue
+            started = time.perf_counter()
+            try:
+                response = await self.client.request(
+                    entry["method"], path, json=entry.get("json"), headers=entry.get("headers")
+                )
+            except httpx.HTTPError:
+                self.errors[route] += record
+                continue
+            latency = time.perf_counter() - started
+            if "capture" in entry and response.status_code < 300:
+                pool, field = entry["capture"]
+                value = response.json().get(field)
+                if value is not None:
+                    self.pools[pool].append(value)
+            if record:
+                self.latencies[route].append(latency)
+                self.statuses[route][response.status_code] += 1
+                if response.status_code >= 500:
+                    self.errors[route] += 1
+
+    def summary(self) -> dict:
+        routes = {}
+        total = 0
+        for route in sorted(set(self.latencies) | set(self.errors) | set(self.skipped)):
+            ordered = sorted(self.latencies.get(route, []))
+            total += len(ordered)
+            routes[route] = {
+                "requests": len(ordered),
+                "errors": self.errors[route],
+                "skipped": self.skipped[route],
+                "statuses": {str(k): v for k, v in sorted(self.statuses[route].items())},
+                "throughput_rps": round(len(ordered) / self.elapsed, 2) if self.elapsed else None,
+            }
+            if ordered:
+                routes[route].update({
+                    "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+                    "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+                    "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+                    "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+                    "max_ms": round(ordered[-1] * 1000, 3),
+                })
+        return {
+            "requests": total,
+            "elapsed_s": round(self.elapsed, 3),
+            "throughput_rps": round(total / self.elapsed, 2) if self.elapsed else None,
+            "routes": routes,
+        }
+
+
+def load_traffic(args) -> List[dict]:
+    if args.traffic:
+        with open(args.traffic) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    return list(generate(args.requests, args.users, args.seed, args.batch_size))
+
+
+def app_env(args) -> Dict[str, str]:
+    return {
+        "DATABASE_URL": f"sqlite:///{os.path.abspath(args.db)}",
+        "MAIL_TRANSPORT": "fake",
+        "MAIL_FAKE_LATENCY_MS": str(args.smtp_latency_ms),
+        "MAIL_FAKE_ERROR_RATE": str(args.smtp_error_rate),
+        "SMS_TRANSPORT": "fake",
+        "SMS_FAKE_LATENCY_MS": str(args.sms_latency_ms),
+        "SMS_FAKE_ERROR_RATE": str(args.sms_error_rate),
+    }
+
+
+async def replay_asgi(args, traffic: List[dict]) -> Replay:
+    """Drive main:app in this process through httpx's ASGI transport"""
+    os.environ.update(app_env(args))
+    sys.path.insert(0, ROOT)
+    from main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+            return await _replay(client, args, traffic)
+
+
+async def replay_uvicorn(args, traffic: List[dict]) -> Replay:
+    """Drive main:app served by a uvicorn subprocess over real sockets"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT,
+        env={**os.environ, **app_env(args)},
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout, limits=limits) as client:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    await client.get("/health")
+                    break
+                except httpx.TransportError:
+                    if time.monotonic() > deadline or server.poll() is not None:
+                        raise RuntimeError("uvicorn did not start")
+                    await asyncio.sleep(0.1)
+            return await _replay(client, args, traffic)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+async def _replay(client: httpx.AsyncClient, args, traffic: List[dict]) -> Replay:
+    replay = Replay(client, args.concurrency)
+    await replay.run(traffic[:args.warmup], record=False)
+    await replay.run(traffic[args.warmup:])
+    return replay
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results: dict):
+    print(f"{'route':<45} {'req':>7} {'err':>5} {'rps':>9} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for route, r in results["routes"].items():
+        print(f"{route:<45} {r['requests']:>7} {r['errors']:>5} {r['throughput_rps'] or 0:>9} "
+              f"{r.get('p50_ms', '-'):>8} {r.get('p95_ms', '-'):>8} {r.get('p99_ms', '-'):>8}")
+    print(f"total: {results['requests']} requests in {results['elapsed_s']}s = {results['throughput_rps']} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay JSONL traffic against main:app and report per-route latency")
+    parser.add_argument("--traffic", help="JSONL file from bench.generate; generated on the fly if omitted")
+    parser.add_argument("--requests", type=int, default=10000, help="requests to generate without --traffic")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mode", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=0, help="leading requests to send but not measure")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--preload", type=int, default=0, help="stored notifications to create first, 1000 to 10000000")
+    parser.add_argument("--db", help="SQLite file to use; a fresh temporary file by default")
+    parser.add_argument("--reuse-db", action="store_true", help="keep the existing contents of --db")
+    parser.add_argument("--smtp-latency-ms", type=float, default=0)
+    parser.add_argument("--smtp-error-rate", type=float, default=0)
+    parser.add_argument("--sms-latency-ms", type=float, default=0)
+    parser.add_argument("--sms-error-rate", type=float, default=0)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.db is None:
+        args.db = os.path.join(tempfile.mkdtemp(prefix="notification-bench-"), "bench.db")
+    elif not args.reuse_db:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    traffic = load_traffic(args)
+    if args.preload:
+        os.environ["DATABASE_URL"] = app_env(args)["DATABASE_URL"]
+        sys.path.insert(0, ROOT)
+        preload(args.preload, args.users, CHANNELS)
+
+    runner = replay_asgi if args.mode == "asgi" else replay_uvicorn
+    replay = asyncio.run(runner(args, traffic))
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "mode": args.mode,
+            "workers": args.workers if args.mode == "uvicorn" else 1,
+            "concurrency": args.concurrency,
+            "preload": args.preload,
+            "users": args.users,
+            "traffic": args.traffic,
+            "smtp_latency_ms": args.smtp_latency_ms,
+            "smtp_error_rate": args.smtp_error_rate,
+            "sms_latency_ms": args.sms_latency_ms,
+            "sms_error_rate": args.sms_error_rate,
+        },
+        **replay.summary(),
+    }
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+from typing import Type
+import os
+
+from database.changes import ChangeFeed
+from database.persistence import SQLPersistence
+from database.records import CompactRecord
+from database.store import RecordStore
+
+NOTIFICATION_BACKEND = os.getenv("NOTIFICATION_BACKEND", "sqlite")
+if NOTIFICATION_BACKEND not in ("memory", "sqlite"):
+    raise ValueError(f"NOTIFICATION_BACKEND must be 'memory' or 'sqlite', not '{NOTIFICATION_BACKEND}'")
+
+# Whether anything (records, scheduled jobs, templates) is written to the database
+PERSISTENT = NOTIFICATION_BACKEND == "sqlite"
+
+change_feed = ChangeFeed(enabled=PERSISTENT)
+
+
+def create_store(record_type: Type[CompactRecord], model, topic: str, store_class=RecordStore,
+                 iso_dates: bool = False) -> RecordStore:
+    """Build a channel's store for the configured NOTIFICATION_BACKEND.
+
+    memory keeps records, scheduled jobs and templates in this process
+    only: fastest, but for a single worker, and nothing survives a restart.
+    sqlite writes them behind to the shared SQLite WAL database through
+    SQLPersistence and keeps every worker's in-memory view coherent through
+    the change feed, so the app can run under uvicorn --workers N. A record
+    created by one worker becomes visible to the others once its write
+    batch commits (WRITE_BATCH_DELAY_MS) and, for lists and counts, once
+    their next poll of the feed runs (CHANGE_POLL_INTERVAL_MS); until then a
+    lookup of it by id on another worker finds nothing. Another shared
+    backend only needs an object with SQLPersistence's methods.
+    """
+    if not PERSISTENT:
+        return store_class(record_type)
+    return store_class(record_type, SQLPersistence(model, iso_dates=iso_dates), feed=change_feed, topic=topic)
@@ -0,0 +1,158 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import delete, func, select
+from typing import Callable, Dict, Optional
+import asyncio
+import json
+import os
+import uuid
+
+from database.database import SessionLocal
+from database.models import ChangeLog
+from database.persistence import WriteBehindQueue, writer
+
+CHANGE_POLL_INTERVAL = float(os.getenv("CHANGE_POLL_INTERVAL_MS", "100")) / 1000
+CHANGE_LOG_RETENTION = float(os.getenv("CHANGE_LOG_RETENTION_SECONDS", "300"))
+CHANGE_POLL_BATCH = 1000
+PRUNE_EVERY_POLLS = 100
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class ChangeFeed:
+    """Cross-process change notification through the shared change_log table.
+
+    Each process appends the changes it makes through the write-behind
+    queue, in order after the data they describe, so a change is never
+    visible before its data. A poller in every process reads entries with
+    a higher sequence number than it has seen and hands each entry of
+    another process to the handler subscribed for its topic as
+    handler(op, user_id, payload); the process's own entries only go to
+    the topic's confirm(user_id) callback, if any, once they are logged.
+    While either runs, last_seq is the entry's sequence number. Entries
+    older than the retention period are pruned.
+
+    Disabled feeds accept publish() calls and do nothing, so single-process
+    backends need no special casing at the call sites.
+    """
+
+    def __init__(self, enabled: bool, write_queue: WriteBehindQueue = writer,
+                 poll_interval: float = CHANGE_POLL_INTERVAL, retention: float = CHANGE_LOG_RETENTION):
+        self.enabled = enabled
+        self.writer = write_queue
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.origin = uuid.uuid4().hex
+        self.received = 0
+        self._handlers: Dict[str, Callable] = {}
+        self._confirms: Dict[str, Callable] = {}
+        self._last_seq = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    def subscribe(self, topic: str, handler: Callable[[str, Optional[int], object], None],
+                  confirm: Optional[Callable[[Optional[int]], None]] = None):
+        self._handlers[topic] = handler
+        if confirm is not None:
+            self._confirms[topic] = confirm
+
+    def latest_seq(self, topic: str, user_id: int) -> int:
+        """Sequence number of the newest logged change of topic for one user.
+
+        For a user whose entries have all been pruned, the number just
+        before the oldest remaining entry stands in. Reads the database, so
+        call it from a worker thread.
+        """
+        with SessionLocal() as session:
+            seq = session.scalar(
+                select(func.max(ChangeLog.seq)).where(ChangeLog.topic == topic, ChangeLog.user_id == user_id)
+            )
+            if seq is None:
+                seq = (session.scalar(select(func.min(ChangeLog.seq))) or 1) - 1
+        return seq
+
+    def publish(self, topic: str, op: str, user_id: Optional[int] = None, payload=None):
+        if not self.enabled:
+            return
+        self.writer.insert(ChangeLog, [{
+            "origin": self.origin,
+            "topic": topic,
+            "op": op,
+            "user_id": user_id,
+            "payload": json.dumps(payload, default=_json_default) if payload is not None else None,
+            "created_at": datetime.now(),
+        }])
+
+    def start(self):
+        """Start following changes made from now on by other processes"""
+        if not self.enabled or self._task is not None:
+            return
+        with SessionLocal() as session:
+            self._last_seq = session.scalar(select(func.max(ChangeLog.seq))) or 0
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        polls = 0
+        while True:
+            try:
+                rows = await asyncio.to_thread(self._read, self._last_seq)
+                for row in rows:
+                    self._last_seq = row[0]
+                    self._dispatch(*row)
+                polls += 1
+                if polls % PRUNE_EVERY_POLLS == 0:
+                    await asyncio.to_thread(self._prune)
+            except Exception as e:
+                print(f"Change feed poll failed: {str(e)}")
+                rows = []
+            if len(rows) < CHANGE_POLL_BATCH:
+                await asyncio.sleep(self.poll_interval)
+
+    def _read(self, after: int):
+        stmt = (
+            select(ChangeLog.seq, ChangeLog.origin, ChangeLog.topic, ChangeLog.op, ChangeLog.user_id, ChangeLog.payload)
+            .where(ChangeLog.seq > after)
+            .order_by(ChangeLog.seq)
+            .limit(CHANGE_POLL_BATCH)
+        )
+        with SessionLocal() as session:
+            return [tuple(row) for row in session.execute(stmt)]
+
+    def _prune(self):
+        cutoff = datetime.now() - timedelta(seconds=self.retention)
+        with SessionLocal() as session:
+            # Keep the newest entry so tables created before seq used
+            # AUTOINCREMENT never restart numbering from 1
+            newest = select(func.max(ChangeLog.seq)).scalar_subquery()
+            session.execute(delete(ChangeLog).where(ChangeLog.created_at < cutoff, ChangeLog.seq < newest))
+            session.commit()
+
+    def _dispatch(self, seq, origin, topic, op, user_id, payload):
+        if origin == self.origin:
+            confirm = self._confirms.get(topic)
+            if confirm is not None:
+                try:
+                    confirm(user_id)
+                except Exception as e:
+                    print(f"Confirming {topic} change {seq} failed: {str(e)}")
+            return
+        handler = self._handlers.get(topic)
+        if handler is None:
+            return
+        self.received += 1
+        try:
+            handler(op, user_id, json.loads(payload) if payload is not None else None)
+        except Exception as e:
+            print(f"Applying {topic} change {seq} failed: {str(e)}")
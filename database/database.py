@@ -1,9 +1,39 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+import os
+import time
 
-DATABASE_URL = "sqlite:///./notifications.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./notifications.db")
 
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers run alongside the write-behind batches, and
+        # synchronous=NORMAL is durable across process crashes in WAL mode
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+def init_db():
+    """Create any missing tables and indexes"""
+    import database.models  # noqa: F401 - registers the models on Base
+    for attempt in range(5):
+        try:
+            Base.metadata.create_all(bind=engine)
+            # create_all skips the indexes of tables that already exist
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(bind=engine, checkfirst=True)
+            return
+        except OperationalError:
+            # Another worker process created the same tables at the same moment
+            if attempt == 4:
+                raise
+            time.sleep(0.1)
@@ -1,14 +1,94 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Index
 from sqlalchemy.sql import func
-from database import Base
+from database.database import Base
 
 class EmailNotification(Base):
     __tablename__ = "email_notifications"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(String, primary_key=True, index=True)
     user_id = Column(Integer, index=True)
     email_to = Column(String, index=True)
     subject = Column(String)
     body = Column(String)
     sent = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    status = Column(String, default="queued")
+    digest_id = Column(String, nullable=True, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (Index("ix_email_notifications_user_created", "user_id", "created_at"),)
+
+class InAppNotification(Base):
+    __tablename__ = "inapp_notifications"
+
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(Integer)
+    title = Column(String)
+    message = Column(String)
+    notification_type = Column(String, default="info")
+    link = Column(String, nullable=True)
+    read = Column(Boolean, default=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_inapp_notifications_user_created", "user_id", "created_at"),
+        Index("ix_inapp_notifications_user_read_created", "user_id", "read", "created_at"),
+    )
+
+class SMSLog(Base):
+    __tablename__ = "sms_logs"
+
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(Integer)
+    to = Column(String)
+    body = Column(String)
+    sid = Column(String, nullable=True)
+    status = Column(String, default="queued")
+    error = Column(String, nullable=True)
+    attempts = Column(Integer, default=0)
+    digest_id = Column(String, nullable=True, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (Index("ix_sms_logs_user_created", "user_id", "created_at"),)
+
+
+class NotificationTemplate(Base):
+    __tablename__ = "notification_templates"
+
+    id = Column(String, primary_key=True, index=True)
+    channel = Column(String, index=True)
+    subject = Column(String, nullable=True)
+    body = Column(String)
+    version = Column(Integer, default=1)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ScheduledJob(Base):
+    __tablename__ = "scheduled_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    channel = Column(String)
+    user_id = Column(Integer, index=True)
+    payload = Column(String, nullable=True)
+    due_at = Column(DateTime(timezone=True))
+    status = Column(String, default="pending")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (Index("ix_scheduled_jobs_status_due", "status", "due_at"),)
+
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    origin = Column(String)
+    topic = Column(String)
+    op = Column(String)
+    user_id = Column(Integer, nullable=True)
+    payload = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+    # AUTOINCREMENT so a seq is never reused after pruning empties the table;
+    # readers follow the log by seq and would skip reused numbers
+    __table_args__ = (
+        Index("ix_change_log_topic_user", "topic", "user_id", "seq"),
+        {"sqlite_autoincrement": True},
+    )
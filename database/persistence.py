@@ -0,0 +1,348 @@
+from sqlalchemy import DateTime, and_, delete, func, insert, or_, select, update
+from sqlalchemy.exc import OperationalError
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import os
+import queue
+import threading
+import time
+
+from database.database import SessionLocal
+from database.records import MICROSECOND, from_micros
+
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "500"))
+WRITE_BATCH_DELAY = float(os.getenv("WRITE_BATCH_DELAY_MS", "50")) / 1000
+WRITE_RETRIES = int(os.getenv("WRITE_RETRIES", "5"))
+
+
+class WriteBehindQueue:
+    """Batches inserts, updates and deletes into single SQLite transactions.
+
+    Callers enqueue operations and return immediately; a background thread
+    drains up to WRITE_BATCH_SIZE operations (waiting at most
+    WRITE_BATCH_DELAY for a batch to fill) and commits them together.
+    Operations are applied in the order they were enqueued.
+
+    A batch that fails with OperationalError (typically "database is
+    locked" while another worker writes) is retried with backoff. If it
+    still fails, or fails for any other reason, its operations are retried
+    one row at a time so a single bad row only loses itself.
+    """
+
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE, max_delay: float = WRITE_BATCH_DELAY,
+                 retries: int = WRITE_RETRIES):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.retries = retries
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, op: str, model, payload):
+        self._ensure_started()
+        self._queue.put((op, model, payload))
+
+    def insert(self, model, rows: List[dict]):
+        self.submit("insert", model, rows)
+
+    def update(self, model, ids: List[str], values: dict):
+        self.submit("update", model, (ids, values))
+
+    def update_where(self, model, user_id: int, where: dict, values: dict):
+        """Update every row of one user whose columns equal where"""
+        self.submit("update_where", model, (user_id, where, values))
+
+    def delete(self, model, ids: List[str]):
+        self.submit("delete", model, ids)
+
+    def delete_before(self, model, user_id: int, cutoff: datetime):
+        """Delete one user's rows created before cutoff"""
+        self.submit("delete_before", model, (user_id, cutoff))
+
+    def flush(self):
+        """Block until every operation enqueued so far is committed"""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(("flush", None, done))
+        done.wait()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            flushes = [payload for op, _, payload in batch if op == "flush"]
+            writes = [item for item in batch if item[0] != "flush"]
+            if writes:
+                self._write(writes)
+            for done in flushes:
+                done.set()
+            if stop:
+                return
+
+    def _write(self, batch):
+        try:
+            self._commit_with_retry(batch)
+            return
+        except Exception as e:
+            print(f"Write-behind batch of {len(batch)} failed, retrying row by row: {str(e)}")
+        for item in _single_rows(batch):
+            try:
+                self._commit_with_retry([item])
+            except Exception as e:
+                self.failed += 1
+                print(f"Write-behind {item[0]} on {item[1].__tablename__} dropped: {str(e)}")
+
+    def _commit_with_retry(self, batch):
+        delay = 0.05
+        for attempt in range(self.retries + 1):
+            try:
+                self._commit(batch)
+                return
+            except OperationalError:
+                if attempt == self.retries:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 2.0)
+
+    def _commit(self, batch):
+        with SessionLocal() as session:
+            for op, model, payload in _group(batch):
+                if op == "insert":
+                    session.execute(insert(model), payload)
+                elif op == "update":
+                    ids, values = payload
+                    for chunk in _chunks(ids):
+                        session.execute(update(model).where(model.id.in_(chunk)).values(**values))
+                elif op == "update_where":
+                    user_id, where, values = payload
+                    conditions = [getattr(model, name) == value for name, value in where.items()]
+                    session.execute(update(model).where(model.user_id == user_id, *conditions).values(**values))
+                elif op == "delete":
+                    for chunk in _chunks(payload):
+                        session.execute(delete(model).where(model.id.in_(chunk)))
+                elif op == "delete_before":
+                    user_id, cutoff = payload
+                    session.execute(delete(model).where(model.user_id == user_id, model.created_at < cutoff))
+            session.commit()
+
+
+def _chunks(ids: List[str], size: int = 500):
+    """Keep IN (...) lists well below SQLite's bound-parameter limit"""
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _group(batch):
+    """Merge runs of compatible operations so each run is a single statement"""
+    grouped = []
+    for op, model, payload in batch:
+        last = grouped[-1] if grouped else None
+        if last and last[0] == op and last[1] is model:
+            if op in ("insert", "delete"):
+                last[2].extend(payload)
+                continue
+            if op == "update" and last[2][1] == payload[1]:
+                last[2][0].extend(payload[0])
+                continue
+        if op in ("update_where", "delete_before"):
+            grouped.append([op, model, payload])
+        elif op == "update":
+            grouped.append([op, model, (list(payload[0]), payload[1])])
+        else:
+            grouped.append([op, model, list(payload)])
+    return grouped
+
+
+def _single_rows(batch):
+    """Split a failed batch into operations touching one row each"""
+    for op, model, payload in batch:
+        if op == "insert":
+            for row in payload:
+                yield op, model, [row]
+        elif op == "delete":
+            for record_id in payload:
+                yield op, model, [record_id]
+        elif op == "update":
+            ids, values = payload
+            for record_id in ids:
+                yield op, model, ([record_id], values)
+        else:
+            yield op, model, payload
+
+
+writer = WriteBehindQueue()
+
+
+class SQLPersistence:
+    """Durable backing for a RecordStore using one SQLAlchemy model.
+
+    Writes go through the shared write-behind queue; reads are indexed
+    queries on the primary key or bounded (LIMIT and COUNT) queries on
+    (user_id, created_at), and are meant to run in a worker thread.
+    """
+
+    def __init__(self, model, iso_dates: bool = False, write_queue: WriteBehindQueue = writer):
+        self.model = model
+        self.iso_dates = iso_dates
+        self.writer = write_queue
+        self._columns = [c.name for c in model.__table__.columns]
+        self._date_columns = [c.name for c in model.__table__.columns if isinstance(c.type, DateTime)]
+
+    def insert(self, record: dict):
+        self.writer.insert(self.model, [self._to_row(record)])
+
+    def insert_many(self, records: List[dict]):
+        self.writer.insert(self.model, [self._to_row(r) for r in records])
+
+    def update(self, ids: List[str], values: dict):
+        self.writer.update(self.model, ids, self._to_row(values))
+
+    def update_where(self, user_id: int, where: dict, values: dict):
+        self.writer.update_where(self.model, user_id, self._to_row(where), self._to_row(values))
+
+    def delete(self, ids: List[str]):
+        self.writer.delete(self.model, ids)
+
+    def flush(self):
+        self.writer.flush()
+
+    def delete_before(self, user_id: int, cutoff: datetime):
+        self.writer.delete_before(self.model, user_id, cutoff)
+
+    def users_before(self, cutoff: datetime) -> List[int]:
+        """Ids of the users who have records created before cutoff"""
+        with SessionLocal() as session:
+            return list(session.scalars(
+                select(self.model.user_id).where(self.model.created_at < cutoff).distinct()
+            ))
+
+    def load_window(self, user_id: int, size: int, counted: Optional[dict] = None, cap: int = 0,
+                    flush: bool = True) -> dict:
+        """Read a user's newest records and count the older ones.
+
+        Returns the records created at or after floor, newest first; floor
+        is None when they are the user's whole history. older is the number
+        of records before floor and counted how many of those match the
+        counted column values. With cap set and more records than that,
+        trim_before is the created_at before which the user's records
+        exceed the cap; they are left out of everything else. Unless flush
+        is False, pending writes are committed first, so the result
+        includes every write enqueued before the call.
+        """
+        if flush:
+            self.writer.flush()
+        model = self.model
+        conditions = [model.user_id == user_id]
+        newest = (model.created_at.desc(), model.id.desc())
+        trim_before = None
+        with SessionLocal() as session:
+            if cap > 0:
+                edge = session.scalars(
+                    select(model.created_at).where(*conditions).order_by(*newest).offset(cap - 1).limit(2)
+                ).all()
+                if len(edge) == 2:
+                    trim_before = edge[0]
+                    conditions.append(model.created_at >= trim_before)
+            rows = session.scalars(select(model).where(*conditions).order_by(*newest).limit(size + 1)).all()
+            floor = None
+            older = counted_older = 0
+            if len(rows) > size:
+                floor = rows[size - 1].created_at
+                if rows[size].created_at == floor:
+                    # Keep records with equal created_at on the same side of the floor
+                    floor += MICROSECOND
+                rows = [row for row in rows[:size] if row.created_at >= floor]
+                conditions.append(model.created_at < floor)
+                older = session.scalar(select(func.count()).select_from(model).where(*conditions))
+                if counted:
+                    matching = [getattr(model, name) == value for name, value in counted.items()]
+                    counted_older = session.scalar(
+                        select(func.count()).select_from(model).where(*conditions, *matching)
+                    )
+            records = [self._to_record(row) for row in rows]
+        return {
+            "records": records,
+            "floor": floor,
+            "older": older,
+            "counted": counted_older,
+            "trim_before": trim_before,
+        }
+
+    def load_page(self, user_id: int, limit: int, before: Optional[Tuple] = None, after: Optional[Tuple] = None,
+                  newest_first: bool = True, filters: Optional[dict] = None) -> List[dict]:
+        """Keyset page: up to limit of a user's records strictly between the
+        after and before (created_at micros, id) keys, in key order"""
+        model = self.model
+        conditions = [model.user_id == user_id]
+        if before is not None:
+            created_at, record_id = from_micros(before[0]), before[1]
+            conditions.append(model.created_at <= created_at)
+            conditions.append(or_(model.created_at < created_at, and_(model.created_at == created_at, model.id < record_id)))
+        if after is not None:
+            created_at, record_id = from_micros(after[0]), after[1]
+            conditions.append(model.created_at >= created_at)
+            conditions.append(or_(model.created_at > created_at, and_(model.created_at == created_at, model.id > record_id)))
+        for name, value in (filters or {}).items():
+            conditions.append(getattr(model, name) == value)
+        if newest_first:
+            order = (model.created_at.desc(), model.id.desc())
+        else:
+            order = (model.created_at, model.id)
+        stmt = select(model).where(*conditions).order_by(*order).limit(limit)
+        with SessionLocal() as session:
+            return [self._to_record(row) for row in session.scalars(stmt)]
+
+    def load_id(self, record_id: str, flush: bool = False) -> Optional[dict]:
+        """Read one record by id, optionally committing pending writes first"""
+        if flush:
+            self.writer.flush()
+        with SessionLocal() as session:
+            row = session.get(self.model, record_id)
+            return self._to_record(row) if row is not None else None
+
+    def _to_row(self, record: dict) -> Dict:
+        row = {k: v for k, v in record.items() if k in self._columns}
+        for name in self._date_columns:
+            if isinstance(row.get(name), str):
+                row[name] = datetime.fromisoformat(row[name])
+        return row
+
+    def _to_record(self, row) -> dict:
+        record = {name: getattr(row, name) for name in self._columns}
+        if self.iso_dates:
+            for name in self._date_columns:
+                if record[name] is not None:
+                    record[name] = record[name].isoformat()
+        return record
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+from typing import Tuple, Union
+import sys
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# Approximate bytes each record costs outside its own object: the id map
+# entry, the (created_at, id) key tuple and its slot in the user's key list.
+INDEX_OVERHEAD = 112
+
+
+def to_micros(value: Union[datetime, str]) -> int:
+    """Naive datetime (or ISO string) to integer microseconds since 1970-01-01"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return (value.replace(tzinfo=None) - EPOCH) // MICROSECOND
+
+
+def from_micros(micros: int) -> datetime:
+    return EPOCH + micros * MICROSECOND
+
+
+class CompactRecord:
+    """Slotted form of a notification record kept by a RecordStore.
+
+    created_at is held as integer microseconds and the fields listed in
+    interned share one string object per distinct value. Records read like
+    the dicts the API returns (record["status"]) and are converted back
+    with to_dict() only when they leave the store.
+    """
+
+    __slots__ = ()
+    interned: Tuple[str, ...] = ()
+    iso_dates = False
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CompactRecord":
+        record = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(record, name, data.get(name))
+        record.set(created_at=data["created_at"])
+        for name in cls.interned:
+            record.set(**{name: data.get(name)})
+        return record
+
+    @property
+    def key(self) -> Tuple[int, str]:
+        return (self.created_at, self.id)
+
+    def set(self, **values):
+        for name, value in values.items():
+            if name == "created_at":
+                value = to_micros(value)
+            elif name in self.interned and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, name, value)
+
+    def __getitem__(self, name: str):
+        if name == "created_at":
+            created_at = from_micros(self.created_at)
+            return created_at.isoformat() if self.iso_dates else created_at
+        return getattr(self, name)
+
+    def to_dict(self) -> dict:
+        return {name: self[name] for name in self.__slots__}
+
+    def footprint(self) -> int:
+        """Approximate bytes held by this record and the index entries for it"""
+        size = sys.getsizeof(self) + INDEX_OVERHEAD
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, str) and name not in self.interned:
+                size += sys.getsizeof(value)
+        return size
+
+
+class EmailRecord(CompactRecord):
+    __slots__ = ("id", "user_id", "email_to", "subject", "body", "sent", "status", "digest_id", "created_at")
+    interned = ("status",)
+    iso_dates = True
+
+
+class SMSRecord(CompactRecord):
+    __slots__ = ("id", "user_id", "to", "body", "sid", "status", "error", "attempts", "digest_id", "created_at")
+    interned = ("status",)
+    iso_dates = True
+
+
+class InAppRecord(CompactRecord):
+    __slots__ = ("id", "user_id", "title", "message", "notification_type", "link", "read", "created_at")
+    interned = ("notification_type",)
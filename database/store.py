@@ -0,0 +1,624 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple, Type
+import asyncio
+import os
+import time
+import uuid
+
+from database.records import CompactRecord, to_micros
+
+RETENTION_MAX_PER_USER = int(os.getenv("RETENTION_MAX_PER_USER", "0"))
+RECENT_PER_USER = int(os.getenv("STORE_RECENT_PER_USER", "500"))
+LOAD_ATTEMPTS = 3
+
+
+def _key(record: dict) -> Tuple[int, str]:
+    return (to_micros(record["created_at"]), record["id"])
+
+
+def _matches(record, values: Optional[dict]) -> bool:
+    return not values or all(record[name] == value for name, value in values.items())
+
+
+class RecordStore:
+    """Indexed in-memory store for one channel's notification records.
+
+    Keeps an id -> record map and a per-user list of (created_at, id) keys
+    in ascending created_at order, so router operations only touch one
+    user's data. Records are held as slotted CompactRecords with integer
+    timestamps and handed out as dicts.
+
+    With a persistence backend every change is also written through it,
+    and memory only holds each user's recent records. The first read of a
+    user fetches their newest recent_per_user records and counts the
+    older ones with bounded queries in a worker thread; from then on every
+    record created at or after the user's floor is in memory, and pages
+    reaching further back continue with keyset queries against the
+    database, so no request reads a user's whole history. Records added
+    later join memory and trim() moves the oldest back out once they are
+    committed. Whenever a change touches records older than the floor in a
+    way the counts cannot follow, the user's counts are dropped and read
+    again on next access.
+
+    version() identifies one state of a user's history for conditional
+    GETs. With a change feed it is the sequence number of the user's
+    newest logged change, which every worker agrees on; while this process
+    has changes of the user that are not logged yet, and without a feed,
+    it is a counter qualified by the per-process epoch instead.
+
+    With max_per_user set, adding records beyond the cap deletes that
+    user's oldest records.
+
+    With a change feed, every change is also announced under topic, and
+    changes announced by other processes are applied to the records this
+    process holds, so several workers can share one database.
+    """
+
+    # Column values whose older records are counted separately (see InAppNotificationStore)
+    counted_where: Optional[dict] = None
+
+    def __init__(self, record_type: Type[CompactRecord], persistence=None, max_per_user: int = RETENTION_MAX_PER_USER,
+                 feed=None, topic: Optional[str] = None, recent_per_user: int = RECENT_PER_USER):
+        self.record_type = record_type
+        self.persistence = persistence
+        self.max_per_user = max_per_user
+        self.recent_per_user = recent_per_user
+        self.feed = feed
+        self.topic = topic
+        self.epoch = uuid.uuid4().hex[:8]
+        self._by_id: Dict[str, CompactRecord] = {}
+        self._user_keys: Dict[int, List[Tuple]] = {}
+        self._versions: Dict[int, int] = {}
+        self._seqs: Dict[int, int] = {}
+        # Own changes per user that the change feed has not read back yet
+        self._unconfirmed: Dict[int, int] = {}
+        self._last_used: "OrderedDict[int, float]" = OrderedDict()
+        self._bytes = 0
+        # Users whose floor and older counts are current
+        self._loaded: Set[int] = set()
+        self._loading: Dict[int, asyncio.Future] = {}
+        # created_at micros from which a user's records are all in memory (None: all of them)
+        self._floors: Dict[int, Optional[int]] = {}
+        self._older: Dict[int, int] = {}
+        self._older_counted: Dict[int, int] = {}
+        if feed is not None:
+            feed.subscribe(topic, self.apply_change, self._confirm)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def memory_bytes(self) -> int:
+        """Approximate bytes held by the records currently in memory"""
+        return self._bytes
+
+    def users_in_memory(self) -> int:
+        return len(self._user_keys)
+
+    async def version(self, user_id: int) -> str:
+        await self._ensure_user(user_id)
+        if self.feed is None or self._unconfirmed.get(user_id) or user_id not in self._seqs:
+            return f"{self.epoch}.{self._versions.get(user_id, 0)}"
+        return str(self._seqs[user_id])
+
+    async def count(self, user_id: int) -> int:
+        await self._ensure_user(user_id)
+        return len(self._user_keys.get(user_id, ())) + self._older.get(user_id, 0)
+
+    def add(self, record: dict) -> dict:
+        self._use(record["user_id"])
+        self._index(self.record_type.from_dict(record))
+        self._touch(record["user_id"])
+        if self.persistence is not None:
+            self.persistence.insert(record)
+        self._announce("add", record["user_id"], {"records": [record]})
+        self._enforce_cap(record["user_id"])
+        return record
+
+    def add_many(self, records: List[dict]) -> List[dict]:
+        """Add records in one pass with a single persistence write"""
+        user_ids = {r["user_id"] for r in records}
+        for record in records:
+            self._index(self.record_type.from_dict(record))
+        for user_id in user_ids:
+            self._use(user_id)
+            self._touch(user_id)
+        if self.persistence is not None and records:
+            self.persistence.insert_many(records)
+        by_user: Dict[int, List[dict]] = {}
+        for record in records:
+            by_user.setdefault(record["user_id"], []).append(record)
+        for user_id, rows in by_user.items():
+            self._announce("add", user_id, {"records": rows})
+        for user_id in user_ids:
+            self._enforce_cap(user_id)
+        return records
+
+    def get(self, record_id: str) -> Optional[dict]:
+        record = self._find(record_id)
+        return record.to_dict() if record is not None else None
+
+    async def page(self, user_id: int, limit: int, before: Optional[Tuple] = None, after: Optional[Tuple] = None,
+                   newest_first: bool = True, filters: Optional[dict] = None):
+        """Return up to limit of a user's records strictly between the after
+        and before (created_at, id) keys, plus the key to continue from.
+
+        Keys hold created_at as integer microseconds; filters maps fields to
+        the values records must have. The continuation key is None once the
+        range is exhausted; otherwise pass it as before (newest_first) or
+        after (oldest first).
+        """
+        await self._ensure_user(user_id)
+        floor = self._floors.get(user_id)
+        stored_before = None
+        if floor is not None and (after is None or after < (floor, "")):
+            stored_before = (floor, "") if before is None else min(before, (floor, ""))
+        if newest_first:
+            records = self._page_memory(user_id, limit + 1, before, after, True, filters)
+            if len(records) <= limit and stored_before is not None:
+                records += await asyncio.to_thread(
+                    self.persistence.load_page, user_id, limit + 1 - len(records), stored_before, after, True, filters
+                )
+        else:
+            records = []
+            if stored_before is not None:
+                records = await asyncio.to_thread(
+                    self.persistence.load_page, user_id, limit + 1, stored_before, after, False, filters
+                )
+            if len(records) <= limit:
+                records += self._page_memory(user_id, limit + 1 - len(records), before, after, False, filters)
+        if len(records) > limit:
+            return records[:limit], _key(records[limit - 1])
+        return records, None
+
+    def update(self, record_id: str, **values) -> bool:
+        record = self._find(record_id)
+        if record is None:
+            return False
+        if self._holds(record):
+            self._apply_update(record, values)
+        else:
+            self._invalidate_counts(record.user_id)
+        self._touch(record.user_id)
+        if self.persistence is not None:
+            self.persistence.update([record_id], values)
+        self._announce("update", record.user_id, {"ids": [record_id], "values": values})
+        return True
+
+    async def delete(self, record_id: str) -> Optional[dict]:
+        """Remove a record, returning it, or None if it does not exist"""
+        record = await self._fetch(record_id)
+        if record is None:
+            return None
+        if self._holds(record):
+            self._unindex(record)
+        else:
+            self._invalidate_counts(record.user_id)
+        self._touch(record.user_id)
+        if self.persistence is not None:
+            self.persistence.delete([record_id])
+        self._announce("delete", record.user_id, {"ids": [record_id]})
+        return record.to_dict()
+
+    def trim(self, committed_before: int) -> int:
+        """Move each user's oldest records beyond recent_per_user out of memory.
+
+        Only records created before committed_before (in microseconds), a
+        time by which every earlier write had been committed, are dropped;
+        they stay in the persistence backend. Returns how many were dropped.
+        """
+        if self.persistence is None:
+            return 0
+        dropped = 0
+        for user_id, keys in list(self._user_keys.items()):
+            excess = len(keys) - self.recent_per_user
+            if excess > 0:
+                dropped += self._evict_before(user_id, min(keys[excess][0], committed_before))
+        return dropped
+
+    async def purge_older_than(self, cutoff) -> int:
+        """Delete every record created before cutoff, in memory and in the
+        persistence backend (including users that are not loaded).
+
+        Each affected user's deletion is announced like any other change,
+        so their version moves in every process. Returns how many records
+        were dropped from memory.
+        """
+        cutoff_micros = to_micros(cutoff)
+        stored = set()
+        if self.persistence is not None:
+            stored = set(await asyncio.to_thread(self.persistence.users_before, cutoff))
+        purged = 0
+        for user_id in set(self._user_keys) | set(self._floors) | stored:
+            count = self._drop_before(user_id, cutoff_micros)
+            if not count and user_id not in stored:
+                continue
+            purged += count
+            self._touch(user_id)
+            if self.persistence is not None:
+                self.persistence.delete_before(user_id, cutoff)
+            self._announce("trim", user_id, {"before": cutoff_micros})
+        return purged
+
+    def least_recently_used(self) -> Optional[Tuple[float, int]]:
+        """(last use, user id) of the user it would be cheapest to unload"""
+        if self.persistence is None:
+            return None
+        for user_id, last_used in self._last_used.items():
+            return last_used, user_id
+        return None
+
+    def unload_user(self, user_id: int, committed_before: int) -> int:
+        """Drop a user's records from memory, returning the bytes freed.
+
+        Only records created before committed_before (see trim) are
+        dropped; the user is read from the persistence backend again on
+        next access.
+        """
+        self._last_used.pop(user_id, None)
+        if self.persistence is None:
+            return 0
+        before = self._bytes
+        keys = self._user_keys.get(user_id)
+        if keys:
+            self._drop_oldest(user_id, bisect_left(keys, (committed_before, "")))
+        self._forget_user(user_id)
+        return before - self._bytes
+
+    def apply_change(self, op: str, user_id: Optional[int], payload: dict):
+        """Change feed handler: mirror a change another process already persisted"""
+        if op == "add":
+            for row in payload["records"]:
+                self._apply_add(row)
+            for changed_user in {row["user_id"] for row in payload["records"]}:
+                self._touch(changed_user)
+                self._seqs[changed_user] = self.feed.last_seq
+            return
+        if op == "trim":
+            self._drop_before(user_id, payload["before"])
+        elif op == "update_where":
+            for record in self._records_of(user_id):
+                if _matches(record, payload["where"]):
+                    self._apply_update(record, payload["values"])
+            self._invalidate_older(user_id)
+        else:
+            for record_id in payload["ids"]:
+                record = self._by_id.get(record_id)
+                if record is None:
+                    # Possibly a record this process only has on disk
+                    self._invalidate_older(user_id)
+                elif op == "update":
+                    self._apply_update(record, payload["values"])
+                elif op == "delete":
+                    self._unindex(record)
+        self._touch(user_id)
+        self._seqs[user_id] = self.feed.last_seq
+
+    def _announce(self, op: str, user_id: int, payload: dict):
+        if self.feed is not None and self.feed.enabled:
+            self._unconfirmed[user_id] = self._unconfirmed.get(user_id, 0) + 1
+            self.feed.publish(self.topic, op, user_id, payload)
+
+    def _confirm(self, user_id: Optional[int]):
+        """Change feed callback: one of this process's own changes was logged"""
+        if user_id not in self._unconfirmed:
+            return
+        self._unconfirmed[user_id] -= 1
+        if self._unconfirmed[user_id] == 0:
+            del self._unconfirmed[user_id]
+            self._seqs[user_id] = max(self._seqs.get(user_id, 0), self.feed.last_seq)
+
+    def _holds(self, record: CompactRecord) -> bool:
+        """Whether record is the indexed copy rather than one read from disk"""
+        return self._by_id.get(record.id) is record
+
+    def _find(self, record_id: str) -> Optional[CompactRecord]:
+        """Look a record up by id, reading it from disk if it is not in memory"""
+        record = self._by_id.get(record_id)
+        if record is None and self.persistence is not None:
+            row = self.persistence.load_id(record_id)
+            if row is not None:
+                record = self._adopt(row)
+        if record is not None:
+            self._use(record.user_id)
+        return record
+
+    async def _fetch(self, record_id: str) -> Optional[CompactRecord]:
+        """Like _find, but commits pending writes and reads in a worker thread"""
+        record = self._by_id.get(record_id)
+        if record is None and self.persistence is not None:
+            row = await asyncio.to_thread(self.persistence.load_id, record_id, True)
+            record = self._by_id.get(record_id)
+            if record is None and row is not None:
+                record = self._adopt(row)
+        if record is not None:
+            self._use(record.user_id)
+        return record
+
+    def _adopt(self, row: dict) -> CompactRecord:
+        """Wrap a row read by id, indexing it if it falls in the user's memory window"""
+        record = self.record_type.from_dict(row)
+        if record.user_id in self._floors:
+            floor = self._floors[record.user_id]
+            if floor is None or record.created_at >= floor:
+                # Written by another process whose change has not reached us yet
+                self._index(record)
+        return record
+
+    def _records_of(self, user_id: int) -> List[CompactRecord]:
+        return [self._by_id[record_id] for _, record_id in self._user_keys.get(user_id, ())]
+
+    def _page_memory(self, user_id: int, limit: int, before: Optional[Tuple], after: Optional[Tuple],
+                     newest_first: bool, filters: Optional[dict]) -> List[dict]:
+        keys = self._user_keys.get(user_id, [])
+        lo = bisect_right(keys, after) if after is not None else 0
+        hi = bisect_left(keys, before) if before is not None else len(keys)
+        positions = range(hi - 1, lo - 1, -1) if newest_first else range(lo, hi)
+        records = []
+        for position in positions:
+            if len(records) == limit:
+                break
+            record = self._by_id[keys[position][1]]
+            if _matches(record, filters):
+                records.append(record.to_dict())
+        return records
+
+    def _use(self, user_id: int):
+        self._last_used[user_id] = time.monotonic()
+        self._last_used.move_to_end(user_id)
+
+    def _touch(self, user_id: int):
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def _complete(self, user_id: int) -> bool:
+        """Whether memory holds every record of the user"""
+        return self.persistence is None or (user_id in self._floors and self._floors[user_id] is None)
+
+    def _invalidate_counts(self, user_id: int):
+        """Read the user's floor and older counts again on next access"""
+        self._loaded.discard(user_id)
+
+    def _invalidate_older(self, user_id: int):
+        if not self._complete(user_id):
+            self._invalidate_counts(user_id)
+
+    def _forget_user(self, user_id: int):
+        self._loaded.discard(user_id)
+        self._floors.pop(user_id, None)
+        self._older.pop(user_id, None)
+        self._older_counted.pop(user_id, None)
+
+    async def _ensure_user(self, user_id: int):
+        self._use(user_id)
+        if self.persistence is None or user_id in self._loaded:
+            return
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = self._loading[user_id] = asyncio.ensure_future(self._load(user_id))
+            loading.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        await asyncio.shield(loading)
+
+    async def _load(self, user_id: int):
+        """Read a user's recent records and older counts without blocking the event loop.
+
+        The read is repeated if the user changed while it ran; if they keep
+        changing, the last result is used for now and read again next time.
+        """
+        for _ in range(LOAD_ATTEMPTS):
+            version = self._versions.get(user_id, 0)
+            started = to_micros(datetime.now())
+            seq, window = await asyncio.to_thread(self._read_window, user_id)
+            settled = self._versions.get(user_id, 0) == version
+            if settled:
+                break
+        self._install(user_id, window, started)
+        if settled:
+            self._loaded.add(user_id)
+            if seq is not None:
+                self._seqs[user_id] = max(self._seqs.get(user_id, 0), seq)
+
+    def _read_window(self, user_id: int):
+        """Return (latest logged seq, window) for a user; runs in a worker thread"""
+        self.persistence.flush()
+        seq = None
+        if self.feed is not None and self.feed.enabled:
+            # Read before the records, so they include every change up to seq
+            seq = self.feed.latest_seq(self.topic, user_id)
+        window = self.persistence.load_window(
+            user_id, self.recent_per_user, self.counted_where, self.max_per_user, flush=False
+        )
+        return seq, window
+
+    def _install(self, user_id: int, window: dict, started: int):
+        fetched = {row["id"] for row in window["records"]}
+        # Records committed before the read but not returned by it were
+        # deleted, or are older than the floor and now only on disk
+        for _, record_id in list(self._user_keys.get(user_id, ())):
+            record = self._by_id[record_id]
+            if record.created_at < started and record_id not in fetched:
+                self._unindex(record)
+        for row in window["records"]:
+            if row["id"] not in self._by_id:
+                self._index(self.record_type.from_dict(row))
+        self._floors[user_id] = to_micros(window["floor"]) if window["floor"] is not None else None
+        self._older[user_id] = window["older"]
+        self._older_counted[user_id] = window["counted"]
+        if window["trim_before"] is not None:
+            self.persistence.delete_before(user_id, window["trim_before"])
+            self._announce("trim", user_id, {"before": to_micros(window["trim_before"])})
+
+    def _apply_add(self, row: dict):
+        user_id = row["user_id"]
+        if row["id"] in self._by_id or (user_id not in self._floors and user_id not in self._loading):
+            return
+        floor = self._floors.get(user_id)
+        if floor is not None and to_micros(row["created_at"]) < floor:
+            self._invalidate_counts(user_id)
+        else:
+            self._index(self.record_type.from_dict(row))
+
+    def _enforce_cap(self, user_id: int):
+        if self.max_per_user <= 0:
+            return
+        if not self._complete(user_id):
+            # Some of this user's records are only on disk; the next load trims them
+            if len(self._user_keys.get(user_id, ())) + self._older.get(user_id, 0) > self.max_per_user:
+                self._invalidate_counts(user_id)
+            return
+        excess = len(self._user_keys.get(user_id, ())) - self.max_per_user
+        if excess > 0:
+            dropped = self._drop_oldest(user_id, excess)
+            if self.persistence is not None:
+                self.persistence.delete(dropped)
+            self._announce("delete", user_id, {"ids": dropped})
+
+    def _evict_before(self, user_id: int, floor: int) -> int:
+        """Move a user's committed records created before floor out of memory"""
+        keys = self._user_keys.get(user_id, [])
+        count = bisect_left(keys, (floor, ""))
+        if count == 0:
+            return 0
+        counted = 0
+        if self.counted_where:
+            counted = sum(1 for _, record_id in keys[:count] if _matches(self._by_id[record_id], self.counted_where))
+        self._drop_oldest(user_id, count)
+        if user_id in self._floors:
+            self._floors[user_id] = floor
+            self._older[user_id] += count
+            self._older_counted[user_id] += counted
+        return count
+
+    def _drop_before(self, user_id: int, cutoff: int) -> int:
+        """Forget a user's records created before cutoff once they are deleted"""
+        keys = self._user_keys.get(user_id)
+        count = bisect_left(keys, (cutoff, "")) if keys else 0
+        if count:
+            self._drop_oldest(user_id, count)
+        floor = self._floors.get(user_id)
+        if floor is not None:
+            if floor <= cutoff:
+                # Everything older than the floor went too
+                self._floors[user_id] = None
+                self._older[user_id] = 0
+                self._older_counted[user_id] = 0
+            else:
+                self._invalidate_counts(user_id)
+        return count
+
+    def _drop_oldest(self, user_id: int, count: int) -> List[str]:
+        """Remove a user's count oldest records from memory only"""
+        keys = self._user_keys[user_id]
+        dropped = [record_id for _, record_id in keys[:count]]
+        del keys[:count]
+        if not keys:
+            del self._user_keys[user_id]
+        for record_id in dropped:
+            record = self._by_id.pop(record_id)
+            self._bytes -= record.footprint()
+            self._forget(record)
+        return dropped
+
+    def _apply_update(self, record: CompactRecord, values: dict):
+        self._bytes -= record.footprint()
+        record.set(**values)
+        self._bytes += record.footprint()
+
+    def _index(self, record: CompactRecord):
+        self._by_id[record.id] = record
+        self._bytes += record.footprint()
+        keys = self._user_keys.setdefault(record.user_id, [])
+        key = record.key
+        if not keys or keys[-1] <= key:
+            keys.append(key)
+        else:
+            insort(keys, key)
+
+    def _unindex(self, record: CompactRecord):
+        user_id = record.user_id
+        del self._by_id[record.id]
+        self._bytes -= record.footprint()
+        keys = self._user_keys[user_id]
+        key = record.key
+        index = bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+        if not keys:
+            del self._user_keys[user_id]
+        self._forget(record)
+
+    def _forget(self, record: CompactRecord):
+        """Hook for subclasses to drop their own indexes of a removed record"""
+
+
+class InAppNotificationStore(RecordStore):
+    """RecordStore that also tracks each user's unread notification ids"""
+
+    counted_where = {"read": False}
+
+    def __init__(self, record_type: Type[CompactRecord], persistence=None, max_per_user: int = RETENTION_MAX_PER_USER,
+                 feed=None, topic: Optional[str] = None, recent_per_user: int = RECENT_PER_USER):
+        self._unread: Dict[int, Set[str]] = {}
+        super().__init__(record_type, persistence, max_per_user, feed, topic, recent_per_user)
+
+    async def unread_count(self, user_id: int) -> int:
+        await self._ensure_user(user_id)
+        return len(self._unread.get(user_id, ())) + self._older_counted.get(user_id, 0)
+
+    async def mark_read(self, notification_id: str) -> Optional[dict]:
+        """Mark a notification read, returning it, or None if it does not exist"""
+        record = await self._fetch(notification_id)
+        if record is None:
+            return None
+        if not record.read:
+            if self._holds(record):
+                self._apply_update(record, {"read": True})
+            else:
+                record.read = True
+                self._invalidate_counts(record.user_id)
+            self._touch(record.user_id)
+            if self.persistence is not None:
+                self.persistence.update([notification_id], {"read": True})
+            self._announce("update", record.user_id, {"ids": [notification_id], "values": {"read": True}})
+        return record.to_dict()
+
+    async def mark_all_read(self, user_id: int) -> int:
+        await self._ensure_user(user_id)
+        unread = self._unread.pop(user_id, None) or set()
+        for notification_id in unread:
+            self._by_id[notification_id].read = True
+        if unread:
+            if self.persistence is not None:
+                self.persistence.update(list(unread), {"read": True})
+            self._announce("update", user_id, {"ids": list(unread), "values": {"read": True}})
+        older_unread = self._older_counted.get(user_id, 0)
+        if older_unread:
+            self._older_counted[user_id] = 0
+            self.persistence.update_where(user_id, {"read": False}, {"read": True})
+            self._announce("update_where", user_id, {"where": {"read": False}, "values": {"read": True}})
+        if unread or older_unread:
+            self._touch(user_id)
+        return len(unread) + older_unread
+
+    def _index(self, record: CompactRecord):
+        super()._index(record)
+        if not record.read:
+            self._unread.setdefault(record.user_id, set()).add(record.id)
+
+    def _apply_update(self, record: CompactRecord, values: dict):
+        if "read" in values and values["read"] != record.read:
+            if values["read"]:
+                self._discard_unread(record.user_id, record.id)
+            else:
+                self._unread.setdefault(record.user_id, set()).add(record.id)
+        super()._apply_update(record, values)
+
+    def _forget(self, record: CompactRecord):
+        self._discard_unread(record.user_id, record.id)
+
+    def _discard_unread(self, user_id: int, notification_id: str):
+        unread = self._unread.get(user_id)
+        if unread is not None:
+            unread.discard(notification_id)
+            if not unread:
+                del self._unread[user_id]
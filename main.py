@@ -1,27 +1,66 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from services.e_notif import router as email_router
-from services.sms_notif import router as sms_router
+from database.backends import change_feed
+from database.database import init_db
+from database.persistence import writer
+from services.e_notif import router as email_router, email_coalescer, email_dispatcher
+from services.sms_notif import router as sms_router, sms_coalescer, sms_dispatcher
 from services.in_notif import router as inapp_router
+from services.templates import router as templates_router
+from services.scheduler import router as schedule_router, scheduler
+from services.storage import router as storage_router, store_maintainer
+from services.metrics import MetricsMiddleware, loop_lag_monitor, router as metrics_router
+from services.profiler import profiler, router as profiler_router
 import os
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    change_feed.start()
+    email_dispatcher.start()
+    sms_dispatcher.start()
+    scheduler.start()
+    store_maintainer.start()
+    loop_lag_monitor.start()
+    yield
+    profiler.stop()
+    await loop_lag_monitor.stop()
+    await store_maintainer.stop()
+    await scheduler.stop()
+    await email_coalescer.stop()
+    await sms_coalescer.stop()
+    await email_dispatcher.stop()
+    await sms_dispatcher.stop()
+    await change_feed.stop()
+    writer.close()
+
+app = FastAPI(lifespan=lifespan)
 
 FRONTEND_URL = os.getenv("FRONTEND_URL", "https://notification-app-dgdx.vercel.app") 
 DEVELOPMENT_URL = os.getenv("DEVELOPMENT_URL", "http://localhost:3000")
 
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[FRONTEND_URL, DEVELOPMENT_URL, "*"], 
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
-    expose_headers=["Content-Type", "X-Requested-With", "Accept", "Authorization", "Access-Control-Allow-Origin"],
+    expose_headers=[
+        "Content-Type", "X-Requested-With", "Accept", "Authorization", "Access-Control-Allow-Origin",
+        "X-Next-Cursor", "ETag",
+    ],
 )
 
 app.include_router(email_router, prefix="/email", tags=["Email"])
 app.include_router(sms_router, prefix="/sms", tags=["SMS"])
 app.include_router(inapp_router, prefix="/inapp", tags=["In-App"])
+app.include_router(templates_router, prefix="/templates", tags=["Templates"])
+app.include_router(schedule_router, prefix="/schedule", tags=["Schedule"])
+app.include_router(storage_router, prefix="/storage", tags=["Storage"])
+app.include_router(metrics_router, tags=["Metrics"])
+app.include_router(profiler_router, prefix="/debug/profiler", tags=["Metrics"])
 
 @app.get("/")
 async def root():
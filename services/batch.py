@@ -0,0 +1,176 @@
+from collections import OrderedDict
+from datetime import datetime
+from fastapi import HTTPException, Request
+from html import escape
+from pydantic import ValidationError
+from string import Template
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import json
+import uuid
+
+BATCH_CHUNK_SIZE = 1000
+MAX_TRACKED_BATCHES = 1000
+
+
+async def read_batch_items(request: Request) -> AsyncIterator[Tuple[int, Any]]:
+    """Yield (index, item) pairs from a JSON array or a streamed NDJSON body"""
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        index = 0
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield index, _parse_line(line, index)
+                    index += 1
+        if buffer.strip():
+            yield index, _parse_line(buffer, index)
+        return
+
+    try:
+        items = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    for index, item in enumerate(items):
+        yield index, item
+
+
+def _parse_line(line: bytes, index: int):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return ValueError(f"Line {index + 1} is not valid JSON")
+
+
+async def validate_batch_items(request: Request, model, results: List[dict]) -> AsyncIterator[List[Tuple[int, Any]]]:
+    """Validate items against model, yielding chunks of (index, item).
+
+    Items that fail validation are appended to results as errors so the
+    caller only has to handle the valid ones.
+    """
+    chunk = []
+    async for index, raw in read_batch_items(request):
+        if isinstance(raw, ValueError):
+            results.append({"index": index, "error": str(raw)})
+            continue
+        try:
+            chunk.append((index, model.model_validate(raw)))
+        except ValidationError as e:
+            results.append({"index": index, "error": _format_errors(e)})
+            continue
+        if len(chunk) >= BATCH_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _format_errors(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in e['loc']) or 'item'}: {e['msg']}" for e in error.errors()
+    )
+
+
+def render(text: str, variables: Dict[str, Any], html: bool = False) -> str:
+    """Substitute $name placeholders with per-recipient variables.
+
+    With html the values are escaped, as stored templates do for email
+    bodies, so a variable cannot inject markup into the message.
+    """
+    if not variables:
+        return text
+    if html:
+        variables = {name: escape(str(value)) for name, value in variables.items()}
+    return Template(text).safe_substitute(variables)
+
+
+class BatchTracker:
+    """Tracks the progress of batch sends for one channel.
+
+    Keeps the most recent MAX_TRACKED_BATCHES batches and maps each pending
+    item id back to its batch so dispatcher callbacks can update counts.
+    With a change feed, a snapshot of the batch is shared with the other
+    processes when it finishes receiving and again when it completes.
+    """
+
+    def __init__(self, channel: str, feed=None):
+        self.channel = channel
+        self.feed = feed
+        self._batches: "OrderedDict[str, dict]" = OrderedDict()
+        self._pending: Dict[str, str] = {}
+        if feed is not None:
+            feed.subscribe(f"{channel}_batches", self._apply_snapshot)
+
+    def create(self) -> dict:
+        batch = {
+            "batch_id": str(uuid.uuid4()),
+            "channel": self.channel,
+            "status": "receiving",
+            "total": 0,
+            "accepted": 0,
+            "rejected": 0,
+            "pending": 0,
+            "delivered": 0,
+            "failed": 0,
+            "created_at": datetime.now().isoformat(),
+        }
+        self._remember(batch)
+        return batch
+
+    def get(self, batch_id: str) -> Optional[dict]:
+        return self._batches.get(batch_id)
+
+    def track(self, batch: dict, item_id: str):
+        """Register an accepted item whose delivery completes later"""
+        self._pending[item_id] = batch["batch_id"]
+        batch["pending"] += 1
+
+    def finish(self, batch: dict, results: List[dict], delivered: bool = False):
+        """Record the per-item results once the whole body has been read.
+
+        delivered marks accepted items as complete for channels that have
+        no asynchronous delivery step; items registered with track stay
+        pending until they are settled.
+        """
+        results.sort(key=lambda r: r["index"])
+        batch["total"] = len(results)
+        batch["accepted"] = sum(1 for r in results if "id" in r)
+        batch["rejected"] = batch["total"] - batch["accepted"]
+        if delivered:
+            batch["delivered"] = batch["accepted"] - batch["pending"] - batch["failed"]
+        batch["status"] = "processing"
+        self._refresh(batch)
+        self._share(batch)
+
+    def settle(self, item_id: str, delivered: bool):
+        batch_id = self._pending.pop(item_id, None)
+        batch = self._batches.get(batch_id) if batch_id else None
+        if batch is None:
+            return
+        batch["pending"] -= 1
+        batch["delivered" if delivered else "failed"] += 1
+        self._refresh(batch)
+        if batch["status"] == "completed":
+            self._share(batch)
+
+    def _remember(self, batch: dict):
+        self._batches[batch["batch_id"]] = batch
+        while len(self._batches) > MAX_TRACKED_BATCHES:
+            _, old = self._batches.popitem(last=False)
+            if old["pending"]:
+                self._pending = {k: v for k, v in self._pending.items() if v != old["batch_id"]}
+
+    def _share(self, batch: dict):
+        if self.feed is not None:
+            self.feed.publish(f"{self.channel}_batches", "snapshot", None, batch)
+
+    def _apply_snapshot(self, op: str, user_id, batch: dict):
+        self._remember(batch)
+
+    def _refresh(self, batch: dict):
+        if batch["status"] != "receiving":
+            batch["status"] = "completed" if batch["pending"] == 0 else "processing"
@@ -0,0 +1,42 @@
+from fastapi import Request, Response
+from typing import Optional
+import hashlib
+
+CACHE_CONTROL = "private, no-cache"
+
+
+async def history_etag(store, user_id: int, request: Request) -> str:
+    """ETag for one view of a user's history.
+
+    Combines the store's per-user version with a digest of the query and
+    Accept header, so it can be checked without building the body, by any
+    worker.
+    """
+    query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    view = f"{query}|{request.headers.get('accept', '')}"
+    digest = hashlib.blake2b(view.encode(), digest_size=6).hexdigest()
+    return f'W/"{await store.version(user_id)}-{digest}"'
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Return a 304 response if If-None-Match already names etag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    candidates = [tag.strip() for tag in header.split(",")]
+    if "*" in candidates or _opaque(etag) in {_opaque(tag) for tag in candidates}:
+        response = Response(status_code=304)
+        set_cache_headers(response, etag)
+        return response
+    return None
+
+
+def set_cache_headers(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.headers["Vary"] = "Accept"
+
+
+def _opaque(tag: str) -> str:
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    return tag[2:] if tag.startswith("W/") else tag
@@ -0,0 +1,88 @@
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, List, Optional
+import asyncio
+import time
+
+
+class DigestCoalescer:
+    """Groups messages to the same recipient into one delivery.
+
+    Items are grouped by key (recipient plus digest key). A group is
+    flushed through on_flush(key, items) when its window closes or when it
+    reaches max_items, whichever comes first. Flushing a full group is
+    scheduled on the event loop rather than done inside add(), so callers
+    can finish recording an item after handing it over.
+
+    All windows have the same length, so groups expire in the order they
+    were opened: a single deque of open groups acts as the timer queue and
+    one task sleeps until the oldest deadline, instead of one sleeping
+    task per recipient.
+    """
+
+    def __init__(self, window: float, max_items: int, on_flush: Callable[[Hashable, List[Any]], None]):
+        self.window = window
+        self.max_items = max_items
+        self.on_flush = on_flush
+        self._groups: Dict[Hashable, dict] = {}
+        self._deadlines = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def pending(self) -> int:
+        return sum(len(g["items"]) for g in self._groups.values())
+
+    def add(self, key: Hashable, item: Any):
+        self.start()
+        group = self._groups.get(key)
+        if group is None:
+            group = {"key": key, "items": [], "deadline": time.monotonic() + self.window, "open": True}
+            self._groups[key] = group
+            self._deadlines.append(group)
+            self._wakeup.set()
+        group["items"].append(item)
+        if len(group["items"]) >= self.max_items:
+            del self._groups[key]
+            asyncio.get_running_loop().call_soon(self._flush, group)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the timer and flush every open group immediately"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while self._deadlines:
+            self._flush(self._deadlines.popleft())
+
+    def _flush(self, group: dict):
+        if not group["open"]:
+            return
+        group["open"] = False
+        if self._groups.get(group["key"]) is group:
+            del self._groups[group["key"]]
+        try:
+            self.on_flush(group["key"], group["items"])
+        except Exception as e:
+            print(f"Digest flush failed: {str(e)}")
+
+    async def _run(self):
+        while True:
+            while self._deadlines and not self._deadlines[0]["open"]:
+                self._deadlines.popleft()
+            if not self._deadlines:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._deadlines[0]["deadline"] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            self._flush(self._deadlines.popleft())
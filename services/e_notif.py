@@ -1,37 +1,126 @@
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
-from pydantic import BaseModel, EmailStr
-from typing import List, Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from pydantic import BaseModel, EmailStr, model_validator
+from typing import List, Dict, Any, Optional
 import os
 from dotenv import load_dotenv
 import json
 from datetime import datetime
 import uuid
+from database.backends import change_feed, create_store
+from database.models import EmailNotification
+from database.records import EmailRecord
+from services.batch import BatchTracker, validate_batch_items
+from services.caching import history_etag, not_modified, set_cache_headers
+from services.pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, set_next_cursor, stream_ndjson, wants_ndjson
+)
+from services.coalesce import DigestCoalescer
+from services.email_dispatch import EmailDispatcher, EmailJob, transport_from_env
+from services.metrics import (
+    dispatch_queue_depth, dispatch_queue_oldest, pending_items, store_memory_bytes, store_records_in_memory
+)
+from services.scheduler import is_future, scheduler
+from services.templates import TemplateRenderError, render_requests
 
 load_dotenv()
 
 router = APIRouter()
 
-email_notifications_db = []
-
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM=os.getenv("MAIL_FROM", "test@example.com"),
-    MAIL_SERVER=os.getenv("MAIL_SERVER", "smtp.example.com"),
-    MAIL_PORT=int(os.getenv("MAIL_PORT", "587")),
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=False,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True
+email_notifications_db = create_store(EmailRecord, EmailNotification, "email", iso_dates=True)
+email_batches = BatchTracker("email", feed=change_feed)
+email_digests: Dict[str, List[str]] = {}
+
+def record_delivery(notification_id: str, sent: bool, error: Optional[str]):
+    """Dispatcher callback: store the final delivery status of an email or digest"""
+    for record_id in email_digests.pop(notification_id, [notification_id]):
+        email_notifications_db.update(record_id, sent=sent, status="sent" if sent else "failed")
+        email_batches.settle(record_id, sent)
+
+email_dispatcher = EmailDispatcher.from_env(transport_from_env(), on_result=record_delivery)
+
+def flush_email_digest(key, records: List[dict]):
+    """Coalescer callback: send the emails held for one recipient as a single message"""
+    email_to = key[0]
+    if len(records) == 1:
+        digest_id = records[0]["id"]
+        subject, body = records[0]["subject"], records[0]["body"]
+    else:
+        digest_id = str(uuid.uuid4())
+        subject = f"{records[0]['subject']} (+{len(records) - 1} more)"
+        body = "<hr>".join(r["body"] for r in records)
+        email_digests[digest_id] = [r["id"] for r in records]
+    for record in records:
+        email_notifications_db.update(record["id"], digest_id=digest_id, status="queued")
+    email_dispatcher.enqueue(EmailJob(digest_id, email_to, subject, body))
+
+email_coalescer = DigestCoalescer(
+    window=float(os.getenv("EMAIL_DIGEST_WINDOW_SECONDS", "0")),
+    max_items=int(os.getenv("EMAIL_DIGEST_MAX_ITEMS", "20")),
+    on_flush=flush_email_digest,
 )
 
+dispatch_queue_depth.track("email", callback=email_dispatcher.qsize)
+dispatch_queue_oldest.track("email", callback=email_dispatcher.oldest_age)
+store_records_in_memory.track("email", callback=email_notifications_db.__len__)
+store_memory_bytes.track("email", callback=email_notifications_db.memory_bytes)
+pending_items.track("email_digest", callback=email_coalescer.pending)
+
+def coalesces(digest_key: Optional[str]) -> bool:
+    return digest_key is not None and email_coalescer.enabled
+
+def dispatch_email(record: dict, digest_key: Optional[str]):
+    """Queue an email for delivery, or hold it for its recipient's digest"""
+    if coalesces(digest_key):
+        email_coalescer.add((record["email_to"], digest_key), record)
+    else:
+        email_dispatcher.enqueue(EmailJob(record["id"], record["email_to"], record["subject"], record["body"]))
+
+def initial_status(send_at: Optional[datetime], digest_key: Optional[str]) -> str:
+    if is_future(send_at):
+        return "scheduled"
+    return "coalescing" if coalesces(digest_key) else "queued"
+
+def submit_email(record: dict, send_at: Optional[datetime], digest_key: Optional[str]):
+    """Dispatch a stored email now, or hand it to the scheduler if it is due later"""
+    if record["status"] == "scheduled":
+        scheduler.schedule(record["id"], "email", record["user_id"], send_at, {"digest_key": digest_key})
+    else:
+        dispatch_email(record, digest_key)
+
+def release_email(job):
+    """Scheduler callback: dispatch an email whose send_at has arrived"""
+    record = email_notifications_db.get(job.id)
+    if record is None:
+        print(f"Scheduled email {job.id} has no stored record; not sent")
+        return
+    if record["status"] != "scheduled":
+        return
+    digest_key = job.payload.get("digest_key")
+    email_notifications_db.update(job.id, status="coalescing" if coalesces(digest_key) else "queued")
+    dispatch_email(record, digest_key)
+
+def cancel_email(job):
+    email_notifications_db.update(job.id, status="cancelled")
+    email_batches.settle(job.id, False)
+
+scheduler.register("email", release_email, cancel_email)
+
 class EmailRequest(BaseModel):
     user_id: int
     email: EmailStr
-    subject: str
-    body: str
+    subject: Optional[str] = None
+    body: Optional[str] = None
+    template_id: Optional[str] = None
+    variables: Dict[str, Any] = {}
+    digest_key: Optional[str] = None
+    send_at: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def check_content(self):
+        if self.template_id is None and (self.subject is None or self.body is None):
+            raise ValueError("Provide subject and body, or a template_id")
+        return self
 
 class EmailNotificationResponse(BaseModel):
     id: str
@@ -40,10 +129,15 @@ class EmailNotificationResponse(BaseModel):
     subject: str
     body: str
     sent: bool
+    status: str
+    digest_id: Optional[str] = None
     created_at: str
 
 @router.post("/send_email")
 async def send_email(data: EmailRequest):
+    [content] = render_requests([data], "email")
+    if isinstance(content, TemplateRenderError):
+        raise HTTPException(status_code=422, detail=str(content))
     try:
         notification_id = str(uuid.uuid4())
         timestamp = datetime.now().isoformat()
@@ -52,40 +146,118 @@ async def send_email(data: EmailRequest):
             "id": notification_id,
             "user_id": data.user_id,
             "email_to": data.email,
-            "subject": data.subject,
-            "body": data.body,
-            "sent": True,
+            "subject": content["subject"],
+            "body": content["body"],
+            "sent": False,
+            "status": initial_status(data.send_at, data.digest_key),
+            "digest_id": None,
             "created_at": timestamp
         }
         
-        email_notifications_db.append(notification)
-        
-        message = MessageSchema(
-            subject=data.subject,
-            recipients=[data.email],
-            body=data.body,
-            subtype="html"
-        )
+        email_notifications_db.add(notification)
+        submit_email(notification, data.send_at, data.digest_key)
         
-        try:
-            fm = FastMail(conf)
-            await fm.send_message(message)
-        except Exception as email_error:
-            notification["sent"] = False
-            print(f"Email sending error: {str(email_error)}")
-        
-        return {"message": "Email notification processed", "notification_id": notification_id}
+        if notification["status"] == "scheduled":
+            return {"message": "Email notification scheduled", "notification_id": notification_id}
+        return {"message": "Email notification queued", "notification_id": notification_id}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process email: {str(e)}")
 
+@router.post("/batch", status_code=202)
+async def send_email_batch(request: Request):
+    """Queue one email per item of a JSON array or NDJSON body.
+
+    Items are send_email requests; templates are rendered once per chunk
+    for all the items that use them, and $name placeholders in plain
+    subjects and bodies are filled from each item's variables.
+    """
+    batch = email_batches.create()
+    results = []
+    async for chunk in validate_batch_items(request, EmailRequest, results):
+        timestamp = datetime.now().isoformat()
+        rendered = render_requests([item for _, item in chunk], "email")
+        records = []
+        delivery = []
+        for (index, item), content in zip(chunk, rendered):
+            if isinstance(content, TemplateRenderError):
+                results.append({"index": index, "error": str(content)})
+                continue
+            records.append({
+                "id": str(uuid.uuid4()),
+                "user_id": item.user_id,
+                "email_to": item.email,
+                "subject": content["subject"],
+                "body": content["body"],
+                "sent": False,
+                "status": initial_status(item.send_at, item.digest_key),
+                "digest_id": None,
+                "created_at": timestamp
+            })
+            delivery.append((item.send_at, item.digest_key))
+            results.append({"index": index, "id": records[-1]["id"]})
+        email_notifications_db.add_many(records)
+        for record, (send_at, digest_key) in zip(records, delivery):
+            email_batches.track(batch, record["id"])
+            submit_email(record, send_at, digest_key)
+    email_batches.finish(batch, results)
+    return {
+        "batch_id": batch["batch_id"],
+        "accepted": batch["accepted"],
+        "rejected": batch["rejected"],
+        "results": results
+    }
+
+@router.get("/batch/{batch_id}")
+async def get_email_batch(batch_id: str):
+    """Get delivery progress for an email batch"""
+    batch = email_batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
 @router.get("/users/{user_id}/notifications")
-def get_user_notifications(user_id: int):
-    """Get all email notifications for a user - for demo purposes returns test data in production"""
+async def get_user_notifications(
+    user_id: int,
+    request: Request,
+    response: Response,
+    sent: Optional[bool] = None,
+    status: Optional[str] = None,
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    format: Optional[str] = None,
+):
+    """Get a page of email notifications for a user - for demo purposes returns test data in production
 
-    user_notifications = [n for n in email_notifications_db if n["user_id"] == user_id]
+    Newest first unless order=asc, so the first page shows the latest mail.
+    before/after take the X-Next-Cursor value of a previous page;
+    format=ndjson streams every matching notification instead.
+    """
+    etag = await history_etag(email_notifications_db, user_id, request)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    filters = {}
+    if sent is not None:
+        filters["sent"] = sent
+    if status is not None:
+        filters["status"] = status
+    newest_first = order == "desc"
+    before_key = decode_cursor(before)
+    after_key = decode_cursor(after)
+    if wants_ndjson(request, format):
+        streaming = stream_ndjson(email_notifications_db, user_id, before_key, after_key, newest_first, filters)
+        set_cache_headers(streaming, etag)
+        return streaming
+    user_notifications, next_key = await email_notifications_db.page(
+        user_id, limit, before=before_key, after=after_key, newest_first=newest_first, filters=filters
+    )
+    set_next_cursor(response, next_key)
+    set_cache_headers(response, etag)
     
-    if not user_notifications and os.getenv("VERCEL") == "1":
+    if not user_notifications and before is None and after is None and os.getenv("VERCEL") == "1":
         return [
             {
                 "id": "sample-1",
@@ -94,6 +266,8 @@ def get_user_notifications(user_id: int):
                 "subject": "Welcome to Notifications",
                 "body": "This is a sample email notification",
                 "sent": True,
+                "status": "sent",
+                "digest_id": None,
                 "created_at": datetime.now().isoformat()
             },
             {
@@ -103,6 +277,8 @@ def get_user_notifications(user_id: int):
                 "subject": "Your Account Update",
                 "body": "This is another sample email notification",
                 "sent": True,
+                "status": "sent",
+                "digest_id": None,
                 "created_at": datetime.now().isoformat()
             }
         ]
@@ -0,0 +1,302 @@
+from collections import deque
+from email.message import EmailMessage
+from typing import Callable, Dict, Optional
+import asyncio
+import os
+import random
+import time
+
+import aiosmtplib
+
+from services.metrics import dispatch_queue_wait, provider_errors, provider_request_duration
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+# How many recent messages a FakeEmailTransport keeps for inspection
+FAKE_SENT_KEPT = 1000
+
+SHUTDOWN_ERROR = "Dispatcher stopped before the message was sent"
+
+# What sending on a session the server closed while it sat idle raises
+DROPPED_SESSION_ERRORS = (aiosmtplib.SMTPServerDisconnected, ConnectionError)
+
+
+class EmailJob:
+    __slots__ = ("notification_id", "to", "subject", "body", "attempts", "enqueued_at")
+
+    def __init__(self, notification_id: str, to: str, subject: str, body: str):
+        self.notification_id = notification_id
+        self.to = to
+        self.subject = subject
+        self.body = body
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+
+class SMTPTransport:
+    """Opens authenticated SMTP sessions that can send many messages each"""
+
+    def __init__(self, hostname: str, port: int, sender: str, username: Optional[str] = None,
+                 password: Optional[str] = None, use_tls: bool = False, start_tls: bool = True,
+                 validate_certs: bool = True, timeout: float = 30):
+        self.hostname = hostname
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.validate_certs = validate_certs
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls):
+        use_credentials = _env_flag("USE_CREDENTIALS", True)
+        return cls(
+            hostname=os.getenv("MAIL_SERVER", "smtp.example.com"),
+            port=int(os.getenv("MAIL_PORT", "587")),
+            sender=os.getenv("MAIL_FROM", "test@example.com"),
+            username=os.getenv("MAIL_USERNAME") if use_credentials else None,
+            password=os.getenv("MAIL_PASSWORD") if use_credentials else None,
+            use_tls=_env_flag("MAIL_SSL_TLS", False),
+            start_tls=_env_flag("MAIL_STARTTLS", True),
+            validate_certs=_env_flag("VALIDATE_CERTS", True),
+        )
+
+    async def open(self):
+        smtp = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            use_tls=self.use_tls,
+            start_tls=self.start_tls,
+            validate_certs=self.validate_certs,
+            timeout=self.timeout,
+        )
+        await smtp.connect()
+        if self.username and self.password:
+            await smtp.login(self.username, self.password)
+        return SMTPSession(smtp, self.sender)
+
+
+class SMTPSession:
+    def __init__(self, smtp, sender: str):
+        self.smtp = smtp
+        self.sender = sender
+
+    async def send(self, job: EmailJob):
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = job.to
+        message["Subject"] = job.subject
+        message.set_content(job.body, subtype="html")
+        await self.smtp.send_message(message)
+
+    async def close(self):
+        try:
+            await self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+
+
+class FakeEmailTransport:
+    """Stand-in SMTP server for tests and benchmarks with tunable latency and failures.
+
+    Counts every message but only keeps the last FAKE_SENT_KEPT in sent.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.sent_count = 0
+        self.sent = deque(maxlen=FAKE_SENT_KEPT)
+
+    async def open(self):
+        return FakeEmailSession(self)
+
+
+class FakeEmailSession:
+    def __init__(self, transport: FakeEmailTransport):
+        self.transport = transport
+
+    async def send(self, job: EmailJob):
+        if self.transport.latency:
+            await asyncio.sleep(self.transport.latency)
+        if random.random() < self.transport.error_rate:
+            raise aiosmtplib.SMTPResponseException(451, "Simulated server failure")
+        self.transport.sent_count += 1
+        self.transport.sent.append({"to": job.to, "subject": job.subject})
+
+    async def close(self):
+        pass
+
+
+def transport_from_env():
+    if os.getenv("MAIL_TRANSPORT", "smtp") == "fake":
+        return FakeEmailTransport(
+            latency=float(os.getenv("MAIL_FAKE_LATENCY_MS", "0")) / 1000,
+            error_rate=float(os.getenv("MAIL_FAKE_ERROR_RATE", "0")),
+        )
+    return SMTPTransport.from_env()
+
+
+class EmailDispatcher:
+    """In-process email delivery queue served by a pool of SMTP connections.
+
+    Each worker keeps one long-lived session open and reuses it for up to
+    max_messages_per_connection messages, closing it after idle_timeout
+    seconds without work. A reused session the server has already closed
+    is replaced and the message resent at once, without counting as an
+    attempt. Other failed sends drop the session and are requeued with
+    exponential backoff until max_retries is reached; on_result is called
+    with (notification_id, sent, error) once a job settles.
+    """
+
+    def __init__(self, transport, on_result: Callable, pool_size: int = 4, max_retries: int = 3,
+                 backoff_base: float = 1.0, max_messages_per_connection: int = 100,
+                 idle_timeout: float = 30.0):
+        self.transport = transport
+        self.on_result = on_result
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_messages_per_connection = max_messages_per_connection
+        self.idle_timeout = idle_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued_at = deque()
+        self._workers = []
+        self._retrying = set()
+        # Every job enqueued and not yet settled, by id
+        self._unsettled: Dict[str, EmailJob] = {}
+
+    @classmethod
+    def from_env(cls, transport, on_result: Callable):
+        return cls(
+            transport,
+            on_result,
+            pool_size=int(os.getenv("MAIL_POOL_SIZE", "4")),
+            max_retries=int(os.getenv("MAIL_MAX_RETRIES", "3")),
+            backoff_base=float(os.getenv("MAIL_RETRY_BACKOFF", "1.0")),
+            max_messages_per_connection=int(os.getenv("MAIL_MAX_MESSAGES_PER_CONNECTION", "100")),
+            idle_timeout=float(os.getenv("MAIL_IDLE_TIMEOUT", "30")),
+        )
+
+    def enqueue(self, job: EmailJob):
+        self.start()
+        self._unsettled[job.notification_id] = job
+        self._put(job)
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def oldest_age(self) -> float:
+        """Seconds since the job at the head of the queue was first enqueued"""
+        return time.monotonic() - self._queued_at[0] if self._queued_at else 0.0
+
+    def _put(self, job):
+        self._queued_at.append(job.enqueued_at)
+        self._queue.put_nowait(job)
+
+    def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._queued_at.clear()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.pool_size)]
+
+    async def stop(self, timeout: float = 10.0):
+        """Let queued jobs drain for up to timeout seconds, then stop the workers.
+
+        Jobs still unsent at that point, queued, backing off or in flight,
+        are settled as failed so their records do not stay queued.
+        """
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for handle in self._retrying:
+            handle.cancel()
+        self._retrying.clear()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._unsettled:
+            print(f"Email dispatcher stopped with {len(self._unsettled)} unsent messages; marking them failed")
+            for job in list(self._unsettled.values()):
+                self._settle(job, False, SHUTDOWN_ERROR)
+
+    async def _worker(self):
+        session = None
+        sent_on_session = 0
+        try:
+            while True:
+                try:
+                    job = await asyncio.wait_for(self._queue.get(), self.idle_timeout if session else None)
+                except asyncio.TimeoutError:
+                    await session.close()
+                    session, sent_on_session = None, 0
+                    continue
+                self._queued_at.popleft()
+                job.attempts += 1
+                dispatch_queue_wait.observe(time.monotonic() - job.enqueued_at, "email")
+                started = time.perf_counter()
+                try:
+                    if session is None:
+                        session = await self.transport.open()
+                        await session.send(job)
+                    else:
+                        try:
+                            await session.send(job)
+                        except DROPPED_SESSION_ERRORS:
+                            # The server timed the idle session out; one resend on a fresh one
+                            await session.close()
+                            session, sent_on_session = None, 0
+                            started = time.perf_counter()
+                            session = await self.transport.open()
+                            await session.send(job)
+                except Exception as e:
+                    provider_request_duration.observe(time.perf_counter() - started, "email")
+                    provider_errors.inc("email")
+                    if session is not None:
+                        await session.close()
+                    session, sent_on_session = None, 0
+                    self._retry_or_fail(job, e)
+                else:
+                    provider_request_duration.observe(time.perf_counter() - started, "email")
+                    self._settle(job, True, None)
+                    sent_on_session += 1
+                    if sent_on_session >= self.max_messages_per_connection:
+                        await session.close()
+                        session, sent_on_session = None, 0
+                finally:
+                    self._queue.task_done()
+        finally:
+            if session is not None:
+                await session.close()
+
+    def _retry_or_fail(self, job: EmailJob, error: Exception):
+        if job.attempts > self.max_retries:
+            print(f"Email sending error: {str(error)}")
+            self._settle(job, False, str(error))
+            return
+        delay = self.backoff_base * (2 ** (job.attempts - 1)) * (0.5 + random.random())
+        handle = None
+
+        def requeue():
+            self._retrying.discard(handle)
+            self._put(job)
+
+        handle = asyncio.get_running_loop().call_later(delay, requeue)
+        self._retrying.add(handle)
+
+    def _settle(self, job: EmailJob, sent: bool, error: Optional[str]):
+        self._unsettled.pop(job.notification_id, None)
+        try:
+            self.on_result(job.notification_id, sent, error)
+        except Exception as e:
+            print(f"Email result callback failed: {str(e)}")
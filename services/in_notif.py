@@ -1,13 +1,40 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
+import asyncio
+import json
 import uuid
 import os
+from database.backends import change_feed, create_store
+from database.models import InAppNotification
+from database.records import InAppRecord
+from database.store import InAppNotificationStore
+from services.batch import BatchTracker, render, validate_batch_items
+from services.caching import history_etag, not_modified, set_cache_headers
+from services.pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, json_default, set_next_cursor, stream_ndjson, wants_ndjson
+)
+from services.metrics import pending_items, store_memory_bytes, store_records_in_memory
+from services.pubsub import NotificationHub
+from services.scheduler import is_future, scheduler, to_local
 
 router = APIRouter()
 
-notifications_db = []
+notifications_db = create_store(InAppRecord, InAppNotification, "inapp", store_class=InAppNotificationStore)
+inapp_batches = BatchTracker("inapp", feed=change_feed)
+notification_hub = NotificationHub(
+    buffer_size=int(os.getenv("PUSH_BUFFER_SIZE", "100")),
+    history_size=int(os.getenv("PUSH_HISTORY_SIZE", "10000")),
+    feed=change_feed,
+)
+
+store_records_in_memory.track("inapp", callback=notifications_db.__len__)
+store_memory_bytes.track("inapp", callback=notifications_db.memory_bytes)
+pending_items.track("push_connections", callback=notification_hub.connection_count)
+
+SSE_HEARTBEAT_SECONDS = 15
 
 class NotificationCreate(BaseModel):
     user_id: int
@@ -15,6 +42,10 @@ class NotificationCreate(BaseModel):
     message: str
     notification_type: str = "info"  
     link: Optional[str] = None
+    send_at: Optional[datetime] = None
+
+class NotificationBatchItem(NotificationCreate):
+    variables: Dict[str, Any] = {}
 
 class Notification(BaseModel):
     id: str
@@ -26,32 +57,132 @@ class Notification(BaseModel):
     read: bool = False
     created_at: datetime
 
+def release_notification(job):
+    """Scheduler callback: show a scheduled notification once its send_at has arrived"""
+    record = dict(job.payload, created_at=datetime.now())
+    notifications_db.add(record)
+    notification_hub.publish(record["user_id"], "created", dict(record))
+    inapp_batches.settle(job.id, True)
+
+def cancel_notification(job):
+    inapp_batches.settle(job.id, False)
+
+scheduler.register("inapp", release_notification, cancel_notification)
+
 @router.post("/create", response_model=Notification, status_code=status.HTTP_201_CREATED)
 async def create_notification(notification: NotificationCreate):
     """Create a new in-app notification for a user"""
-    new_notification = Notification(
-        id=str(uuid.uuid4()),
-        user_id=notification.user_id,
-        title=notification.title,
-        message=notification.message,
-        notification_type=notification.notification_type,
-        link=notification.link,
-        read=False,
-        created_at=datetime.now()
-    )
+    scheduled = is_future(notification.send_at)
+    record = {
+        "id": str(uuid.uuid4()),
+        "user_id": notification.user_id,
+        "title": notification.title,
+        "message": notification.message,
+        "notification_type": notification.notification_type,
+        "link": notification.link,
+        "read": False,
+        "created_at": to_local(notification.send_at) if scheduled else datetime.now()
+    }
     
-    notifications_db.append(new_notification.dict())
-    return new_notification
+    if scheduled:
+        scheduler.schedule(record["id"], "inapp", record["user_id"], notification.send_at, record)
+        return record
+    notifications_db.add(record)
+    notification_hub.publish(record["user_id"], "created", dict(record))
+    return record
+
+@router.post("/batch", status_code=status.HTTP_201_CREATED)
+async def create_notification_batch(request: Request):
+    """Create one in-app notification per item of a JSON array or NDJSON body.
+
+    $name placeholders in each item's title and message are filled from its
+    variables. Items with a future send_at are held by the scheduler and
+    only appear in the user's feed, and count as delivered, once they are
+    due.
+    """
+    batch = inapp_batches.create()
+    results = []
+    async for chunk in validate_batch_items(request, NotificationBatchItem, results):
+        created_at = datetime.now()
+        records = []
+        for index, item in chunk:
+            record = {
+                "id": str(uuid.uuid4()),
+                "user_id": item.user_id,
+                "title": render(item.title, item.variables),
+                "message": render(item.message, item.variables),
+                "notification_type": item.notification_type,
+                "link": item.link,
+                "read": False,
+                "created_at": created_at
+            }
+            if is_future(item.send_at):
+                inapp_batches.track(batch, record["id"])
+                scheduler.schedule(record["id"], "inapp", record["user_id"], item.send_at, record)
+            else:
+                records.append(record)
+            results.append({"index": index, "id": record["id"]})
+        notifications_db.add_many(records)
+        for record in records:
+            notification_hub.publish(record["user_id"], "created", dict(record))
+    inapp_batches.finish(batch, results, delivered=True)
+    return {
+        "batch_id": batch["batch_id"],
+        "accepted": batch["accepted"],
+        "rejected": batch["rejected"],
+        "results": results
+    }
+
+@router.get("/batch/{batch_id}")
+async def get_notification_batch(batch_id: str):
+    """Get the result counts for an in-app notification batch"""
+    batch = inapp_batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
 
 @router.get("/user/{user_id}", response_model=List[dict])
-async def get_user_notifications(user_id: int, unread_only: bool = False):
-    """Get all notifications for a user"""
+async def get_user_notifications(
+    user_id: int,
+    request: Request,
+    response: Response,
+    unread_only: bool = False,
+    read: Optional[bool] = None,
+    notification_type: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    format: Optional[str] = None,
+):
+    """Get a page of notifications for a user, newest first.
+
+    before/after take the X-Next-Cursor value of a previous page;
+    format=ndjson streams every matching notification instead.
+    """
     if unread_only:
-        user_notifications = [n for n in notifications_db if n["user_id"] == user_id and not n["read"]]
-    else:
-        user_notifications = [n for n in notifications_db if n["user_id"] == user_id]
+        read = False
+    etag = await history_etag(notifications_db, user_id, request)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    filters = {}
+    if read is not None:
+        filters["read"] = read
+    if notification_type is not None:
+        filters["notification_type"] = notification_type
+    before_key = decode_cursor(before)
+    after_key = decode_cursor(after)
+    if wants_ndjson(request, format):
+        streaming = stream_ndjson(notifications_db, user_id, before_key, after_key, True, filters)
+        set_cache_headers(streaming, etag)
+        return streaming
+    user_notifications, next_key = await notifications_db.page(
+        user_id, limit, before=before_key, after=after_key, filters=filters
+    )
+    set_next_cursor(response, next_key)
+    set_cache_headers(response, etag)
     
-    if not user_notifications and os.getenv("VERCEL") == "1":
+    if not user_notifications and before is None and after is None and os.getenv("VERCEL") == "1":
         sample_notifications = [
             {
                 "id": f"{user_id}-sample-1",
@@ -86,16 +217,29 @@ async def get_user_notifications(user_id: int, unread_only: bool = False):
         ]
         return sample_notifications
     
-    user_notifications.sort(key=lambda x: x["created_at"], reverse=True)
     return user_notifications
 
+@router.get("/user/{user_id}/summary")
+async def get_notification_summary(user_id: int, request: Request, response: Response):
+    """Get a user's unread and total notification counts"""
+    etag = await history_etag(notifications_db, user_id, request)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    set_cache_headers(response, etag)
+    return {
+        "user_id": user_id,
+        "unread_count": await notifications_db.unread_count(user_id),
+        "total_count": await notifications_db.count(user_id)
+    }
+
 @router.put("/{notification_id}/mark-read")
 async def mark_notification_read(notification_id: str):
     """Mark a notification as read"""
-    for notification in notifications_db:
-        if notification["id"] == notification_id:
-            notification["read"] = True
-            return {"success": True}
+    record = await notifications_db.mark_read(notification_id)
+    if record is not None:
+        notification_hub.publish(record["user_id"], "read", {"id": notification_id})
+        return {"success": True}
     
     if os.getenv("VERCEL") == "1":
         return {"success": True, "note": "Sample notification marked as read"}
@@ -105,22 +249,80 @@ async def mark_notification_read(notification_id: str):
 @router.put("/user/{user_id}/mark-all-read")
 async def mark_all_notifications_read(user_id: int):
     """Mark all user notifications as read"""
-    updated_count = 0
-    for notification in notifications_db:
-        if notification["user_id"] == user_id and not notification["read"]:
-            notification["read"] = True
-            updated_count += 1
+    updated_count = await notifications_db.mark_all_read(user_id)
+    if updated_count:
+        notification_hub.publish(user_id, "read_all", {"count": updated_count})
     
     return {"success": True, "marked_read_count": updated_count}
 
 @router.delete("/{notification_id}")
 async def delete_notification(notification_id: str):
     """Delete a notification"""
-    global notifications_db
-    original_length = len(notifications_db)
-    notifications_db = [n for n in notifications_db if n["id"] != notification_id]
+    deleted = await notifications_db.delete(notification_id)
+    if deleted is not None:
+        notification_hub.publish(deleted["user_id"], "deleted", {"id": notification_id})
     
-    if len(notifications_db) == original_length and os.getenv("VERCEL") != "1":
+    if deleted is None and os.getenv("VERCEL") != "1":
         raise HTTPException(status_code=404, detail="Notification not found")
     
-    return {"success": True}
\ No newline at end of file
+    return {"success": True}
+
+@router.websocket("/ws/{user_id}")
+async def notification_socket(websocket: WebSocket, user_id: int, last_event_id: Optional[str] = None):
+    """Push a user's notification events over a WebSocket as JSON messages"""
+    await websocket.accept()
+    subscription = notification_hub.subscribe(user_id, last_event_id)
+
+    async def send_events():
+        while True:
+            event = await subscription.get()
+            await websocket.send_text(json.dumps(event, default=json_default))
+
+    async def wait_for_disconnect():
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    tasks = [asyncio.create_task(send_events()), asyncio.create_task(wait_for_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        notification_hub.unsubscribe(subscription)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+@router.get("/stream/{user_id}")
+async def notification_events(user_id: int, request: Request, last_event_id: Optional[str] = None):
+    """Push a user's notification events as Server-Sent Events.
+
+    Reconnecting clients resume from the Last-Event-ID header (or the
+    last_event_id query parameter).
+    """
+    subscription = notification_hub.subscribe(
+        user_id, request.headers.get("last-event-id") or last_event_id
+    )
+
+    async def events():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                data = json.dumps(event, default=json_default)
+                if event["id"]:
+                    yield f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+                else:
+                    yield f"event: {event['type']}\ndata: {data}\n\n"
+        finally:
+            notification_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
\ No newline at end of file
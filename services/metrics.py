@@ -0,0 +1,230 @@
+from bisect import bisect_left
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from typing import Callable, Dict, Optional, Tuple
+import asyncio
+import os
+import time
+
+router = APIRouter()
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Gauge:
+    """A gauge whose values are set directly or read from callbacks at scrape time"""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple, float] = {}
+        self._callbacks: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+    def track(self, *labels, callback: Callable[[], float]):
+        self._callbacks[labels] = callback
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        values = dict(self._values)
+        for labels, callback in self._callbacks.items():
+            try:
+                values[labels] = callback()
+            except Exception as e:
+                print(f"Metric {self.name} callback failed: {str(e)}")
+        for labels, value in values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is one bisect and two adds"""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                bucket_labels = _labels(self.labelnames, labels, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to serve an HTTP request", ("method", "route", "status")
+))
+provider_request_duration = registry.register(Histogram(
+    "provider_request_duration_seconds", "Time spent in one call to an email or SMS provider", ("channel",)
+))
+provider_errors = registry.register(Counter(
+    "provider_errors_total", "Failed provider calls, including ones that are retried", ("channel",)
+))
+dispatch_queue_depth = registry.register(Gauge(
+    "dispatch_queue_depth", "Jobs waiting in a dispatcher queue", ("channel",)
+))
+dispatch_queue_wait = registry.register(Histogram(
+    "dispatch_queue_wait_seconds", "Age of a job when a worker takes it, counted from its first enqueue", ("channel",)
+))
+dispatch_queue_oldest = registry.register(Gauge(
+    "dispatch_queue_oldest_seconds", "Age of the job at the head of a dispatcher queue, counted from its first enqueue",
+    ("channel",)
+))
+store_records_in_memory = registry.register(Gauge(
+    "store_records_in_memory",
+    "Notification records held in memory; with the sqlite backend older records are only in the database",
+    ("channel",)
+))
+store_memory_bytes = registry.register(Gauge(
+    "store_memory_bytes", "Approximate bytes held by in-memory notification records", ("channel",)
+))
+event_loop_lag = registry.register(Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a timer that should have fired on time",
+))
+pending_items = registry.register(Gauge(
+    "pending_items", "Items held by schedulers, digest coalescers and push connections", ("kind",)
+))
+
+
+def route_template(scope) -> str:
+    """Path template of the route that matched the request, e.g. /inapp/{notification_id}"""
+    template = getattr(scope.get("route"), "path", None)
+    if template is None:
+        return "unmatched"
+    # Routes of an included router may only carry their own part of the
+    # path; the segments in front of it are the router's fixed prefix
+    parts = scope["path"].split("/")
+    prefix = "/".join(parts[:len(parts) - len(template.split("/")) + 1])
+    return prefix + template
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by its route template.
+
+    Requests that match no route are counted under "unmatched" so that
+    arbitrary paths cannot grow the number of series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], route_template(scope), status)
+
+
+class LoopLagMonitor:
+    """Samples event-loop lag by measuring how late a periodic sleep wakes up"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            event_loop_lag.observe(max(0.0, time.perf_counter() - started - self.interval))
+
+
+loop_lag_monitor = LoopLagMonitor()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Expose metrics in the Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
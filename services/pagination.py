@@ -0,0 +1,70 @@
+from datetime import datetime
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Optional, Tuple
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 500
+
+
+def encode_cursor(key: Tuple) -> str:
+    raw = json.dumps(list(key)).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple]:
+    """Turn a before/after cursor back into a (created_at, id) store key"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, record_id = json.loads(raw)
+        return (int(created_at), str(record_id))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def wants_ndjson(request: Request, format: Optional[str]) -> bool:
+    if format is not None:
+        return format == "ndjson"
+    return "application/x-ndjson" in request.headers.get("accept", "")
+
+
+def set_next_cursor(response: Response, key: Optional[Tuple]):
+    if key is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(key)
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def stream_ndjson(store, user_id: int, before: Optional[Tuple], after: Optional[Tuple],
+                  newest_first: bool, filters: Optional[dict] = None) -> StreamingResponse:
+    """Stream every matching record as NDJSON, one page at a time.
+
+    Each chunk re-seeks from the last key sent, so memory stays constant
+    and records written while the export runs do not break the walk.
+    """
+    async def lines():
+        lo, hi = after, before
+        while True:
+            records, next_key = await store.page(
+                user_id, STREAM_CHUNK_SIZE, before=hi, after=lo,
+                newest_first=newest_first, filters=filters,
+            )
+            if records:
+                yield "".join(json.dumps(r, default=json_default) + "\n" for r in records)
+            if next_key is None:
+                return
+            if newest_first:
+                hi = next_key
+            else:
+                lo = next_key
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,106 @@
+from collections import Counter
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+import os
+import sys
+import threading
+import time
+
+router = APIRouter()
+
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() in ("1", "true", "yes")
+MAX_STACK_DEPTH = 64
+
+
+class SamplingProfiler:
+    """Periodically records the stack of one thread, normally the event loop.
+
+    A daemon thread wakes every interval, reads the target thread's current
+    frame and counts it as a collapsed stack ("file:function;..."), the
+    input format of flamegraph tools. Nothing runs on the event loop itself
+    and nothing is installed in the interpreter while it is stopped.
+    """
+
+    def __init__(self):
+        self.interval = 0.005
+        self.samples: Counter = Counter()
+        self.started_at: Optional[float] = None
+        self._target: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float):
+        if self.running:
+            return
+        self.interval = interval
+        self.samples = Counter()
+        self.started_at = time.time()
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "started_at": self.started_at,
+            "samples": sum(self.samples.values()),
+        }
+
+    def collapsed(self, limit: int) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common(limit))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+
+profiler = SamplingProfiler()
+
+
+def _check_enabled():
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled; set PROFILER_ENABLED=1")
+
+
+@router.post("/start")
+async def start_profiler(interval_ms: float = Query(5, ge=1, le=1000)):
+    """Start sampling the event loop thread"""
+    _check_enabled()
+    profiler.start(interval_ms / 1000)
+    return profiler.status()
+
+
+@router.post("/stop")
+async def stop_profiler():
+    """Stop sampling; collected stacks stay available until the next start"""
+    _check_enabled()
+    profiler.stop()
+    return profiler.status()
+
+
+@router.get("", response_class=PlainTextResponse)
+async def profiler_stacks(limit: int = Query(200, ge=1, le=10000)):
+    """Most frequent sampled stacks in collapsed (flamegraph) format"""
+    _check_enabled()
+    return PlainTextResponse(profiler.collapsed(limit))
@@ -0,0 +1,117 @@
+from collections import deque
+from typing import Dict, List, Optional, Set
+import asyncio
+import itertools
+import uuid
+
+RESYNC = "resync"
+
+
+class Subscription:
+    """One connection's view of a user's event stream.
+
+    The buffer holds at most maxsize events. A client that falls that far
+    behind has its backlog replaced by a single resync event, telling it to
+    reload instead of letting the buffer grow without bound.
+    """
+
+    def __init__(self, user_id: int, maxsize: int):
+        self.user_id = user_id
+        self.maxsize = maxsize
+        self.overflows = 0
+        self._buffer = deque()
+        self._ready = asyncio.Event()
+
+    def push(self, event: dict):
+        if len(self._buffer) >= self.maxsize:
+            self._buffer.clear()
+            self._buffer.append({"id": None, "type": RESYNC, "data": None})
+            self.overflows += 1
+        self._buffer.append(event)
+        self._ready.set()
+
+    async def get(self) -> dict:
+        while not self._buffer:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._buffer.popleft()
+
+
+class NotificationHub:
+    """In-process fan-out of per-user notification events.
+
+    Every event gets an id of the form "<epoch>:<sequence>" and is kept in
+    a ring of the last history_size events, so a reconnecting client can
+    pass its last seen id and receive only what it missed. Ids from a
+    previous process, or older than the ring, produce a resync event
+    instead.
+
+    With a change feed, published events are also sent to the hubs of the
+    other worker processes, which deliver them to their own connections
+    under their own ids.
+    """
+
+    def __init__(self, buffer_size: int = 100, history_size: int = 10000, feed=None):
+        self.buffer_size = buffer_size
+        self.feed = feed
+        self.epoch = uuid.uuid4().hex[:8]
+        self._sequence = itertools.count(1)
+        self._history = deque(maxlen=history_size)
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        if feed is not None:
+            feed.subscribe("push", self._publish_remote)
+
+    def publish(self, user_id: int, event_type: str, data) -> dict:
+        if self.feed is not None:
+            self.feed.publish("push", event_type, user_id, data)
+        return self._publish_local(user_id, event_type, data)
+
+    def _publish_remote(self, event_type: str, user_id: int, data):
+        self._publish_local(user_id, event_type, data)
+
+    def _publish_local(self, user_id: int, event_type: str, data) -> dict:
+        event = {
+            "id": f"{self.epoch}:{next(self._sequence)}",
+            "user_id": user_id,
+            "type": event_type,
+            "data": data,
+        }
+        self._history.append(event)
+        for subscription in self._subscribers.get(user_id, ()):
+            subscription.push(event)
+        return event
+
+    def subscribe(self, user_id: int, last_event_id: Optional[str] = None) -> Subscription:
+        subscription = Subscription(user_id, self.buffer_size)
+        if last_event_id:
+            for event in self._replay(user_id, last_event_id):
+                subscription.push(event)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscribers.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.user_id]
+
+    def connection_count(self) -> int:
+        return sum(len(s) for s in self._subscribers.values())
+
+    def _replay(self, user_id: int, last_event_id: str) -> List[dict]:
+        epoch, _, sequence = last_event_id.partition(":")
+        if epoch != self.epoch or not sequence.isdigit():
+            return [{"id": None, "type": RESYNC, "data": None}]
+        last = int(sequence)
+        oldest = int(self._history[0]["id"].partition(":")[2]) if self._history else last + 1
+        if last + 1 < oldest:
+            return [{"id": None, "type": RESYNC, "data": None}]
+        missed = []
+        for event in reversed(self._history):
+            if int(event["id"].partition(":")[2]) <= last:
+                break
+            if event["user_id"] == user_id:
+                missed.append(event)
+        missed.reverse()
+        return missed
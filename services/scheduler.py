@@ -0,0 +1,352 @@
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query
+from sqlalchemy import delete, select
+from typing import Any, Callable, Dict, List, Optional, Set
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+
+from database.backends import PERSISTENT, change_feed
+from database.database import SessionLocal
+from database.models import ScheduledJob
+from database.persistence import writer
+from services.metrics import pending_items
+from services.pagination import json_default
+from services.ratelimit import TokenBucket
+
+router = APIRouter()
+
+MAX_RETRY_DELAY = 30.0
+
+
+def to_local(moment: datetime) -> datetime:
+    """Normalise a send_at value to the naive local time used for records"""
+    if moment.tzinfo is not None:
+        return moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+def is_future(moment: Optional[datetime]) -> bool:
+    return moment is not None and to_local(moment) > datetime.now()
+
+
+class PendingJob:
+    __slots__ = ("id", "channel", "user_id", "payload", "due_at", "status")
+
+    def __init__(self, id: str, channel: str, user_id: int, payload: Any, due_at: datetime, status: str = "pending"):
+        self.id = id
+        self.channel = channel
+        self.user_id = user_id
+        self.payload = payload
+        self.due_at = due_at
+        self.status = status
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "channel": self.channel,
+            "user_id": self.user_id,
+            "due_at": self.due_at.isoformat(),
+            "status": self.status,
+        }
+
+
+class Scheduler:
+    """Persistent timer queue for delayed deliveries.
+
+    Pending jobs live in a min-heap ordered by due time and in the
+    scheduled_jobs table, so they survive restarts. A single task sleeps
+    until the earliest due time; due jobs are then handed to their
+    channel's release handler at no more than release_rate per second,
+    so a large set of jobs due at the same instant is spread out evenly
+    rather than released as one spike. Cancelled jobs are left in the
+    heap and skipped when they reach the top. The table is read in a
+    worker thread, and a pass that fails (typically "database is locked"
+    while other workers write) is logged and retried with backoff.
+
+    Several worker processes can share the table: new jobs are announced
+    through the change feed so every process tracks every job, and a job
+    is only released or cancelled by the process whose conditional DELETE
+    of its pending row succeeds, so each job fires exactly once and the
+    table only ever holds pending jobs. release_rate applies per process,
+    with bursts of at most a hundredth of a second's worth of jobs.
+
+    Without persistence (the memory backend) jobs only live in this
+    process, like the records they release.
+    """
+
+    def __init__(self, release_rate: float = 500.0, feed=None, persistent: bool = True):
+        self.release_rate = release_rate
+        self.feed = feed
+        self.persistent = persistent
+        self._claim_batch = max(1, int(release_rate / 10))
+        self._bucket = TokenBucket(release_rate, burst=max(1.0, release_rate / 100))
+        self._heap = []
+        self._sequence = itertools.count()
+        self._jobs: Dict[str, PendingJob] = {}
+        self._by_user: Dict[int, Set[str]] = {}
+        self._handlers: Dict[str, tuple] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loaded = False
+        self._loading: Optional[asyncio.Future] = None
+        if feed is not None:
+            feed.subscribe("scheduler", self._apply_change)
+
+    def register(self, channel: str, on_release: Callable[[PendingJob], None],
+                 on_cancel: Optional[Callable[[PendingJob], None]] = None):
+        self._handlers[channel] = (on_release, on_cancel)
+
+    def pending(self) -> int:
+        return len(self._jobs)
+
+    def schedule(self, job_id: str, channel: str, user_id: int, due_at: datetime, payload: Any = None) -> PendingJob:
+        self.start()
+        job = PendingJob(job_id, channel, user_id, payload, to_local(due_at))
+        self._add(job)
+        if self.persistent:
+            writer.insert(ScheduledJob, [{
+                "id": job.id,
+                "channel": channel,
+                "user_id": user_id,
+                "payload": json.dumps(payload, default=json_default),
+                "due_at": job.due_at,
+                "status": "pending",
+            }])
+        if self.feed is not None:
+            self.feed.publish("scheduler", "schedule", user_id, {
+                "id": job.id, "channel": channel, "payload": payload, "due_at": job.due_at,
+            })
+        self._wake_if_first(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[PendingJob]:
+        await self._ensure_loaded()
+        return self._jobs.get(job_id)
+
+    async def list(self, channel: Optional[str] = None, user_id: Optional[int] = None, limit: int = 100):
+        await self._ensure_loaded()
+        ids = self._by_user.get(user_id, ()) if user_id is not None else self._jobs.keys()
+        jobs = (self._jobs[i] for i in ids)
+        if channel is not None:
+            jobs = (j for j in jobs if j.channel == channel)
+        return heapq.nsmallest(limit, jobs, key=lambda j: j.due_at)
+
+    async def cancel(self, job_id: str) -> Optional[PendingJob]:
+        """Cancel a pending job, or return None if it is unknown or already released"""
+        job = await self.get(job_id)
+        if job is None:
+            return None
+        claimed = await self._claim_jobs([job_id])
+        self._remove(job)
+        if not claimed:
+            return None
+        job.status = "cancelled"
+        self._announce_done(claimed)
+        on_cancel = self._handlers.get(job.channel, (None, None))[1]
+        if on_cancel is not None:
+            on_cancel(job)
+        return job
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _ensure_loaded(self):
+        """Read the pending jobs from the table once, in a worker thread"""
+        if self._loaded:
+            return
+        if not self.persistent:
+            self._loaded = True
+            return
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(asyncio.to_thread(self._read_pending))
+        try:
+            jobs = await asyncio.shield(self._loading)
+        except Exception:
+            self._loading = None
+            raise
+        if not self._loaded:
+            self._loaded = True
+            for job in jobs:
+                if job.id not in self._jobs:
+                    self._add(job)
+
+    def _read_pending(self) -> List[PendingJob]:
+        stmt = select(ScheduledJob).where(ScheduledJob.status == "pending")
+        with SessionLocal() as session:
+            # Rows left behind by versions that kept finished jobs
+            session.execute(delete(ScheduledJob).where(ScheduledJob.status != "pending"))
+            session.commit()
+            return [
+                PendingJob(row.id, row.channel, row.user_id, json.loads(row.payload) if row.payload else None, row.due_at)
+                for row in session.scalars(stmt)
+            ]
+
+    async def _claim_jobs(self, job_ids: List[str]) -> List[str]:
+        if not self.persistent:
+            # Only this process holds the jobs
+            return [job_id for job_id in job_ids if job_id in self._jobs]
+        return await asyncio.to_thread(self._claim, job_ids)
+
+    def _claim(self, job_ids: List[str]) -> List[str]:
+        """Delete pending jobs' rows, returning the ids this process won.
+
+        Runs in a worker thread; pending writes are flushed first so jobs
+        scheduled a moment ago are already in the table.
+        """
+        writer.flush()
+        claimed = []
+        with SessionLocal() as session:
+            for job_id in job_ids:
+                result = session.execute(
+                    delete(ScheduledJob).where(ScheduledJob.id == job_id, ScheduledJob.status == "pending")
+                )
+                if result.rowcount:
+                    claimed.append(job_id)
+            session.commit()
+        return claimed
+
+    def _announce_done(self, job_ids: List[str]):
+        if self.feed is not None and job_ids:
+            self.feed.publish("scheduler", "done", None, {"ids": job_ids})
+
+    def _apply_change(self, op: str, user_id: Optional[int], payload: dict):
+        if op == "done":
+            for job_id in payload["ids"]:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    self._remove(job)
+        elif (self._loaded or self._loading is not None) and payload["id"] not in self._jobs:
+            job = PendingJob(payload["id"], payload["channel"], user_id, payload["payload"],
+                             datetime.fromisoformat(payload["due_at"]))
+            self._add(job)
+            self._wake_if_first(job)
+
+    def _wake_if_first(self, job: PendingJob):
+        if self._wakeup is not None and self._heap[0][2] == job.id:
+            self._wakeup.set()
+
+    def _add(self, job: PendingJob):
+        self._jobs[job.id] = job
+        self._by_user.setdefault(job.user_id, set()).add(job.id)
+        heapq.heappush(self._heap, (job.due_at.timestamp(), next(self._sequence), job.id))
+
+    def _remove(self, job: PendingJob):
+        self._jobs.pop(job.id, None)
+        user_jobs = self._by_user.get(job.user_id)
+        if user_jobs is not None:
+            user_jobs.discard(job.id)
+            if not user_jobs:
+                del self._by_user[job.user_id]
+
+    async def _run(self):
+        retry_delay = 0.1
+        while True:
+            try:
+                await self._ensure_loaded()
+                await self._release_due()
+                retry_delay = 0.1
+            except Exception as e:
+                # Typically "database is locked" while other workers write
+                print(f"Scheduler pass failed, retrying in {retry_delay:.1f}s: {str(e)}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+
+    async def _release_due(self):
+        """Wait for the earliest job to fall due, then release one batch of due jobs"""
+        while self._heap and self._heap[0][2] not in self._jobs:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+            return
+        delay = self._heap[0][0] - time.time()
+        if delay > 0:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            return
+        due = []
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now and len(due) < self._claim_batch:
+            entry = heapq.heappop(self._heap)
+            if entry[2] in self._jobs:
+                due.append(entry)
+        if not due:
+            return
+        try:
+            claimed = set(await self._claim_jobs([job_id for _, _, job_id in due]))
+        except Exception:
+            # Put the batch back so the next pass claims it again
+            for entry in due:
+                heapq.heappush(self._heap, entry)
+            raise
+        self._announce_done(list(claimed))
+        for _, _, job_id in due:
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            if job_id not in claimed:
+                self._remove(job)
+                continue
+            await self._bucket.acquire()
+            self._release(job)
+
+    def _release(self, job: PendingJob):
+        self._remove(job)
+        job.status = "released"
+        on_release = self._handlers.get(job.channel, (None, None))[0]
+        if on_release is None:
+            print(f"No release handler for scheduled {job.channel} job {job.id}")
+            return
+        try:
+            on_release(job)
+        except Exception as e:
+            print(f"Scheduled {job.channel} job {job.id} failed: {str(e)}")
+
+
+scheduler = Scheduler(
+    release_rate=float(os.getenv("SCHEDULER_RELEASE_RATE", "500")), feed=change_feed, persistent=PERSISTENT
+)
+pending_items.track("scheduled_jobs", callback=scheduler.pending)
+
+
+@router.get("/jobs")
+async def list_scheduled_jobs(
+    channel: Optional[str] = None,
+    user_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """List pending scheduled deliveries, soonest first"""
+    return [job.to_dict() for job in await scheduler.list(channel, user_id, limit)]
+
+
+@router.get("/jobs/{job_id}")
+async def get_scheduled_job(job_id: str):
+    """Get a pending scheduled delivery"""
+    job = await scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scheduled job not found")
+    return job.to_dict()
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_scheduled_job(job_id: str):
+    """Cancel a pending scheduled delivery"""
+    job = await scheduler.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scheduled job not found")
+    return {"success": True, "job": job.to_dict()}
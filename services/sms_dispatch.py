@@ -0,0 +1,266 @@
+from collections import deque
+from itertools import cycle
+from typing import Callable, Dict, List, Optional
+import asyncio
+import os
+import random
+import time
+import uuid
+
+from services.metrics import dispatch_queue_wait, provider_errors, provider_request_duration
+from services.ratelimit import TokenBucket
+
+SHUTDOWN_ERROR = "Dispatcher stopped before the message was sent"
+
+# How many recent messages a FakeSMSTransport keeps for inspection
+FAKE_SENT_KEPT = 1000
+
+
+class SMSDeliveryError(Exception):
+    """Provider rejected a message; retryable says whether trying again can help"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class SMSJob:
+    __slots__ = ("sms_id", "to", "body", "from_", "attempts", "enqueued_at")
+
+    def __init__(self, sms_id: str, to: str, body: str):
+        self.sms_id = sms_id
+        self.to = to
+        self.body = body
+        self.from_ = None
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+
+class TwilioTransport:
+    """Sends through Twilio's REST API using its aiohttp-based async client"""
+
+    def __init__(self, account_sid: str, auth_token: str):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.http_client = None
+        self.client = None
+
+    async def send(self, from_: str, to: str, body: str) -> str:
+        from twilio.base.exceptions import TwilioRestException
+
+        if self.client is None:
+            # The aiohttp session has to be created inside the running loop
+            from twilio.http.async_http_client import AsyncTwilioHttpClient
+            from twilio.rest import Client
+
+            self.http_client = AsyncTwilioHttpClient()
+            self.client = Client(self.account_sid, self.auth_token, http_client=self.http_client)
+        try:
+            message = await self.client.messages.create_async(body=body, from_=from_, to=to)
+        except TwilioRestException as e:
+            raise SMSDeliveryError(e.msg, retryable=e.status == 429 or e.status >= 500)
+        return message.sid
+
+    async def close(self):
+        if self.http_client is not None:
+            await self.http_client.close()
+            self.http_client = self.client = None
+
+
+class FakeSMSTransport:
+    """Stand-in provider for tests and benchmarks with tunable latency and failures.
+
+    Counts every message but only keeps the last FAKE_SENT_KEPT in sent.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.sent_count = 0
+        self.sent: "deque[Dict]" = deque(maxlen=FAKE_SENT_KEPT)
+
+    async def send(self, from_: str, to: str, body: str) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            raise SMSDeliveryError("Simulated provider failure")
+        sid = f"FAKE{uuid.uuid4().hex}"
+        self.sent_count += 1
+        self.sent.append({"sid": sid, "from": from_, "to": to, "body": body})
+        return sid
+
+    async def close(self):
+        pass
+
+
+class LogSMSTransport:
+    """Used when no provider is configured: logs the message instead of sending it"""
+
+    async def send(self, from_: str, to: str, body: str) -> Optional[str]:
+        print("Twilio not configured. SMS would have been sent to:", to)
+        return None
+
+    async def close(self):
+        pass
+
+
+def transport_from_env():
+    kind = os.getenv("SMS_TRANSPORT", "twilio")
+    if kind == "fake":
+        return FakeSMSTransport(
+            latency=float(os.getenv("SMS_FAKE_LATENCY_MS", "0")) / 1000,
+            error_rate=float(os.getenv("SMS_FAKE_ERROR_RATE", "0")),
+        )
+    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+    if kind == "twilio" and account_sid and auth_token:
+        return TwilioTransport(account_sid, auth_token)
+    return LogSMSTransport()
+
+
+class SMSDispatcher:
+    """Bounded pool of async SMS workers with per-sender rate limiting.
+
+    Jobs are assigned a sender number round-robin and every send first
+    takes a token from that number's bucket, so throughput stays within the
+    provider's per-number cap; a rate_per_sender of 0 sends without limit.
+    Retryable failures are requeued with exponential backoff; on_result is
+    called with (sms_id, sid, error, attempts) once a job settles.
+    """
+
+    def __init__(self, transport, on_result: Callable, senders: List[str], workers: int = 8,
+                 rate_per_sender: float = 1.0, burst: float = 1.0, max_retries: int = 3,
+                 backoff_base: float = 1.0, max_queue: int = 0):
+        self.transport = transport
+        self.on_result = on_result
+        self.senders = senders or [None]
+        self.worker_count = workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_queue = max_queue
+        self._buckets = {}
+        if rate_per_sender > 0:
+            self._buckets = {sender: TokenBucket(rate_per_sender, burst) for sender in self.senders}
+        self._next_sender = cycle(self.senders)
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued_at = deque()
+        self._workers = []
+        self._retrying = set()
+        # Every job enqueued and not yet settled, by id
+        self._unsettled: Dict[str, SMSJob] = {}
+
+    @classmethod
+    def from_env(cls, transport, on_result: Callable):
+        numbers = os.getenv("TWILIO_PHONE_NUMBERS") or os.getenv("TWILIO_PHONE_NUMBER") or ""
+        return cls(
+            transport,
+            on_result,
+            senders=[n.strip() for n in numbers.split(",") if n.strip()],
+            workers=int(os.getenv("SMS_WORKERS", "8")),
+            # Messages that are only logged have no provider cap to respect
+            rate_per_sender=0 if isinstance(transport, LogSMSTransport) else float(os.getenv("SMS_RATE_PER_SECOND", "1")),
+            burst=float(os.getenv("SMS_BURST", "1")),
+            max_retries=int(os.getenv("SMS_MAX_RETRIES", "3")),
+            backoff_base=float(os.getenv("SMS_RETRY_BACKOFF", "1.0")),
+            max_queue=int(os.getenv("SMS_MAX_QUEUE", "0")),
+        )
+
+    def enqueue(self, job: SMSJob):
+        """Queue a job; raises asyncio.QueueFull when max_queue jobs are waiting"""
+        self.start()
+        if self.max_queue and self._queue.qsize() >= self.max_queue:
+            raise asyncio.QueueFull()
+        job.from_ = next(self._next_sender)
+        self._unsettled[job.sms_id] = job
+        self._put(job)
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def oldest_age(self) -> float:
+        """Seconds since the job at the head of the queue was first enqueued"""
+        return time.monotonic() - self._queued_at[0] if self._queued_at else 0.0
+
+    def _put(self, job):
+        self._queued_at.append(job.enqueued_at)
+        self._queue.put_nowait(job)
+
+    def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._queued_at.clear()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self, timeout: float = 10.0):
+        """Let queued jobs drain for up to timeout seconds, then stop the workers.
+
+        Jobs still unsent at that point, queued, backing off or in flight,
+        are settled as failed so their records do not stay queued.
+        """
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for handle in self._retrying:
+            handle.cancel()
+        self._retrying.clear()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._unsettled:
+            print(f"SMS dispatcher stopped with {len(self._unsettled)} unsent messages; marking them failed")
+            for job in list(self._unsettled.values()):
+                self._settle(job, None, SHUTDOWN_ERROR)
+        await self.transport.close()
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self._queued_at.popleft()
+            dispatch_queue_wait.observe(time.monotonic() - job.enqueued_at, "sms")
+            started = None
+            try:
+                bucket = self._buckets.get(job.from_)
+                if bucket is not None:
+                    await bucket.acquire()
+                job.attempts += 1
+                started = time.perf_counter()
+                sid = await self.transport.send(job.from_, job.to, job.body)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if started is not None:
+                    provider_request_duration.observe(time.perf_counter() - started, "sms")
+                    provider_errors.inc("sms")
+                self._retry_or_fail(job, e)
+            else:
+                provider_request_duration.observe(time.perf_counter() - started, "sms")
+                self._settle(job, sid, None)
+            finally:
+                self._queue.task_done()
+
+    def _retry_or_fail(self, job: SMSJob, error: Exception):
+        if not getattr(error, "retryable", True) or job.attempts > self.max_retries:
+            print(f"SMS sending error: {str(error)}")
+            self._settle(job, None, str(error))
+            return
+        delay = self.backoff_base * (2 ** (job.attempts - 1)) * (0.5 + random.random())
+        handle = None
+
+        def requeue():
+            self._retrying.discard(handle)
+            self._put(job)
+
+        handle = asyncio.get_running_loop().call_later(delay, requeue)
+        self._retrying.add(handle)
+
+    def _settle(self, job: SMSJob, sid: Optional[str], error: Optional[str]):
+        self._unsettled.pop(job.sms_id, None)
+        try:
+            self.on_result(job.sms_id, sid, error, job.attempts)
+        except Exception as e:
+            print(f"SMS result callback failed: {str(e)}")
@@ -1,35 +1,158 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from twilio.rest import Client
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from pydantic import BaseModel, model_validator
 from dotenv import load_dotenv
+from typing import Any, Dict, List, Optional
+import asyncio
 import os
 from datetime import datetime
 import uuid
+from database.backends import change_feed, create_store
+from database.models import SMSLog
+from database.records import SMSRecord
+from services.batch import BatchTracker, validate_batch_items
+from services.caching import history_etag, not_modified, set_cache_headers
+from services.pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, set_next_cursor, stream_ndjson, wants_ndjson
+)
+from services.coalesce import DigestCoalescer
+from services.metrics import (
+    dispatch_queue_depth, dispatch_queue_oldest, pending_items, store_memory_bytes, store_records_in_memory
+)
+from services.scheduler import is_future, scheduler
+from services.sms_dispatch import SMSDispatcher, SMSJob, transport_from_env
+from services.templates import TemplateRenderError, check_sms_length, render_requests
 
 load_dotenv()
 
 router = APIRouter()
 
-account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-twilio_number = os.getenv("TWILIO_PHONE_NUMBER")
+sms_logs = create_store(SMSRecord, SMSLog, "sms", iso_dates=True)
+sms_batches = BatchTracker("sms", feed=change_feed)
+sms_digests: Dict[str, List[str]] = {}
 
-sms_logs = []
+def record_delivery(sms_id: str, sid: Optional[str], error: Optional[str], attempts: int):
+    """Dispatcher callback: store the provider sid or the final error of an SMS or digest"""
+    for log_id in sms_digests.pop(sms_id, [sms_id]):
+        sms_logs.update(
+            log_id,
+            sid=sid,
+            status="failed" if error else "sent",
+            error=error,
+            attempts=attempts,
+        )
+        sms_batches.settle(log_id, error is None)
 
-twilio_client = None
-if account_sid and auth_token:
+sms_dispatcher = SMSDispatcher.from_env(transport_from_env(), on_result=record_delivery)
+
+def _pack_digests(log_entries: List[dict]) -> List[List[dict]]:
+    """Split held messages into runs whose joined body stays within the segment limit"""
+    packs = [[]]
+    for log_entry in log_entries:
+        if packs[-1]:
+            try:
+                check_sms_length("\n".join(e["body"] for e in packs[-1] + [log_entry]))
+            except TemplateRenderError:
+                packs.append([])
+        packs[-1].append(log_entry)
+    return packs
+
+def flush_sms_digest(key, log_entries: List[dict]):
+    """Coalescer callback: send the messages held for one number as few SMS as possible"""
+    to = key[0]
+    for pack in _pack_digests(log_entries):
+        if len(pack) == 1:
+            digest_id = pack[0]["id"]
+        else:
+            digest_id = str(uuid.uuid4())
+            sms_digests[digest_id] = [e["id"] for e in pack]
+        for log_entry in pack:
+            sms_logs.update(log_entry["id"], digest_id=digest_id, status="queued")
+        try:
+            sms_dispatcher.enqueue(SMSJob(digest_id, to, "\n".join(e["body"] for e in pack)))
+        except asyncio.QueueFull:
+            record_delivery(digest_id, None, "SMS queue is full", 0)
+
+sms_coalescer = DigestCoalescer(
+    window=float(os.getenv("SMS_DIGEST_WINDOW_SECONDS", "0")),
+    max_items=int(os.getenv("SMS_DIGEST_MAX_ITEMS", "5")),
+    on_flush=flush_sms_digest,
+)
+
+dispatch_queue_depth.track("sms", callback=sms_dispatcher.qsize)
+dispatch_queue_oldest.track("sms", callback=sms_dispatcher.oldest_age)
+store_records_in_memory.track("sms", callback=sms_logs.__len__)
+store_memory_bytes.track("sms", callback=sms_logs.memory_bytes)
+pending_items.track("sms_digest", callback=sms_coalescer.pending)
+
+def coalesces(digest_key: Optional[str]) -> bool:
+    return digest_key is not None and sms_coalescer.enabled
+
+def dispatch_sms(log_entry: dict, digest_key: Optional[str]):
+    """Queue an SMS for delivery, or hold it for its recipient's digest.
+
+    Raises asyncio.QueueFull when the dispatcher cannot take the message.
+    """
+    if coalesces(digest_key):
+        sms_coalescer.add((log_entry["to"], digest_key), log_entry)
+    else:
+        sms_dispatcher.enqueue(SMSJob(log_entry["id"], log_entry["to"], log_entry["body"]))
+
+def initial_status(send_at: Optional[datetime], digest_key: Optional[str]) -> str:
+    if is_future(send_at):
+        return "scheduled"
+    return "coalescing" if coalesces(digest_key) else "queued"
+
+def submit_sms(log_entry: dict, send_at: Optional[datetime], digest_key: Optional[str]):
+    """Dispatch an SMS now, or hand it to the scheduler if it is due later.
+
+    Raises asyncio.QueueFull when the dispatcher cannot take the message.
+    """
+    if log_entry["status"] == "scheduled":
+        scheduler.schedule(log_entry["id"], "sms", log_entry["user_id"], send_at, {"digest_key": digest_key})
+    else:
+        dispatch_sms(log_entry, digest_key)
+
+def release_sms(job):
+    """Scheduler callback: dispatch an SMS whose send_at has arrived"""
+    log_entry = sms_logs.get(job.id)
+    if log_entry is None:
+        print(f"Scheduled SMS {job.id} has no stored record; not sent")
+        return
+    if log_entry["status"] != "scheduled":
+        return
+    digest_key = job.payload.get("digest_key")
+    sms_logs.update(job.id, status="coalescing" if coalesces(digest_key) else "queued")
     try:
-        twilio_client = Client(account_sid, auth_token)
-    except Exception as e:
-        print(f"Failed to initialize Twilio client: {str(e)}")
+        dispatch_sms(log_entry, digest_key)
+    except asyncio.QueueFull:
+        record_delivery(job.id, None, "SMS queue is full", 0)
+
+def cancel_sms(job):
+    sms_logs.update(job.id, status="cancelled")
+    sms_batches.settle(job.id, False)
+
+scheduler.register("sms", release_sms, cancel_sms)
 
 class SMSRequest(BaseModel):
     user_id: int
     to: str
-    body: str
+    body: Optional[str] = None
+    template_id: Optional[str] = None
+    variables: Dict[str, Any] = {}
+    digest_key: Optional[str] = None
+    send_at: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def check_content(self):
+        if self.template_id is None and self.body is None:
+            raise ValueError("Provide a body or a template_id")
+        return self
 
 @router.post("/send")
-def send_sms(payload: SMSRequest):
+async def send_sms(payload: SMSRequest):
+    [content] = render_requests([payload], "sms")
+    if isinstance(content, TemplateRenderError):
+        raise HTTPException(status_code=422, detail=str(content))
     try:
         sms_id = str(uuid.uuid4())
         timestamp = datetime.now().isoformat()
@@ -38,33 +161,121 @@ def send_sms(payload: SMSRequest):
             "id": sms_id,
             "user_id": payload.user_id,
             "to": payload.to,
-            "body": payload.body,
+            "body": content["body"],
             "sid": None,
+            "status": initial_status(payload.send_at, payload.digest_key),
+            "error": None,
+            "attempts": 0,
+            "digest_id": None,
             "created_at": timestamp
         }
         
-        if twilio_client and twilio_number:
-            message = twilio_client.messages.create(
-                body=payload.body,
-                from_=twilio_number,
-                to=payload.to
-            )
-            log_entry["sid"] = message.sid
-        else:
-            print("Twilio not configured. SMS would have been sent to:", payload.to)
-        
-        sms_logs.append(log_entry)
+        submit_sms(log_entry, payload.send_at, payload.digest_key)
+        sms_logs.add(log_entry)
         
-        return {"message": "SMS processed", "sid": log_entry["sid"], "id": sms_id}
+        if log_entry["status"] == "scheduled":
+            return {"message": "SMS scheduled", "sid": None, "id": sms_id}
+        return {"message": "SMS queued", "sid": log_entry["sid"], "id": sms_id}
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="SMS queue is full, retry later")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/batch", status_code=202)
+async def send_sms_batch(request: Request):
+    """Queue one SMS per item of a JSON array or NDJSON body.
+
+    Items are send_sms requests; templates are rendered once per chunk for
+    all the items that use them, $name placeholders in plain bodies are
+    filled from each item's variables, and every body is checked against
+    the segment limit before it is queued.
+    """
+    batch = sms_batches.create()
+    results = []
+    async for chunk in validate_batch_items(request, SMSRequest, results):
+        timestamp = datetime.now().isoformat()
+        rendered = render_requests([item for _, item in chunk], "sms")
+        log_entries = []
+        for (index, item), content in zip(chunk, rendered):
+            if isinstance(content, TemplateRenderError):
+                results.append({"index": index, "error": str(content)})
+                continue
+            log_entry = {
+                "id": str(uuid.uuid4()),
+                "user_id": item.user_id,
+                "to": item.to,
+                "body": content["body"],
+                "sid": None,
+                "status": initial_status(item.send_at, item.digest_key),
+                "error": None,
+                "attempts": 0,
+                "digest_id": None,
+                "created_at": timestamp
+            }
+            try:
+                submit_sms(log_entry, item.send_at, item.digest_key)
+            except asyncio.QueueFull:
+                results.append({"index": index, "error": "SMS queue is full, retry later"})
+                continue
+            sms_batches.track(batch, log_entry["id"])
+            log_entries.append(log_entry)
+            results.append({"index": index, "id": log_entry["id"]})
+        sms_logs.add_many(log_entries)
+    sms_batches.finish(batch, results)
+    return {
+        "batch_id": batch["batch_id"],
+        "accepted": batch["accepted"],
+        "rejected": batch["rejected"],
+        "results": results
+    }
+
+@router.get("/batch/{batch_id}")
+async def get_sms_batch(batch_id: str):
+    """Get delivery progress for an SMS batch"""
+    batch = sms_batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
 @router.get("/logs/{user_id}")
-def get_sms_logs(user_id: int):
-    """Get SMS logs for a user"""
-    user_logs = [log for log in sms_logs if log["user_id"] == user_id]
+async def get_sms_logs(
+    user_id: int,
+    request: Request,
+    response: Response,
+    status: Optional[str] = None,
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    format: Optional[str] = None,
+):
+    """Get a page of SMS logs for a user
+
+    Newest first unless order=asc, so the first page shows the latest messages.
+    before/after take the X-Next-Cursor value of a previous page;
+    format=ndjson streams every matching log instead.
+    """
+    etag = await history_etag(sms_logs, user_id, request)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    filters = {}
+    if status is not None:
+        filters["status"] = status
+    newest_first = order == "desc"
+    before_key = decode_cursor(before)
+    after_key = decode_cursor(after)
+    if wants_ndjson(request, format):
+        streaming = stream_ndjson(sms_logs, user_id, before_key, after_key, newest_first, filters)
+        set_cache_headers(streaming, etag)
+        return streaming
+    user_logs, next_key = await sms_logs.page(
+        user_id, limit, before=before_key, after=after_key, newest_first=newest_first, filters=filters
+    )
+    set_next_cursor(response, next_key)
+    set_cache_headers(response, etag)
     
-    if not user_logs and os.getenv("VERCEL") == "1":
+    if not user_logs and before is None and after is None and os.getenv("VERCEL") == "1":
         sample_logs = [
             {
                 "id": "sample-1",
@@ -72,6 +283,8 @@ def get_sms_logs(user_id: int):
                 "to": "+1234567890",
                 "body": "This is a sample SMS notification",
                 "sid": "sample-sid-1",
+                "status": "sent",
+                "digest_id": None,
                 "created_at": datetime.now().isoformat()
             },
             {
@@ -80,6 +293,8 @@ def get_sms_logs(user_id: int):
                 "to": "+1234567890", 
                 "body": "Another sample SMS notification",
                 "sid": "sample-sid-2",
+                "status": "sent",
+                "digest_id": None,
                 "created_at": datetime.now().isoformat()
             }
         ]
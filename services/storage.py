@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+from fastapi import APIRouter
+from typing import Dict, Optional
+import asyncio
+import os
+
+from database.backends import PERSISTENT
+from database.persistence import writer
+from database.records import to_micros
+from database.store import RECENT_PER_USER, RETENTION_MAX_PER_USER, RecordStore
+from services.e_notif import email_notifications_db
+from services.in_notif import notifications_db
+from services.sms_notif import sms_logs
+
+router = APIRouter()
+
+RETENTION_MAX_AGE_DAYS = float(os.getenv("RETENTION_MAX_AGE_DAYS", "0"))
+STORE_MEMORY_BUDGET_MB = float(os.getenv("STORE_MEMORY_BUDGET_MB", "0"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "30"))
+
+if STORE_MEMORY_BUDGET_MB > 0 and not PERSISTENT:
+    # Unloading only drops records the database still holds
+    raise ValueError("STORE_MEMORY_BUDGET_MB needs NOTIFICATION_BACKEND=sqlite; the memory backend cannot unload records")
+
+
+class StoreMaintainer:
+    """Background retention for the notification stores.
+
+    Every interval it flushes pending writes, then moves each user's
+    records beyond the store's recent window out of memory (they stay in
+    the database), deletes records older than max_age_days (in memory and
+    in the database), and, if the stores together hold more than
+    budget_bytes, unloads least-recently-used users from memory until they
+    are back under 90% of the budget. Only records created before the
+    flush leave memory, so a later read from the database never misses a
+    record still waiting in the write-behind queue.
+    """
+
+    def __init__(self, stores: Dict[str, RecordStore], max_age_days: float = 0,
+                 budget_bytes: int = 0, interval: float = RETENTION_INTERVAL_SECONDS):
+        self.stores = stores
+        self.max_age_days = max_age_days
+        self.budget_bytes = budget_bytes
+        self.interval = interval
+        self.trimmed = 0
+        self.purged = 0
+        self.unloaded = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def memory_bytes(self) -> int:
+        return sum(store.memory_bytes() for store in self.stores.values())
+
+    def stats(self) -> dict:
+        return {
+            "stores": {
+                name: {
+                    "records": len(store),
+                    "users_in_memory": store.users_in_memory(),
+                    "memory_bytes": store.memory_bytes(),
+                }
+                for name, store in self.stores.items()
+            },
+            "memory_bytes": self.memory_bytes(),
+            "budget_bytes": self.budget_bytes or None,
+            "max_age_days": self.max_age_days or None,
+            "max_per_user": RETENTION_MAX_PER_USER or None,
+            "recent_per_user": RECENT_PER_USER,
+            "trimmed_records": self.trimmed,
+            "purged_records": self.purged,
+            "unloaded_users": self.unloaded,
+        }
+
+    def start(self):
+        persisted = any(store.persistence is not None for store in self.stores.values())
+        if self._task is None and (persisted or self.max_age_days > 0 or self.budget_bytes > 0):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_once(self):
+        committed_before = to_micros(datetime.now())
+        await asyncio.to_thread(writer.flush)
+        for store in self.stores.values():
+            self.trimmed += store.trim(committed_before)
+        if self.max_age_days > 0:
+            cutoff = datetime.now() - timedelta(days=self.max_age_days)
+            for store in self.stores.values():
+                self.purged += await store.purge_older_than(cutoff)
+        if self.budget_bytes > 0 and self.memory_bytes() > self.budget_bytes:
+            self._unload_to_budget(committed_before)
+
+    def _unload_to_budget(self, committed_before: int):
+        target = self.budget_bytes * 0.9
+        while self.memory_bytes() > target:
+            candidates = [(store.least_recently_used(), store) for store in self.stores.values()]
+            candidates = [c for c in candidates if c[0] is not None]
+            if not candidates:
+                return
+            (_, user_id), store = min(candidates, key=lambda c: c[0][0])
+            if store.unload_user(user_id, committed_before):
+                self.unloaded += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Store retention pass failed: {str(e)}")
+
+
+store_maintainer = StoreMaintainer(
+    {"email": email_notifications_db, "sms": sms_logs, "inapp": notifications_db},
+    max_age_days=RETENTION_MAX_AGE_DAYS,
+    budget_bytes=int(STORE_MEMORY_BUDGET_MB * 1024 * 1024),
+)
+
+
+@router.get("/stats")
+async def storage_stats():
+    """Report record counts and the approximate memory held by each store"""
+    return store_maintainer.stats()
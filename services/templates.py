@@ -0,0 +1,326 @@
+from collections import OrderedDict
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, status
+from jinja2 import StrictUndefined, TemplateError
+from jinja2.sandbox import SandboxedEnvironment
+from pydantic import BaseModel, model_validator
+from sqlalchemy import select
+from typing import Any, Dict, List, Literal, Optional
+import os
+import uuid
+
+from database.backends import PERSISTENT, change_feed
+from database.database import SessionLocal
+from database.models import NotificationTemplate
+from database.persistence import writer
+from services.batch import render
+
+router = APIRouter()
+
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "256"))
+SMS_MAX_SEGMENTS = int(os.getenv("SMS_MAX_SEGMENTS", "10"))
+
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+
+class TemplateRenderError(ValueError):
+    pass
+
+
+def sms_segments(text: str):
+    """Return (encoding, segment count) for an SMS body.
+
+    GSM-7 bodies fit 160 septets in one segment or 153 per segment when
+    concatenated (extension characters take two); anything else is sent
+    as UCS-2 at 70, or 67 per segment.
+    """
+    septets = 0
+    for char in text:
+        if char in GSM7_BASIC:
+            septets += 1
+        elif char in GSM7_EXTENDED:
+            septets += 2
+        else:
+            units = len(text.encode("utf-16-le")) // 2
+            return "UCS-2", 1 if units <= 70 else -(-units // 67)
+    return "GSM-7", 1 if septets <= 160 else -(-septets // 153)
+
+
+def check_sms_length(text: str):
+    encoding, segments = sms_segments(text)
+    if segments > SMS_MAX_SEGMENTS:
+        raise TemplateRenderError(
+            f"SMS body needs {segments} {encoding} segments, the limit is {SMS_MAX_SEGMENTS}"
+        )
+
+
+class TemplateCache:
+    """LRU cache of compiled templates keyed by (template id, field)"""
+
+    def __init__(self, maxsize: int = TEMPLATE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._text_env = SandboxedEnvironment(undefined=StrictUndefined, autoescape=False)
+        self._html_env = SandboxedEnvironment(undefined=StrictUndefined, autoescape=True)
+
+    def compile(self, source: str, html: bool = False):
+        env = self._html_env if html else self._text_env
+        return env.from_string(source)
+
+    def get(self, template: dict, field: str):
+        key = (template["id"], field)
+        compiled = self._entries.get(key)
+        if compiled is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return compiled
+        self.misses += 1
+        html = template["channel"] == "email" and field == "body"
+        compiled = self.compile(template[field], html=html)
+        self._entries[key] = compiled
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return compiled
+
+    def invalidate(self, template_id: str):
+        for field in ("subject", "body"):
+            self._entries.pop((template_id, field), None)
+
+
+class TemplateRegistry:
+    """Named email and SMS templates, persisted to the database.
+
+    Templates are loaded on first use and kept in memory; their compiled
+    form lives in the LRU cache and is dropped whenever the template is
+    updated or deleted, in this process or (through the change feed) in
+    another one. Without persistence they only live in this process.
+    """
+
+    def __init__(self, cache: TemplateCache, feed=None, persistent: bool = True):
+        self.cache = cache
+        self.feed = feed
+        self.persistent = persistent
+        self._templates: Dict[str, dict] = {}
+        self._loaded = False
+        if feed is not None:
+            feed.subscribe("templates", self._apply_change)
+
+    def all(self) -> List[dict]:
+        self._ensure_loaded()
+        return list(self._templates.values())
+
+    def get(self, template_id: str) -> Optional[dict]:
+        self._ensure_loaded()
+        return self._templates.get(template_id)
+
+    def save(self, template: dict) -> dict:
+        self._ensure_loaded()
+        is_new = template["id"] not in self._templates
+        self._templates[template["id"]] = template
+        self.cache.invalidate(template["id"])
+        if self.persistent and is_new:
+            writer.insert(NotificationTemplate, [template])
+        elif self.persistent:
+            writer.update(NotificationTemplate, [template["id"]], template)
+        if self.feed is not None:
+            self.feed.publish("templates", "save", None, template)
+        return template
+
+    def delete(self, template_id: str) -> bool:
+        self._ensure_loaded()
+        if self._templates.pop(template_id, None) is None:
+            return False
+        self.cache.invalidate(template_id)
+        if self.persistent:
+            writer.delete(NotificationTemplate, [template_id])
+        if self.feed is not None:
+            self.feed.publish("templates", "delete", None, {"id": template_id})
+        return True
+
+    def render_many(self, template_id: str, channel: str, variables_list: List[Dict[str, Any]]) -> List[Any]:
+        """Render one template for many recipients.
+
+        Each result is a dict of rendered fields, or a TemplateRenderError
+        for a recipient whose variables did not fit the template.
+        """
+        template = self.get(template_id)
+        if template is None or template["channel"] != channel:
+            raise TemplateRenderError(f"No {channel} template named '{template_id}'")
+        fields = ["subject", "body"] if channel == "email" else ["body"]
+        try:
+            compiled = [(field, self.cache.get(template, field)) for field in fields]
+        except TemplateError as e:
+            raise TemplateRenderError(f"Template '{template_id}': {e}")
+        results = []
+        for variables in variables_list:
+            try:
+                results.append({field: c.render(variables) for field, c in compiled})
+            except Exception as e:
+                # Not only TemplateError: expressions such as {{ amount + 1 }}
+                # raise TypeError and friends for unsuitable variables
+                results.append(TemplateRenderError(f"Template '{template_id}': {e}"))
+        return results
+
+    def _apply_change(self, op: str, user_id, template: dict):
+        self.cache.invalidate(template["id"])
+        if not self._loaded:
+            return
+        if op == "save":
+            for field in ("created_at", "updated_at"):
+                template[field] = datetime.fromisoformat(template[field])
+            self._templates[template["id"]] = template
+        else:
+            self._templates.pop(template["id"], None)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.persistent:
+            return
+        with SessionLocal() as session:
+            for row in session.scalars(select(NotificationTemplate)):
+                self._templates.setdefault(row.id, {
+                    "id": row.id,
+                    "channel": row.channel,
+                    "subject": row.subject,
+                    "body": row.body,
+                    "version": row.version,
+                    "created_at": row.created_at,
+                    "updated_at": row.updated_at,
+                })
+
+
+template_registry = TemplateRegistry(TemplateCache(), feed=change_feed, persistent=PERSISTENT)
+
+
+def render_requests(items: List[Any], channel: str) -> List[Any]:
+    """Resolve the text fields of send requests.
+
+    Requests naming a template_id are grouped so each template is looked
+    up and compiled once per call; the rest have $name placeholders in
+    their own text filled from their variables (HTML-escaped in email
+bodies, as the templates' autoescape does). Each result is a dict of
+    fields or a TemplateRenderError.
+    """
+    fields = ["subject", "body"] if channel == "email" else ["body"]
+    results: List[Any] = [None] * len(items)
+    by_template: Dict[str, List[int]] = {}
+    for position, item in enumerate(items):
+        if item.template_id is None:
+            results[position] = {
+                field: render(getattr(item, field), item.variables, html=channel == "email" and field == "body")
+                for field in fields
+            }
+        else:
+            by_template.setdefault(item.template_id, []).append(position)
+    for template_id, positions in by_template.items():
+        try:
+            rendered = template_registry.render_many(
+                template_id, channel, [items[p].variables for p in positions]
+            )
+        except TemplateRenderError as e:
+            rendered = [e] * len(positions)
+        for position, result in zip(positions, rendered):
+            results[position] = result
+    if channel == "sms":
+        for position, result in enumerate(results):
+            if isinstance(result, dict):
+                try:
+                    check_sms_length(result["body"])
+                except TemplateRenderError as e:
+                    results[position] = e
+    return results
+
+
+class TemplateCreate(BaseModel):
+    id: Optional[str] = None
+    channel: Literal["email", "sms"]
+    subject: Optional[str] = None
+    body: str
+
+    @model_validator(mode="after")
+    def check_subject(self):
+        if self.channel == "email" and not self.subject:
+            raise ValueError("Email templates need a subject")
+        return self
+
+
+class TemplateUpdate(BaseModel):
+    subject: Optional[str] = None
+    body: Optional[str] = None
+
+
+def _validate_sources(template: dict):
+    for field in ("subject", "body"):
+        if template.get(field) is not None:
+            try:
+                template_registry.cache.compile(template[field])
+            except TemplateError as e:
+                raise HTTPException(status_code=422, detail=f"Invalid {field} template: {e}")
+
+
+@router.post("", status_code=status.HTTP_201_CREATED)
+async def create_template(data: TemplateCreate):
+    """Register a named email or SMS template"""
+    template_id = data.id or str(uuid.uuid4())
+    if template_registry.get(template_id) is not None:
+        raise HTTPException(status_code=409, detail="Template already exists")
+    now = datetime.now()
+    template = {
+        "id": template_id,
+        "channel": data.channel,
+        "subject": data.subject if data.channel == "email" else None,
+        "body": data.body,
+        "version": 1,
+        "created_at": now,
+        "updated_at": now,
+    }
+    _validate_sources(template)
+    return template_registry.save(template)
+
+
+@router.get("")
+async def list_templates(channel: Optional[str] = None):
+    """List registered templates"""
+    return [t for t in template_registry.all() if channel is None or t["channel"] == channel]
+
+
+@router.get("/{template_id}")
+async def get_template(template_id: str):
+    """Get a template by id"""
+    template = template_registry.get(template_id)
+    if template is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return template
+
+
+@router.put("/{template_id}")
+async def update_template(template_id: str, data: TemplateUpdate):
+    """Replace a template's subject and/or body"""
+    template = template_registry.get(template_id)
+    if template is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    updated = dict(template)
+    if data.subject is not None and template["channel"] == "email":
+        updated["subject"] = data.subject
+    if data.body is not None:
+        updated["body"] = data.body
+    updated["version"] = template["version"] + 1
+    updated["updated_at"] = datetime.now()
+    _validate_sources(updated)
+    return template_registry.save(updated)
+
+
+@router.delete("/{template_id}")
+async def delete_template(template_id: str):
+    """Delete a template"""
+    if not template_registry.delete(template_id):
+        raise HTTPException(status_code=404, detail="Template not found")
+    return {"success": True}
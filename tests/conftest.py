@@ -0,0 +1,24 @@
+import os
+import tempfile
+
+# The database modules read their settings at import time
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/notifications.db")
+os.environ.setdefault("NOTIFICATION_BACKEND", "sqlite")
+os.environ.setdefault("MAIL_TRANSPORT", "fake")
+os.environ.setdefault("SMS_TRANSPORT", "fake")
+
+import itertools
+
+import pytest
+
+from database.database import init_db
+
+init_db()
+
+_user_ids = itertools.count(1000)
+
+
+@pytest.fixture
+def user_id():
+    """A user id no other test has written rows for"""
+    return next(_user_ids)
@@ -0,0 +1,100 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from services.batch import render
+
+
+@pytest.fixture
+def client():
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _ndjson(*lines):
+    return "\n".join(lines).encode()
+
+
+def test_ndjson_items_are_validated_one_by_one(client, user_id):
+    item = {"user_id": user_id, "title": "t", "message": "m"}
+    body = _ndjson(
+        json.dumps(item),
+        "",
+        "{not json",
+        json.dumps({"user_id": user_id, "message": "no title"}),
+        json.dumps(dict(item, title="second")),
+    )
+    response = client.post("/inapp/batch", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 201
+    result = response.json()
+    assert (result["accepted"], result["rejected"]) == (2, 2)
+    by_index = {r["index"]: r for r in result["results"]}
+    assert sorted(by_index) == [0, 1, 2, 3]
+    assert by_index[1]["error"] == "Line 2 is not valid JSON"
+    assert by_index[2]["error"].startswith("title:")
+    assert "id" in by_index[0] and "id" in by_index[3]
+
+    batch = client.get(f"/inapp/batch/{result['batch_id']}").json()
+    assert batch["total"] == 4
+    assert (batch["delivered"], batch["pending"], batch["status"]) == (2, 0, "completed")
+
+
+def test_json_array_counts_partial_rejects(client, user_id):
+    items = [
+        {"user_id": user_id, "to": "+1555", "body": "hello $name", "variables": {"name": "Ann"}},
+        {"user_id": user_id, "to": "+1555"},
+        {"user_id": user_id, "to": "+1555", "template_id": "no-such-template"},
+    ]
+    result = client.post("/sms/batch", json=items).json()
+    assert (result["accepted"], result["rejected"]) == (1, 2)
+    assert [("id" in r) for r in result["results"]] == [True, False, False]
+    assert "no-such-template" in result["results"][2]["error"]
+
+
+def test_body_must_be_an_array_or_ndjson(client):
+    response = client.post("/inapp/batch", json={"user_id": 1})
+    assert response.status_code == 400
+
+
+def test_render_escapes_variables_in_html():
+    variables = {"name": "<b>Ann</b> & co"}
+    assert render("Hi $name", variables) == "Hi <b>Ann</b> & co"
+    assert render("<p>Hi $name</p>", variables, html=True) == "<p>Hi &lt;b&gt;Ann&lt;/b&gt; &amp; co</p>"
+    assert render("Hi $missing", variables, html=True) == "Hi $missing"
+
+
+def test_email_batch_escapes_body_variables(client, user_id):
+    from services.e_notif import email_notifications_db
+
+    item = {
+        "user_id": user_id,
+        "email": "ann@example.com",
+        "subject": "For $name",
+        "body": "<p>Hi $name</p>",
+        "variables": {"name": "<script>x</script>"},
+    }
+    [created] = client.post("/email/batch", json=[item]).json()["results"]
+    record = email_notifications_db.get(created["id"])
+    assert record["subject"] == "For <script>x</script>"
+    assert record["body"] == "<p>Hi &lt;script&gt;x&lt;/script&gt;</p>"
+
+
+def test_scheduled_inapp_items_stay_pending_until_released(client, user_id):
+    later = (datetime.now() + timedelta(hours=1)).isoformat()
+    items = [
+        {"user_id": user_id, "title": "now", "message": "m"},
+        {"user_id": user_id, "title": "later", "message": "m", "send_at": later},
+    ]
+    result = client.post("/inapp/batch", json=items).json()
+    batch = client.get(f"/inapp/batch/{result['batch_id']}").json()
+    assert (batch["delivered"], batch["pending"], batch["status"]) == (1, 1, "processing")
+
+    scheduled_id = result["results"][1]["id"]
+    assert client.delete(f"/schedule/jobs/{scheduled_id}").status_code == 200
+    batch = client.get(f"/inapp/batch/{result['batch_id']}").json()
+    assert (batch["delivered"], batch["failed"], batch["pending"]) == (1, 1, 0)
+    assert batch["status"] == "completed"
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client():
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _logged(user_id, timeout=5.0):
+    """Wait until the change feed has read back this process's changes of the user"""
+    from services.in_notif import notifications_db
+
+    deadline = time.monotonic() + timeout
+    while notifications_db._unconfirmed.get(user_id):
+        assert time.monotonic() < deadline, "changes never logged"
+        time.sleep(0.01)
+
+
+def _create(client, user_id, title="t"):
+    return client.post("/inapp/create", json={"user_id": user_id, "title": title, "message": "m"}).json()["id"]
+
+
+@pytest.mark.parametrize("path", ["/inapp/user/{user_id}", "/inapp/user/{user_id}/summary"])
+def test_matching_if_none_match_gets_304(client, user_id, path):
+    _create(client, user_id)
+    _logged(user_id)
+    url = path.format(user_id=user_id)
+    first = client.get(url)
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "private, no-cache"
+
+    for header in (etag, etag[2:], f'W/"other", {etag}', "*"):
+        cached = client.get(url, headers={"If-None-Match": header})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert cached.headers["ETag"] == etag
+
+    assert client.get(url, headers={"If-None-Match": 'W/"other"'}).status_code == 200
+
+
+def test_views_of_one_history_have_their_own_etags(client, user_id):
+    _create(client, user_id)
+    _logged(user_id)
+    url = f"/inapp/user/{user_id}"
+    etags = {
+        client.get(url).headers["ETag"],
+        client.get(url, params={"limit": 1}).headers["ETag"],
+        client.get(url, params={"unread_only": True}).headers["ETag"],
+        client.get(url, headers={"Accept": "application/x-ndjson"}).headers["ETag"],
+    }
+    assert len(etags) == 4
+
+
+def test_changes_move_the_etag_and_the_counts(client, user_id):
+    url = f"/inapp/user/{user_id}/summary"
+    seen = set()
+
+    def summary():
+        response = client.get(url)
+        assert response.headers["ETag"] not in seen
+        seen.add(response.headers["ETag"])
+        body = response.json()
+        return body["unread_count"], body["total_count"]
+
+    assert summary() == (0, 0)
+    first, second = _create(client, user_id), _create(client, user_id)
+    assert summary() == (2, 2)
+    client.put(f"/inapp/{first}/mark-read")
+    assert summary() == (1, 2)
+    client.put(f"/inapp/user/{user_id}/mark-all-read")
+    assert summary() == (0, 2)
+    client.delete(f"/inapp/{second}")
+    assert summary() == (0, 1)
+
+    # An unchanged history keeps its ETag once the changes are logged
+    _logged(user_id)
+    etag = client.get(url).headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
@@ -0,0 +1,159 @@
+from datetime import datetime, timedelta
+import asyncio
+import time
+
+from database.changes import ChangeFeed
+from database.models import InAppNotification
+from database.persistence import SQLPersistence
+from database.records import InAppRecord
+from database.store import InAppNotificationStore
+
+TOPIC = "test_inapp"
+
+
+def _record(user_id, i):
+    return {
+        "id": f"{user_id}-{i}",
+        "user_id": user_id,
+        "title": "t",
+        "message": "m",
+        "notification_type": "info",
+        "link": None,
+        "read": False,
+        "created_at": datetime.now() + timedelta(microseconds=i),
+    }
+
+
+def _worker():
+    """A store with its own feed, as one worker process would have"""
+    feed = ChangeFeed(enabled=True, poll_interval=0.01)
+    store = InAppNotificationStore(InAppRecord, SQLPersistence(InAppNotification), feed=feed, topic=TOPIC)
+    return store, feed
+
+
+async def _eventually(check, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not await check():
+        assert time.monotonic() < deadline, "change never arrived"
+        await asyncio.sleep(0.01)
+
+
+def test_changes_reach_the_other_store(user_id):
+    first, first_feed = _worker()
+    second, second_feed = _worker()
+
+    async def scenario():
+        first_feed.start()
+        second_feed.start()
+        try:
+            assert await second.count(user_id) == 0
+            first.add(_record(user_id, 1))
+            first.add_many([_record(user_id, 2), _record(user_id, 3)])
+
+            async def second_sees_adds():
+                return await second.unread_count(user_id) == 3
+            await _eventually(second_sees_adds)
+            assert second.get(f"{user_id}-2")["title"] == "t"
+
+            await first.mark_read(f"{user_id}-1")
+            first.update(f"{user_id}-2", title="renamed")
+            await first.delete(f"{user_id}-3")
+
+            async def second_sees_changes():
+                return await second.count(user_id) == 2 and await second.unread_count(user_id) == 1
+            await _eventually(second_sees_changes)
+            assert second.get(f"{user_id}-2")["title"] == "renamed"
+            assert second.get(f"{user_id}-3") is None
+
+            await second.mark_all_read(user_id)
+
+            async def first_sees_mark_all():
+                return await first.unread_count(user_id) == 0
+            await _eventually(first_sees_mark_all)
+        finally:
+            await first_feed.stop()
+            await second_feed.stop()
+
+    asyncio.run(scenario())
+
+
+def test_own_changes_are_not_applied_twice(user_id):
+    store, feed = _worker()
+
+    async def scenario():
+        feed.start()
+        try:
+            assert await store.count(user_id) == 0
+            store.add(_record(user_id, 1))
+            await asyncio.sleep(0.2)
+            assert await store.count(user_id) == 1
+            assert feed.received == 0
+        finally:
+            await feed.stop()
+
+    asyncio.run(scenario())
+
+
+def test_workers_agree_on_versions(user_id):
+    first, first_feed = _worker()
+    second, second_feed = _worker()
+
+    async def scenario():
+        first_feed.start()
+        second_feed.start()
+        try:
+            await second.count(user_id)
+            first.add_many([_record(user_id, 1), _record(user_id, 2)])
+
+            async def versions_agree():
+                return await first.version(user_id) == await second.version(user_id)
+            await _eventually(versions_agree)
+            logged = await first.version(user_id)
+
+            # A worker that has not read the user yet agrees too
+            third, third_feed = _worker()
+            assert await third.version(user_id) == logged
+
+            await second.mark_read(f"{user_id}-1")
+            await _eventually(versions_agree)
+            assert await first.version(user_id) != logged
+        finally:
+            await first_feed.stop()
+            await second_feed.stop()
+
+    asyncio.run(scenario())
+
+
+def test_purge_moves_versions_of_unloaded_users(user_id):
+    first, first_feed = _worker()
+    second, second_feed = _worker()
+
+    async def scenario():
+        first_feed.start()
+        second_feed.start()
+        try:
+            old = dict(_record(user_id, 1), created_at=datetime.now() - timedelta(days=10))
+            first.add_many([old, _record(user_id, 2)])
+
+            async def versions_agree():
+                return await first.version(user_id) == await second.version(user_id)
+            await _eventually(versions_agree)
+            before = await second.version(user_id)
+
+            # The purging worker has never read the user
+            fresh, fresh_feed = _worker()
+            fresh_feed.start()
+            try:
+                await fresh.purge_older_than(datetime.now() - timedelta(days=1))
+            finally:
+                await fresh_feed.stop()
+
+            async def second_sees_purge():
+                return await second.count(user_id) == 1
+            await _eventually(second_sees_purge)
+            assert await second.version(user_id) != before
+        finally:
+            await first_feed.stop()
+            await second_feed.stop()
+
+    asyncio.run(scenario())
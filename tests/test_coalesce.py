@@ -0,0 +1,130 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from services.coalesce import DigestCoalescer
+
+
+def _coalescer(window, max_items=10):
+    flushed = []
+    coalescer = DigestCoalescer(window, max_items, lambda key, items: flushed.append((key, list(items))))
+    return coalescer, flushed
+
+
+def test_groups_flush_when_their_window_closes():
+    async def scenario():
+        coalescer, flushed = _coalescer(0.1)
+        coalescer.add("a", 1)
+        await asyncio.sleep(0.05)
+        coalescer.add("b", 2)
+        coalescer.add("a", 3)
+        assert coalescer.pending() == 3
+        await asyncio.sleep(0.07)
+        assert flushed == [("a", [1, 3])]
+        await asyncio.sleep(0.05)
+        assert flushed == [("a", [1, 3]), ("b", [2])]
+        assert coalescer.pending() == 0
+        # A new item after the flush opens a new window
+        coalescer.add("a", 4)
+        await asyncio.sleep(0.15)
+        assert flushed[-1] == ("a", [4])
+        await coalescer.stop()
+
+    asyncio.run(scenario())
+
+
+def test_full_group_flushes_early():
+    async def scenario():
+        coalescer, flushed = _coalescer(10, max_items=3)
+        for item in range(4):
+            coalescer.add("a", item)
+        # Flushing is left to the event loop, not done inside add()
+        assert flushed == []
+        await asyncio.sleep(0)
+        assert flushed == [("a", [0, 1, 2])]
+        assert coalescer.pending() == 1
+        await coalescer.stop()
+        assert flushed[-1] == ("a", [3])
+
+    asyncio.run(scenario())
+
+
+def test_stop_flushes_open_groups():
+    async def scenario():
+        coalescer, flushed = _coalescer(60)
+        coalescer.add("a", 1)
+        coalescer.add("b", 2)
+        await coalescer.stop()
+        assert flushed == [("a", [1]), ("b", [2])]
+        assert coalescer.pending() == 0
+
+    asyncio.run(scenario())
+
+
+def test_failing_flush_does_not_stop_the_timer():
+    async def scenario():
+        calls = []
+
+        def on_flush(key, items):
+            calls.append(key)
+            if key == "a":
+                raise RuntimeError("boom")
+
+        coalescer = DigestCoalescer(0.05, 10, on_flush)
+        coalescer.add("a", 1)
+        coalescer.add("b", 2)
+        await asyncio.sleep(0.1)
+        assert calls == ["a", "b"]
+        await coalescer.stop()
+
+    asyncio.run(scenario())
+
+
+def test_digest_delivery_status_reaches_every_member(user_id, monkeypatch):
+    import main
+    from services.e_notif import email_coalescer, email_dispatcher, email_notifications_db
+
+    monkeypatch.setattr(email_coalescer, "window", 60)
+    with TestClient(main.app) as client:
+        ids = [
+            client.post("/email/send_email", json={
+                "user_id": user_id, "email": f"{user_id}@example.com", "subject": f"s{i}", "body": "b",
+                "digest_key": "daily",
+            }).json()["notification_id"]
+            for i in range(3)
+        ]
+        assert {email_notifications_db.get(i)["status"] for i in ids} == {"coalescing"}
+    # Shutting down flushes the open digest and drains the dispatcher
+    records = [email_notifications_db.get(i) for i in ids]
+    assert {r["status"] for r in records} == {"sent"}
+    assert len({r["digest_id"] for r in records}) == 1
+    assert records[0]["digest_id"] not in ids
+    assert {"to": f"{user_id}@example.com", "subject": "s0 (+2 more)"} in email_dispatcher.transport.sent
+
+
+def test_failed_digest_fails_every_member(user_id):
+    from services.sms_notif import record_delivery, sms_digests, sms_logs
+
+    ids = [f"{user_id}-{i}" for i in range(2)]
+    for log_id in ids:
+        sms_logs.add({
+            "id": log_id, "user_id": user_id, "to": "+1555", "body": "b", "sid": None, "status": "queued",
+            "error": None, "attempts": 0, "digest_id": "digest", "created_at": "2024-01-01T00:00:00",
+        })
+    sms_digests["digest"] = ids
+    record_delivery("digest", None, "Provider rejected the number", 1)
+    for log_id in ids:
+        entry = sms_logs.get(log_id)
+        assert (entry["status"], entry["error"]) == ("failed", "Provider rejected the number")
+    assert "digest" not in sms_digests
+
+
+def test_sms_digests_are_split_at_the_segment_limit():
+    from services.sms_notif import _pack_digests
+    from services.templates import SMS_MAX_SEGMENTS
+
+    body = "a" * (153 * SMS_MAX_SEGMENTS // 2)
+    packs = _pack_digests([{"id": str(i), "body": body} for i in range(3)])
+    assert [len(pack) for pack in packs] == [1, 1, 1]
+    packs = _pack_digests([{"id": str(i), "body": "short"} for i in range(3)])
+    assert [len(pack) for pack in packs] == [3]
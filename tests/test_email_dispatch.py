@@ -0,0 +1,157 @@
+import asyncio
+import socket
+import time
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from services.email_dispatch import SHUTDOWN_ERROR, EmailDispatcher, EmailJob, SMTPTransport
+from services.metrics import provider_errors
+
+
+class RecordingHandler:
+    """aiosmtpd handler that keeps accepted messages and can refuse some first"""
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+        self.refuse = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        if self.refuse:
+            self.refuse -= 1
+            return "451 Try again later"
+        self.messages.append(envelope.rcpt_tos[0])
+        return "250 OK"
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+class Server:
+    def __init__(self):
+        self.handler = RecordingHandler()
+        self.hostname = "127.0.0.1"
+        self.port = _free_port()
+        self.controller = None
+
+    def start(self):
+        self.controller = Controller(self.handler, hostname=self.hostname, port=self.port)
+        self.controller.start()
+
+    def stop(self):
+        self.controller.stop()
+
+
+@pytest.fixture
+def smtp():
+    server = Server()
+    server.start()
+    yield server
+    server.stop()
+
+
+async def _settled(results, count, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while len(results) < count:
+        assert time.monotonic() < deadline, "jobs never settled"
+        await asyncio.sleep(0.01)
+
+
+def _dispatch(server, jobs, between=None, **options):
+    """Send jobs through a one-connection dispatcher and return each job's (sent, error)"""
+    results = {}
+
+    def on_result(notification_id, sent, error):
+        results[notification_id] = (sent, error)
+
+    transport = SMTPTransport(server.hostname, server.port, "sender@example.com",
+                              start_tls=False, validate_certs=False, timeout=5)
+    options.setdefault("backoff_base", 0.01)
+    dispatcher = EmailDispatcher(transport, on_result, pool_size=1, **options)
+
+    async def scenario():
+        for count, job in enumerate(jobs, 1):
+            dispatcher.enqueue(job)
+            if between is not None:
+                await _settled(results, count)
+                between()
+        await _settled(results, len(jobs))
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+    return results
+
+
+def _jobs(count):
+    return [EmailJob(f"n{i}", f"user{i}@example.com", "Subject", "<p>Body</p>") for i in range(count)]
+
+
+def test_reuses_one_connection(smtp):
+    results = _dispatch(smtp, _jobs(5))
+    assert results == {f"n{i}": (True, None) for i in range(5)}
+    assert smtp.handler.messages == [f"user{i}@example.com" for i in range(5)]
+    assert len(smtp.handler.sessions) == 1
+
+
+def test_reconnects_after_max_messages_per_connection(smtp):
+    _dispatch(smtp, _jobs(5), max_messages_per_connection=2)
+    assert len(smtp.handler.messages) == 5
+    assert len(smtp.handler.sessions) == 3
+
+
+def test_retries_transient_failures(smtp):
+    smtp.handler.refuse = 2
+    jobs = _jobs(1)
+    results = _dispatch(smtp, jobs, max_retries=3)
+    assert results == {"n0": (True, None)}
+    assert jobs[0].attempts == 3
+    assert smtp.handler.messages == ["user0@example.com"]
+
+
+def test_settles_failure_after_max_retries(smtp):
+    smtp.handler.refuse = 10
+    jobs = _jobs(1)
+    results = _dispatch(smtp, jobs, max_retries=2)
+    assert results["n0"][0] is False
+    assert "Try again later" in results["n0"][1]
+    assert jobs[0].attempts == 3
+    assert smtp.handler.messages == []
+
+
+def test_resends_once_when_server_dropped_idle_session(smtp):
+    errors_before = provider_errors._values.get(("email",), 0)
+    jobs = _jobs(2)
+
+    def restart_server():
+        # Closes the dispatcher's open session, as a server idle timeout would
+        smtp.stop()
+        smtp.start()
+
+    results = _dispatch(smtp, jobs, between=restart_server, max_retries=0)
+    assert results == {"n0": (True, None), "n1": (True, None)}
+    assert jobs[1].attempts == 1
+    assert provider_errors._values.get(("email",), 0) == errors_before
+
+
+def test_stop_fails_jobs_it_could_not_send(smtp):
+    smtp.handler.refuse = 10
+    results = {}
+    transport = SMTPTransport(smtp.hostname, smtp.port, "sender@example.com",
+                              start_tls=False, validate_certs=False, timeout=5)
+    dispatcher = EmailDispatcher(transport, lambda *result: results.setdefault(result[0], result[1:]),
+                                 pool_size=1, backoff_base=60)
+
+    async def scenario():
+        for job in _jobs(3):
+            dispatcher.enqueue(job)
+        # Every send is refused, so the jobs wait in backoff when stop() runs
+        await asyncio.sleep(0.2)
+        await dispatcher.stop(timeout=0.1)
+
+    asyncio.run(scenario())
+    assert results == {f"n{i}": (False, SHUTDOWN_ERROR) for i in range(3)}
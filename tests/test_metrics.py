@@ -0,0 +1,77 @@
+import re
+
+from fastapi.testclient import TestClient
+
+from services.metrics import Counter, Gauge, Histogram, Registry
+
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*"(,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*")*\})? -?[0-9.e+-]+$')
+
+
+def _check_exposition(text):
+    """Every line is a HELP or TYPE comment or a well-formed sample"""
+    assert text.endswith("\n")
+    for line in text.splitlines():
+        if line.startswith("# HELP ") or line.startswith("# TYPE "):
+            continue
+        assert SAMPLE.match(line), line
+
+
+def test_exposition_format():
+    registry = Registry()
+    counter = registry.register(Counter("jobs_total", "Jobs", ("channel",)))
+    gauge = registry.register(Gauge("depth", "Depth", ("channel",)))
+    histogram = registry.register(Histogram("wait_seconds", "Wait", ("channel",), buckets=(0.1, 1.0)))
+    counter.inc('say "hi"\n\\')
+    counter.inc('say "hi"\n\\', amount=2)
+    gauge.set("email", value=1.5)
+    gauge.track("sms", callback=lambda: 3)
+    gauge.track("broken", callback=lambda: 1 / 0)
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, "email")
+
+    text = registry.render()
+    _check_exposition(text)
+    lines = text.splitlines()
+    assert lines[:2] == ["# HELP jobs_total Jobs", "# TYPE jobs_total counter"]
+    assert 'jobs_total{channel="say \\"hi\\"\\n\\\\"} 3' in lines
+    assert 'depth{channel="email"} 1.5' in lines
+    assert 'depth{channel="sms"} 3' in lines
+    assert not any("broken" in line for line in lines)
+    assert "# TYPE wait_seconds histogram" in lines
+    assert [line for line in lines if line.startswith("wait_seconds")] == [
+        'wait_seconds_bucket{channel="email",le="0.1"} 1',
+        'wait_seconds_bucket{channel="email",le="1"} 2',
+        'wait_seconds_bucket{channel="email",le="+Inf"} 3',
+        'wait_seconds_sum{channel="email"} 5.55',
+        'wait_seconds_count{channel="email"} 3',
+    ]
+
+
+def _request_count(text, method, route, status):
+    labels = f'method="{method}",route="{route}",status="{status}"'
+    match = re.search(rf'^http_request_duration_seconds_count\{{{re.escape(labels)}\}} (\d+)$', text, re.M)
+    return int(match.group(1)) if match else 0
+
+
+def test_requests_are_labelled_by_route_template(user_id):
+    import main
+
+    with TestClient(main.app) as client:
+        before = client.get("/metrics").text
+        client.put("/inapp/no-such-id/mark-read")
+        client.put("/inapp/another-id/mark-read")
+        client.get(f"/inapp/user/{user_id}/summary")
+        client.get("/no/such/path")
+        response = client.get("/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    _check_exposition(text)
+    for method, route, status, count in (
+        ("PUT", "/inapp/{notification_id}/mark-read", 404, 2),
+        ("GET", "/inapp/user/{user_id}/summary", 200, 1),
+        ("GET", "unmatched", 404, 1),
+    ):
+        assert _request_count(text, method, route, status) - _request_count(before, method, route, status) == count
+    assert "no-such-id" not in text and "/no/such/path" not in text
+    assert 'store_records_in_memory{channel="inapp"}' in text
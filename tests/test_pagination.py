@@ -0,0 +1,116 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from services import pagination
+
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def client():
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _notifications(user_id, count):
+    from services.in_notif import notifications_db
+
+    records = [{
+        "id": f"{user_id}-{i:04d}",
+        "user_id": user_id,
+        "title": f"t{i}",
+        "message": "m",
+        "notification_type": "info",
+        "link": None,
+        "read": False,
+        "created_at": START + timedelta(seconds=i),
+    } for i in range(count)]
+    notifications_db.add_many(records)
+    return [r["id"] for r in records]
+
+
+def _emails(client, user_id, count):
+    items = [{"user_id": user_id, "email": "a@example.com", "subject": f"s{i}", "body": "b"} for i in range(count)]
+    return [r["id"] for r in client.post("/email/batch", json=items).json()["results"]]
+
+
+def _walk(client, url, cursor_param, limit, **query):
+    ids, cursor = [], None
+    while True:
+        params = dict(query, limit=limit)
+        if cursor is not None:
+            params[cursor_param] = cursor
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        ids.extend(r["id"] for r in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return ids
+
+
+def test_before_cursor_walks_newest_first(client, user_id):
+    ids = _notifications(user_id, 25)
+    assert _walk(client, f"/inapp/user/{user_id}", "before", 10) == ids[::-1]
+
+
+def test_after_cursor_walks_oldest_first(client, user_id):
+    ids = _emails(client, user_id, 25)
+    # One batch shares a created_at, so ties are ordered by id
+    assert _walk(client, f"/email/users/{user_id}/notifications", "after", 10, order="asc") == sorted(ids)
+
+
+def test_cursor_survives_deleting_its_record(client, user_id):
+    ids = _notifications(user_id, 5)
+    first = client.get(f"/inapp/user/{user_id}", params={"limit": 2})
+    assert client.delete(f"/inapp/{ids[3]}").status_code == 200
+    rest = client.get(f"/inapp/user/{user_id}", params={"before": first.headers["X-Next-Cursor"]})
+    assert [r["id"] for r in rest.json()] == [ids[2], ids[1], ids[0]]
+
+
+def test_limit_defaults_to_100_and_is_bounded(client, user_id):
+    _notifications(user_id, pagination.DEFAULT_PAGE_SIZE + 5)
+    url = f"/inapp/user/{user_id}"
+    response = client.get(url)
+    assert len(response.json()) == pagination.DEFAULT_PAGE_SIZE
+    assert "X-Next-Cursor" in response.headers
+    assert len(client.get(url, params={"limit": pagination.MAX_PAGE_SIZE}).json()) == pagination.DEFAULT_PAGE_SIZE + 5
+    assert client.get(url, params={"limit": pagination.MAX_PAGE_SIZE + 1}).status_code == 422
+    assert client.get(url, params={"limit": 0}).status_code == 422
+
+
+def _b64(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    _b64({"offset": 100}),
+    _b64(100),
+    _b64(["2024-01-01", "id", 3]),
+    _b64(["yesterday", "id"]),
+])
+def test_malformed_or_stale_cursor_is_rejected(client, user_id, cursor):
+    for param in ("before", "after"):
+        response = client.get(f"/inapp/user/{user_id}", params={param: cursor})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_ndjson_streams_every_record(client, user_id, monkeypatch):
+    monkeypatch.setattr(pagination, "STREAM_CHUNK_SIZE", 7)
+    ids = _notifications(user_id, 30)
+    url = f"/inapp/user/{user_id}"
+    for response in (
+        client.get(url, params={"format": "ndjson"}),
+        client.get(url, headers={"Accept": "application/x-ndjson"}),
+    ):
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = response.text.splitlines()
+        assert [json.loads(line)["id"] for line in lines] == ids[::-1]
+        assert "ETag" in response.headers
@@ -0,0 +1,64 @@
+from datetime import datetime
+from sqlalchemy import select
+
+from database.database import SessionLocal
+from database.models import InAppNotification
+from database.persistence import WriteBehindQueue
+
+
+def _row(record_id, user_id, title="first", read=False):
+    return {
+        "id": record_id,
+        "user_id": user_id,
+        "title": title,
+        "message": "m",
+        "notification_type": "info",
+        "link": None,
+        "read": read,
+        "created_at": datetime(2024, 1, 1),
+    }
+
+
+def _stored(user_id):
+    with SessionLocal() as session:
+        rows = session.scalars(select(InAppNotification).where(InAppNotification.user_id == user_id))
+        return {row.id: (row.title, row.read) for row in rows}
+
+
+def test_operations_apply_in_order_across_batches(user_id):
+    queue = WriteBehindQueue(batch_size=2, max_delay=0.01)
+    a, b = f"{user_id}-a", f"{user_id}-b"
+    queue.insert(InAppNotification, [_row(a, user_id), _row(b, user_id)])
+    queue.update(InAppNotification, [a], {"read": True})
+    queue.delete(InAppNotification, [a])
+    queue.insert(InAppNotification, [_row(a, user_id, title="second")])
+    queue.update(InAppNotification, [b], {"title": "renamed"})
+    queue.update_where(InAppNotification, user_id, {"read": False}, {"read": True})
+    queue.close()
+
+    assert _stored(user_id) == {a: ("second", True), b: ("renamed", True)}
+
+
+def test_bad_row_only_loses_itself(user_id):
+    queue = WriteBehindQueue(max_delay=0.01)
+    queue.insert(InAppNotification, [_row(f"{user_id}-a", user_id)])
+    queue.flush()
+    queue.insert(InAppNotification, [_row(f"{user_id}-b", user_id)])
+    queue.insert(InAppNotification, [_row(f"{user_id}-a", user_id, title="duplicate")])
+    queue.insert(InAppNotification, [_row(f"{user_id}-c", user_id)])
+    queue.close()
+
+    assert queue.failed == 1
+    assert _stored(user_id) == {
+        f"{user_id}-a": ("first", False),
+        f"{user_id}-b": ("first", False),
+        f"{user_id}-c": ("first", False),
+    }
+
+
+def test_flush_waits_for_commit(user_id):
+    queue = WriteBehindQueue(max_delay=1.0)
+    queue.insert(InAppNotification, [_row(f"{user_id}-a", user_id)])
+    queue.flush()
+    assert f"{user_id}-a" in _stored(user_id)
+    queue.close()
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from services.pubsub import RESYNC, NotificationHub
+
+
+async def _next(subscription, timeout=0.2):
+    return await asyncio.wait_for(subscription.get(), timeout)
+
+
+def _types(events):
+    return [event["type"] for event in events]
+
+
+def test_events_only_reach_the_affected_user():
+    async def scenario():
+        hub = NotificationHub()
+        first, also_first, second = hub.subscribe(1), hub.subscribe(1), hub.subscribe(2)
+        event = hub.publish(1, "created", {"id": "a"})
+        assert await _next(first) == event
+        assert await _next(also_first) == event
+        with pytest.raises(asyncio.TimeoutError):
+            await _next(second, timeout=0.05)
+        hub.unsubscribe(first)
+        hub.unsubscribe(also_first)
+        hub.unsubscribe(second)
+        assert hub.connection_count() == 0
+
+    asyncio.run(scenario())
+
+
+def test_overflow_replaces_backlog_with_resync():
+    async def scenario():
+        hub = NotificationHub(buffer_size=3)
+        subscription = hub.subscribe(1)
+        events = [hub.publish(1, "created", {"n": n}) for n in range(5)]
+        received = [await _next(subscription) for _ in range(3)]
+        assert _types(received) == [RESYNC, "created", "created"]
+        assert received[1:] == events[3:]
+        assert subscription.overflows == 1
+
+    asyncio.run(scenario())
+
+
+def test_replay_from_last_event_id():
+    async def scenario():
+        hub = NotificationHub()
+        seen = hub.publish(1, "created", {"n": 0})
+        missed = [hub.publish(1, "created", {"n": 1}), hub.publish(1, "read", {"n": 1})]
+        hub.publish(2, "created", {"n": 2})
+        subscription = hub.subscribe(1, last_event_id=seen["id"])
+        assert [await _next(subscription) for _ in missed] == missed
+        with pytest.raises(asyncio.TimeoutError):
+            await _next(subscription, timeout=0.05)
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("last_event_id", ["expired", "otherepoch:1", "garbage"])
+def test_replay_from_unknown_or_expired_id_asks_for_resync(last_event_id):
+    async def scenario():
+        hub = NotificationHub(history_size=2)
+        first = hub.publish(1, "created", {"n": 0})
+        for n in range(1, 4):
+            hub.publish(1, "created", {"n": n})
+        subscription = hub.subscribe(1, last_event_id=first["id"] if last_event_id == "expired" else last_event_id)
+        assert _types([await _next(subscription)]) == [RESYNC]
+
+    asyncio.run(scenario())
+
+
+def test_websocket_resumes_from_last_event_id(user_id):
+    import main
+    from services.in_notif import notification_hub
+
+    with TestClient(main.app) as client:
+        seen = notification_hub.publish(user_id, "created", {"n": 0})
+        missed = notification_hub.publish(user_id, "created", {"n": 1})
+        with client.websocket_connect(f"/inapp/ws/{user_id}?last_event_id={seen['id']}") as socket:
+            assert json.loads(socket.receive_text())["id"] == missed["id"]
+            created = client.post("/inapp/create", json={"user_id": user_id, "title": "t", "message": "m"}).json()
+            event = json.loads(socket.receive_text())
+            assert event["type"] == "created" and event["data"]["id"] == created["id"]
+            # Let the endpoint finish before the test client cancels it
+            socket.close()
+            deadline = time.monotonic() + 5
+            while notification_hub.connection_count() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.05)
+
+
+def test_sse_resumes_from_last_event_id_header(user_id):
+    from services.in_notif import notification_events, notification_hub
+
+    async def scenario():
+        seen = notification_hub.publish(user_id, "created", {"n": 0})
+        missed = notification_hub.publish(user_id, "created", {"n": 1})
+        request = Request({"type": "http", "method": "GET", "path": "/", "query_string": b"",
+                           "headers": [(b"last-event-id", seen["id"].encode())]})
+        response = await notification_events(user_id, request)
+        body = response.body_iterator
+        try:
+            chunk = await asyncio.wait_for(body.__anext__(), 1)
+        finally:
+            await body.aclose()
+        assert chunk.startswith(f"id: {missed['id']}\nevent: created\n")
+        assert notification_hub.connection_count() == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+import asyncio
+import time
+
+from database.persistence import writer
+from services.scheduler import Scheduler
+
+
+async def _eventually(check, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline, "jobs were never released"
+        await asyncio.sleep(0.01)
+
+
+def _collecting(scheduler, channel):
+    released = []
+    scheduler.register(channel, lambda job: released.append((job.id, time.monotonic())))
+    return released
+
+
+def test_releases_in_due_order():
+    async def scenario():
+        scheduler = Scheduler(persistent=False)
+        released = _collecting(scheduler, "test")
+        now = datetime.now()
+        for i in range(5):
+            scheduler.schedule(f"job{i}", "test", 1, now + timedelta(milliseconds=200 - 40 * i))
+        listed = await scheduler.list(limit=3)
+        assert [job.id for job in listed] == ["job4", "job3", "job2"]
+        await _eventually(lambda: len(released) == 5)
+        await scheduler.stop()
+        assert [job_id for job_id, _ in released] == ["job4", "job3", "job2", "job1", "job0"]
+        assert scheduler.pending() == 0
+
+    asyncio.run(scenario())
+
+
+def test_spreads_jobs_due_together():
+    async def scenario():
+        scheduler = Scheduler(release_rate=200, persistent=False)
+        released = _collecting(scheduler, "test")
+        due = datetime.now()
+        for i in range(40):
+            scheduler.schedule(f"job{i}", "test", 1, due)
+        await _eventually(lambda: len(released) == 40)
+        await scheduler.stop()
+        times = [at for _, at in released]
+        # A burst of 2, then one job every 5 ms
+        assert times[-1] - times[0] >= 0.15
+        assert sum(1 for at in times if at - times[0] < 0.004) <= 3
+
+    asyncio.run(scenario())
+
+
+def test_shared_table_releases_each_job_once(user_id):
+    channel = f"test{user_id}"
+
+    async def scenario():
+        first, second = Scheduler(), Scheduler()
+        released = _collecting(first, channel)
+        second.register(channel, lambda job: released.append((job.id, time.monotonic())))
+        due = datetime.now() + timedelta(milliseconds=300)
+        for i in range(20):
+            first.schedule(f"{channel}-{i}", channel, user_id, due)
+        writer.flush()
+        second.start()
+        await _eventually(lambda: len(released) == 20)
+        await asyncio.sleep(0.2)
+        await first.stop()
+        await second.stop()
+        assert sorted(job_id for job_id, _ in released) == sorted(f"{channel}-{i}" for i in range(20))
+
+    asyncio.run(scenario())
+
+
+def test_cancel_stops_release(user_id):
+    channel = f"test{user_id}"
+
+    async def scenario():
+        first, second = Scheduler(), Scheduler()
+        released = _collecting(first, channel)
+        cancelled = []
+        second.register(channel, released.append, on_cancel=cancelled.append)
+        first.schedule(f"{channel}-dropped", channel, user_id, datetime.now() + timedelta(milliseconds=500))
+        first.schedule(f"{channel}-kept", channel, user_id, datetime.now() + timedelta(milliseconds=600))
+        writer.flush()
+
+        job = await second.cancel(f"{channel}-dropped")
+        assert job.status == "cancelled"
+        assert cancelled == [job]
+        assert await second.cancel(f"{channel}-dropped") is None
+        assert await second.get(f"{channel}-dropped") is None
+
+        await _eventually(lambda: len(released) == 1)
+        await asyncio.sleep(0.2)
+        await first.stop()
+        await second.stop()
+        assert [job_id for job_id, _ in released] == [f"{channel}-kept"]
+
+    asyncio.run(scenario())
+
+
+def test_failed_claim_is_retried():
+    async def scenario():
+        scheduler = Scheduler(persistent=False)
+        released = _collecting(scheduler, "test")
+        claim = scheduler._claim_jobs
+        failures = []
+
+        async def flaky_claim(job_ids):
+            if not failures:
+                failures.append(job_ids)
+                raise RuntimeError("database is locked")
+            return await claim(job_ids)
+
+        scheduler._claim_jobs = flaky_claim
+        scheduler.schedule("job", "test", 1, datetime.now())
+        await _eventually(lambda: len(released) == 1)
+        await scheduler.stop()
+        assert failures == [["job"]]
+
+    asyncio.run(scenario())
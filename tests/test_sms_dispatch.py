@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from services.ratelimit import TokenBucket
+from services.sms_dispatch import (
+    SHUTDOWN_ERROR, FakeSMSTransport, LogSMSTransport, SMSDeliveryError, SMSDispatcher, SMSJob,
+)
+
+
+class FailingTransport:
+    def __init__(self, error: Exception):
+        self.error = error
+        self.calls = 0
+
+    async def send(self, from_, to, body):
+        self.calls += 1
+        raise self.error
+
+    async def close(self):
+        pass
+
+
+class BlockedTransport(FakeSMSTransport):
+    """Holds every send until release is set"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def send(self, from_, to, body):
+        await self.release.wait()
+        return await super().send(from_, to, body)
+
+
+def _run(dispatcher, jobs, timeout=5.0):
+    results = {}
+    dispatcher.on_result = lambda sms_id, sid, error, attempts: results.setdefault(sms_id, (sid, error, attempts))
+
+    async def scenario():
+        for job in jobs:
+            dispatcher.enqueue(job)
+        deadline = time.monotonic() + timeout
+        while len(results) < len(jobs):
+            assert time.monotonic() < deadline, "jobs never settled"
+            await asyncio.sleep(0.01)
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+    return results
+
+
+def test_token_bucket_allows_burst_then_rate():
+    async def scenario():
+        bucket = TokenBucket(50, burst=2)
+        started = time.monotonic()
+        await bucket.acquire()
+        await bucket.acquire()
+        assert time.monotonic() - started < 0.01
+        for _ in range(10):
+            await bucket.acquire()
+        assert 0.18 <= time.monotonic() - started < 0.5
+
+    asyncio.run(scenario())
+
+
+def test_non_retryable_error_settles_at_once():
+    transport = FailingTransport(SMSDeliveryError("Invalid number", retryable=False))
+    dispatcher = SMSDispatcher(transport, None, senders=["+1000"], rate_per_sender=0, backoff_base=0.01)
+    assert _run(dispatcher, [SMSJob("s1", "+1555", "hi")]) == {"s1": (None, "Invalid number", 1)}
+    assert transport.calls == 1
+
+
+def test_retryable_error_is_retried_until_max_retries():
+    transport = FailingTransport(SMSDeliveryError("Provider unavailable"))
+    dispatcher = SMSDispatcher(transport, None, senders=["+1000"], rate_per_sender=0, max_retries=2,
+                               backoff_base=0.01)
+    assert _run(dispatcher, [SMSJob("s1", "+1555", "hi")]) == {"s1": (None, "Provider unavailable", 3)}
+
+
+def test_senders_take_turns_and_respect_their_rate():
+    transport = FakeSMSTransport()
+    dispatcher = SMSDispatcher(transport, None, senders=["+1000", "+2000"], rate_per_sender=20, burst=1)
+    started = time.monotonic()
+    results = _run(dispatcher, [SMSJob(f"s{i}", "+1555", "hi") for i in range(6)])
+    # Three sends per sender at 20/s: the first is free, two more take 100 ms
+    assert time.monotonic() - started >= 0.09
+    assert all(error is None for _, error, _ in results.values())
+    assert sorted(message["from"] for message in transport.sent) == ["+1000"] * 3 + ["+2000"] * 3
+
+
+def test_log_transport_is_not_rate_limited(monkeypatch):
+    monkeypatch.setenv("SMS_RATE_PER_SECOND", "1")
+    dispatcher = SMSDispatcher.from_env(LogSMSTransport(), None)
+    started = time.monotonic()
+    results = _run(dispatcher, [SMSJob(f"s{i}", "+1555", "hi") for i in range(5)])
+    assert time.monotonic() - started < 0.5
+    assert len(results) == 5
+
+
+def test_stop_fails_jobs_it_could_not_send():
+    transport = BlockedTransport()
+    dispatcher = SMSDispatcher(transport, None, senders=["+1000"], workers=1, rate_per_sender=0)
+    results = {}
+    dispatcher.on_result = lambda sms_id, sid, error, attempts: results.setdefault(sms_id, error)
+
+    async def scenario():
+        for i in range(3):
+            dispatcher.enqueue(SMSJob(f"s{i}", "+1555", "hi"))
+        await asyncio.sleep(0.05)
+        await dispatcher.stop(timeout=0.1)
+
+    asyncio.run(scenario())
+    assert results == {f"s{i}": SHUTDOWN_ERROR for i in range(3)}
+
+
+def test_full_queue_answers_503(user_id):
+    import main
+    from services.sms_notif import sms_dispatcher
+
+    transport = BlockedTransport()
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(sms_dispatcher, "transport", transport)
+        patch.setattr(sms_dispatcher, "max_queue", 1)
+        patch.setattr(sms_dispatcher, "_buckets", {})
+        with TestClient(main.app) as client:
+            statuses = [
+                client.post("/sms/send", json={"user_id": user_id, "to": "+1555", "body": "hi"}).status_code
+                for _ in range(sms_dispatcher.worker_count + 2)
+            ]
+            # Every worker holds one message and one more waits in the queue
+            assert statuses == [200] * (sms_dispatcher.worker_count + 1) + [503]
+            logs = client.get(f"/sms/logs/{user_id}").json()["logs"]
+            assert len(logs) == sms_dispatcher.worker_count + 1
+            client.portal.call(transport.release.set)
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+import asyncio
+
+from database.models import InAppNotification
+from database.persistence import SQLPersistence, writer
+from database.records import InAppRecord, to_micros
+from database.store import InAppNotificationStore
+
+START = datetime(2024, 1, 1)
+
+
+def _records(user_id, count):
+    return [{
+        "id": f"{user_id}-{i:03d}",
+        "user_id": user_id,
+        "title": f"t{i}",
+        "message": "m",
+        "notification_type": "info",
+        "link": None,
+        "read": False,
+        "created_at": START + timedelta(minutes=i),
+    } for i in range(count)]
+
+
+def _store(recent_per_user=3):
+    return InAppNotificationStore(InAppRecord, SQLPersistence(InAppNotification), recent_per_user=recent_per_user)
+
+
+def _stored_history(user_id, count):
+    """Persist count records, then return a fresh store that has not read the user yet"""
+    _store().add_many(_records(user_id, count))
+    writer.flush()
+    return _store()
+
+
+async def _all_ids(store, user_id, limit, newest_first):
+    ids, cursor = [], None
+    while True:
+        if newest_first:
+            records, cursor = await store.page(user_id, limit, before=cursor, newest_first=True)
+        else:
+            records, cursor = await store.page(user_id, limit, after=cursor, newest_first=False)
+        ids += [r["id"] for r in records]
+        if cursor is None:
+            return ids
+
+
+def test_pages_span_memory_and_database(user_id):
+    store = _stored_history(user_id, 10)
+    expected = [r["id"] for r in _records(user_id, 10)]
+
+    async def scenario():
+        assert await _all_ids(store, user_id, 4, newest_first=True) == expected[::-1]
+        assert await _all_ids(store, user_id, 4, newest_first=False) == expected
+        assert await store.count(user_id) == 10
+
+    asyncio.run(scenario())
+    assert len(store) == 3
+
+
+def test_filtered_pages_skip_other_records(user_id):
+    store = _stored_history(user_id, 10)
+
+    async def scenario():
+        for i in (1, 4, 8):
+            await store.mark_read(f"{user_id}-{i:03d}")
+        records, cursor = await store.page(user_id, 10, filters={"read": True})
+        assert [r["id"] for r in records] == [f"{user_id}-{i:03d}" for i in (8, 4, 1)]
+        assert cursor is None
+
+    asyncio.run(scenario())
+
+
+def test_trim_keeps_counts(user_id):
+    store = _store()
+    store.add_many(_records(user_id, 10))
+    writer.flush()
+    assert store.trim(to_micros(datetime.now())) == 7
+
+    async def scenario():
+        assert await store.count(user_id) == 10
+        assert await store.unread_count(user_id) == 10
+        assert len(await _all_ids(store, user_id, 4, newest_first=True)) == 10
+
+    asyncio.run(scenario())
+
+
+def test_unread_count_follows_changes_to_older_records(user_id):
+    store = _stored_history(user_id, 10)
+
+    async def scenario():
+        assert await store.unread_count(user_id) == 10
+        # The oldest records are only on disk
+        await store.mark_read(f"{user_id}-000")
+        assert await store.unread_count(user_id) == 9
+        await store.mark_read(f"{user_id}-009")
+        assert await store.unread_count(user_id) == 8
+        await store.delete(f"{user_id}-001")
+        assert await store.unread_count(user_id) == 7
+        assert await store.count(user_id) == 9
+        assert await store.mark_all_read(user_id) == 7
+        assert await store.unread_count(user_id) == 0
+        writer.flush()
+        assert await _store().unread_count(user_id) == 0
+
+    asyncio.run(scenario())
+
+
+def test_version_changes_with_every_change(user_id):
+    store = _store()
+    records = _records(user_id, 2)
+
+    async def scenario():
+        seen = {await store.version(user_id)}
+        store.add(records[0])
+        seen.add(await store.version(user_id))
+        await store.mark_read(records[0]["id"])
+        seen.add(await store.version(user_id))
+        store.update(records[0]["id"], title="renamed")
+        seen.add(await store.version(user_id))
+        await store.delete(records[0]["id"])
+        seen.add(await store.version(user_id))
+        assert len(seen) == 5
+
+        unchanged = await store.version(user_id)
+        await store.page(user_id, 10)
+        await store.unread_count(user_id)
+        assert await store.version(user_id) == unchanged
+
+    asyncio.run(scenario())
@@ -0,0 +1,110 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from services.templates import (
+    SMS_MAX_SEGMENTS, TemplateCache, TemplateRenderError, check_sms_length, sms_segments, template_registry
+)
+
+
+@pytest.fixture
+def client():
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _send(client, user_id, template_id, **variables):
+    return client.post("/email/send_email", json={
+        "user_id": user_id, "email": "a@example.com", "template_id": template_id, "variables": variables,
+    })
+
+
+def _sent_body(client, user_id, template_id, **variables):
+    from services.e_notif import email_notifications_db
+
+    response = _send(client, user_id, template_id, **variables)
+    assert response.status_code == 200
+    return email_notifications_db.get(response.json()["notification_id"])["body"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("", ("GSM-7", 1)),
+    ("a" * 160, ("GSM-7", 1)),
+    ("a" * 161, ("GSM-7", 2)),
+    ("a" * 306, ("GSM-7", 2)),
+    ("a" * 307, ("GSM-7", 3)),
+    ("€" * 80, ("GSM-7", 1)),
+    ("€" * 81, ("GSM-7", 2)),
+    ("ж" * 70, ("UCS-2", 1)),
+    ("ж" * 71, ("UCS-2", 2)),
+    ("ж" * 134, ("UCS-2", 2)),
+    ("ж" * 135, ("UCS-2", 3)),
+    ("a" * 100 + "ж", ("UCS-2", 2)),
+    ("🙂" * 35, ("UCS-2", 1)),
+    ("🙂" * 36, ("UCS-2", 2)),
+])
+def test_sms_segments(text, expected):
+    assert sms_segments(text) == expected
+
+
+def test_sms_length_limit():
+    check_sms_length("a" * 153 * SMS_MAX_SEGMENTS)
+    with pytest.raises(TemplateRenderError):
+        check_sms_length("a" * (153 * SMS_MAX_SEGMENTS + 1))
+
+
+def test_sms_over_the_segment_limit_is_rejected(client, user_id):
+    body = "a" * (153 * SMS_MAX_SEGMENTS + 1)
+    response = client.post("/sms/send", json={"user_id": user_id, "to": "+1555", "body": body})
+    assert response.status_code == 422
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TemplateCache(maxsize=2)
+    templates = [{"id": name, "channel": "sms", "body": name} for name in "abc"]
+    cache.get(templates[0], "body")
+    cache.get(templates[1], "body")
+    cache.get(templates[0], "body")
+    cache.get(templates[2], "body")
+    assert (cache.hits, cache.misses) == (1, 3)
+    cache.get(templates[0], "body")
+    assert cache.hits == 2
+    cache.get(templates[1], "body")
+    assert cache.misses == 4
+
+
+def test_update_and_delete_invalidate_the_compiled_template(client, user_id):
+    created = client.post("/templates", json={
+        "channel": "email", "subject": "Hello", "body": "<p>Hi {{ name }}</p>",
+    }).json()
+    template_id = created["id"]
+    assert _sent_body(client, user_id, template_id, name="<b>Ann</b>") == "<p>Hi &lt;b&gt;Ann&lt;/b&gt;</p>"
+    misses = template_registry.cache.misses
+    _sent_body(client, user_id, template_id, name="Ann")
+    assert template_registry.cache.misses == misses
+
+    updated = client.put(f"/templates/{template_id}", json={"body": "<p>Bye {{ name }}</p>"}).json()
+    assert updated["version"] == 2
+    assert _sent_body(client, user_id, template_id, name="Ann") == "<p>Bye Ann</p>"
+
+    assert client.delete(f"/templates/{template_id}").status_code == 200
+    response = _send(client, user_id, template_id, name="Ann")
+    assert response.status_code == 422
+    assert template_id in response.json()["detail"]
+    assert (template_id, "body") not in template_registry.cache._entries
+
+
+def test_undefined_variables_are_rejected(client, user_id):
+    template_id = client.post("/templates", json={
+        "channel": "email", "subject": "For {{ name }}", "body": "{{ amount + 1 }}",
+    }).json()["id"]
+    assert _send(client, user_id, template_id, amount=1).status_code == 422
+    assert _send(client, user_id, template_id, name="Ann").status_code == 422
+    assert _send(client, user_id, template_id, name="Ann", amount="one").status_code == 422
+    assert _sent_body(client, user_id, template_id, name="Ann", amount=1) == "2"
+
+
+def test_invalid_template_source_is_rejected(client):
+    response = client.post("/templates", json={"channel": "sms", "body": "Hi {{ name"})
+    assert response.status_code == 422